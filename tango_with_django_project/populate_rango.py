@@ -4,8 +4,11 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tango_with_django_project.setti
 import django
 django.setup()
 
+from rango.bulk import CatalogueImporter
 from rango.models import Category, Page
 
+# Rows collected by add_page() for the bulk importer.
+pages = []
 
 def populate():
     python_cat = add_cat('Python', 128, 64)
@@ -54,17 +57,15 @@ def populate():
         url="http://flask.pocoo.org",
         views=4321)
 
+    # Load the pages in one go, updating any that are already there.
+    CatalogueImporter(upsert=True).run(pages)
+
     # Print out what we have added to the user.
-    for c in Category.objects.all():
-        for p in Page.objects.filter(category=c):
-            print "- {0} - {1}".format(str(c), str(p))
+    for category, title in Page.objects.values_list('category__name', 'title').order_by('category__name', 'id'):
+        print "- {0} - {1}".format(category.encode('utf-8'), title.encode('utf-8'))
 
 def add_page(cat, title, url, views=0):
-    p = Page.objects.get_or_create(category=cat, title=title)[0]
-    p.url = url
-    p.views = views
-    p.save()
-    return p
+    pages.append({'category': cat.name, 'title': title, 'url': url, 'views': views})
 
 def add_cat(name, views=0, likes=0):
     c = Category.objects.get_or_create(name=name)[0]
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class RangoConfig(AppConfig):
+    name = 'rango'
+    verbose_name = 'Rango'
+
+    def ready(self):
+        #Importing these modules connects their signal receivers.
+        from rango import counters, freshness, leaderboards, search_cache, sidebar, suggest
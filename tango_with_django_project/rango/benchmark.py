@@ -0,0 +1,287 @@
+"""
+Load benchmark for the rango endpoints, see `manage.py bench_rango`.
+
+A synthetic catalogue is added to the configured database: categories
+named "bench-..." whose sizes, page views and likes all follow Zipf-like
+distributions, so a few are huge and hot and most are small and cold.
+Requests go through the project's real WSGI application in this process,
+middleware included, from concurrent clients. Queries per request come
+from rango.metrics.
+"""
+import bisect
+import platform
+import random
+import threading
+from collections import OrderedDict
+from importlib import import_module
+from timeit import default_timer
+
+import django
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.utils.six import BytesIO
+
+from rango import metrics
+from rango.bulk import IN_CHUNK_SIZE, CatalogueImporter
+from rango.models import Category, Page
+
+PREFIX = 'bench-'
+WORDS = ('python django rango tango web search cache index query page category like view '
+         'tutorial guide recipe music film travel garden history science sport news code '
+         'data cloud mobile design photo game book art health food').split()
+
+#Endpoint -> the URL name rango.metrics files its requests under.
+ENDPOINTS = OrderedDict([
+    ('index', 'index'),
+    ('category', 'category'),
+    ('suggest_category', 'suggest_category'),
+    ('track_url', 'goto'),
+    ('like_category', 'like_category'),
+    ('search', 'haystack_search'),
+])
+
+
+class Zipf(object):
+    """Draws ranks 0..n-1, rank r with probability proportional to 1 / (r + 1) ** s."""
+
+    def __init__(self, n, s=1.1):
+        self.cumulative = []
+        total = 0.0
+        for rank in range(n):
+            total += 1.0 / (rank + 1) ** s
+            self.cumulative.append(total)
+
+    def draw(self, rng):
+        return bisect.bisect_left(self.cumulative, rng.random() * self.cumulative[-1])
+
+
+def synthetic_rows(pages, categories, seed=0):
+    """`pages` catalogue rows over `categories` categories, sizes and views skewed."""
+    rng = random.Random(seed)
+    sizes = Zipf(categories)
+    views = Zipf(max(pages, 1))
+    for n in range(pages):
+        category = sizes.draw(rng)
+        title = ' '.join(rng.choice(WORDS) for i in range(3))
+        yield {'category': '%s%s %d' % (PREFIX, WORDS[category % len(WORDS)], category),
+               'title': '%s %d' % (title, n),
+               'url': 'http://example.com/%d/%d' % (category, n),
+               #A few pages get most of the views.
+               'views': pages // (views.draw(rng) + 1)}
+
+
+def generate(pages, categories=None, seed=0, progress=None):
+    """
+    Add a synthetic catalogue of `pages` pages unless the same one is there
+    already, with Zipf distributed likes on its categories. Returns
+    (categories, pages) in it.
+    """
+    categories = categories or max(int(pages ** 0.5), 1)
+    bench = Category.objects.filter(name__startswith=PREFIX)
+    if Page.objects.filter(category__in=bench).count() != pages:
+        remove()
+        CatalogueImporter(batch_size=5000, progress=progress).run(synthetic_rows(pages, categories, seed))
+        rng = random.Random(seed)
+        ids = list(bench.order_by('id').values_list('id', flat=True))
+        rng.shuffle(ids)
+        for rank, category_id in enumerate(ids):
+            Category.objects.filter(id=category_id).update(likes=1000 // (rank + 1))
+    return bench.count(), Page.objects.filter(category__in=bench).count()
+
+
+def remove():
+    """
+    Drop the synthetic catalogue. Its pages go in plain DELETE statements,
+    loading up to a million of them to send delete signals would take longer
+    than the benchmark.
+    """
+    bench = list(Category.objects.filter(name__startswith=PREFIX).values_list('id', flat=True))
+    for start in range(0, len(bench), IN_CHUNK_SIZE):
+        chunk = bench[start:start + IN_CHUNK_SIZE]
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+                connection.ops.quote_name(Page._meta.db_table),
+                connection.ops.quote_name(Page._meta.get_field('category').column),
+                ', '.join(['%s'] * len(chunk))), chunk)
+        Category.objects.filter(id__in=chunk).delete()
+
+
+class Workload(object):
+    """The requests to send, drawn the way real traffic would be skewed."""
+
+    def __init__(self, seed=0, search_terms=None):
+        self.rng = random.Random(seed)
+        bench = Category.objects.filter(name__startswith=PREFIX)
+        #Most liked first, which is also how popular they are.
+        categories = list(bench.order_by('-likes').values_list('id', 'slug', 'name'))
+        if not categories:
+            raise ValueError('There is no synthetic catalogue, see generate().')
+        self.categories = categories
+        self.category_ranks = Zipf(len(categories))
+        self.page_ids = list(Page.objects.filter(category__in=bench).order_by('-views')
+                             .values_list('id', flat=True)[:10000])
+        self.page_ranks = Zipf(len(self.page_ids))
+        self.terms = search_terms or WORDS
+
+    def category(self):
+        return self.categories[self.category_ranks.draw(self.rng)]
+
+    def request(self, endpoint):
+        """(path, query string) for one request to `endpoint`."""
+        if endpoint == 'index':
+            return '/rango/', ''
+        if endpoint == 'category':
+            return '/rango/category/%s/' % self.category()[1], ''
+        if endpoint == 'suggest_category':
+            name = self.category()[2]
+            prefix = name[:len(PREFIX) + self.rng.randint(1, 4)]
+            return '/rango/suggest_category/', 'suggestion=%s' % prefix.replace(' ', '+')
+        if endpoint == 'track_url':
+            return '/rango/goto/', 'page_id=%d' % self.page_ids[self.page_ranks.draw(self.rng)]
+        if endpoint == 'like_category':
+            return '/rango/like_category/', 'category_id=%d' % self.category()[0]
+        if endpoint == 'search':
+            return '/search/', 'q=%s' % self.rng.choice(self.terms)
+        raise ValueError('Unknown endpoint %r.' % endpoint)
+
+
+def session_cookie(username='bench-user'):
+    """A cookie for a logged in session of a benchmark user, like Client.login() makes."""
+    user, created = User.objects.get_or_create(username=username)
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore()
+    session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return '%s=%s' % (settings.SESSION_COOKIE_NAME, session.session_key)
+
+
+def wsgi_get(app, path, query='', cookie=''):
+    """GET path through the WSGI app, reading the whole body. Returns (status, bytes)."""
+    hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')]
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SCRIPT_NAME': '',
+        'SERVER_NAME': hosts[0] if hosts else 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': hosts[0] if hosts else 'localhost',
+        'HTTP_ACCEPT_ENCODING': 'gzip',
+        'HTTP_COOKIE': cookie,
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': BytesIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+    body = app(environ, lambda s, headers, exc_info=None: status.append(s))
+    try:
+        size = sum(len(chunk) for chunk in body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return int(status[0].split(' ', 1)[0]), size
+
+
+def percentile(timings, fraction):
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)] if timings else 0.0
+
+
+def run_endpoint(app, workload, endpoint, requests, clients, cookie=''):
+    """
+    Send `requests` requests to `endpoint` from `clients` concurrent
+    clients. Returns its report, a dict.
+    """
+    #Draw the requests up front so every client's share is fixed and the
+    #random generator is only used from this thread.
+    plan = [workload.request(endpoint) for i in range(requests)]
+    timings, errors = [], [0]
+    lock = threading.Lock()
+    metrics.reset()
+
+    def client(share):
+        mine, failed = [], 0
+        try:
+            for path, query in share:
+                started = default_timer()
+                status, size = wsgi_get(app, path, query, cookie)
+                mine.append(default_timer() - started)
+                failed += status >= 400
+        finally:
+            if threading.current_thread() is not main:
+                connection.close()
+        with lock:
+            timings.extend(mine)
+            errors[0] += failed
+
+    main = threading.current_thread()
+    began = default_timer()
+    if clients <= 1:
+        client(plan)
+    else:
+        threads = [threading.Thread(target=client, args=(plan[n::clients],)) for n in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = default_timer() - began
+
+    timings.sort()
+    report = OrderedDict([
+        ('requests', len(timings)),
+        ('errors', errors[0]),
+        ('seconds', round(elapsed, 4)),
+        ('throughput', round(len(timings) / elapsed, 2) if elapsed else 0.0),
+        ('latency_ms', OrderedDict([
+            ('mean', round(1000 * sum(timings) / len(timings), 3) if timings else 0.0),
+            ('p50', round(1000 * percentile(timings, 0.5), 3)),
+            ('p95', round(1000 * percentile(timings, 0.95), 3)),
+            ('p99', round(1000 * percentile(timings, 0.99), 3)),
+            ('max', round(1000 * timings[-1], 3) if timings else 0.0),
+        ])),
+    ])
+    stats = metrics.snapshot().get(ENDPOINTS[endpoint])
+    if stats is not None and stats.requests:
+        queries = stats.histograms['queries']
+        report['queries_per_request'] = OrderedDict([
+            ('mean', round(float(queries.sum) / queries.count, 2)),
+            ('p95', round(queries.quantile(0.95), 2)),
+        ])
+    else:
+        #MetricsMiddleware isn't installed.
+        report['queries_per_request'] = None
+    return report
+
+
+def run(endpoints=None, requests=200, clients=4, seed=0, search_terms=None):
+    """Benchmark `endpoints` (all by default) on the synthetic catalogue, returns the report."""
+    app = get_wsgi_application()
+    workload = Workload(seed, search_terms)
+    cookie = session_cookie()
+    report = OrderedDict([
+        ('environment', OrderedDict([
+            ('python', platform.python_version()),
+            ('django', django.get_version()),
+            ('database', connection.vendor),
+            ('debug', settings.DEBUG),
+        ])),
+        ('categories', len(workload.categories)),
+        ('pages', Page.objects.filter(category__name__startswith=PREFIX).count()),
+        ('clients', clients),
+        ('endpoints', OrderedDict()),
+    ])
+    for endpoint in endpoints or ENDPOINTS:
+        #Only liking needs a login, everything else is browsed anonymously.
+        report['endpoints'][endpoint] = run_endpoint(app, workload, endpoint, requests, clients,
+                                                     cookie if endpoint == 'like_category' else '')
+    return report
@@ -1,65 +1,27 @@
 #NOTE THIS IS OLD, NEW SEARCH USES ELASTIC#
-import requests
-import sys
 from keys import BING_API_KEY
+from rango.websearch import RevalidatingCache, WebSearchClient, CACHE_SIZE, CACHE_TTL, STALE_TTL
+
+#One pooled client for the whole process, see rango.websearch.
+client = WebSearchClient(key=BING_API_KEY)
+#Every call costs money, answers are shared between users for a while.
+cache = RevalidatingCache(lambda terms: client.search(terms), CACHE_SIZE, CACHE_TTL, STALE_TTL)
 
 def run_query(search_terms):
-    #Specify the base
-    root_url = 'https://api.datamarket.azure.com/Bing/Search/v1/'
-    source = 'Web'
-    username = ''
-    
-    #Specify how many results we wish to be returned per page.
-    #Offset specifies where in the results list to start from.
-    results_per_page = 10
-    offset = 0
-    
-    #Wrap quotes around our query terms as required by the Bing API.
-    #The query we will then use is stored within variable query.
-    query = "'{0}'".format(search_terms.replace(" ", "%20"))
-    
-    #Construct the latter part of our request's URL.
-    #Set the format of the response to json and sets other properties.
-    search_url = "{0}{1}?Query=%27{4}%27&$format=json&$top={2}&$skip={3}".format(
-        root_url,
-        source,
-        results_per_page,
-        offset,
-        query)
-    
-    #Create our results list
-    results = []
-    
-    try:
-        
-        #Connect to the server and read the response generated as JSON
-        json_response = requests.get(search_url, auth=(username, BING_API_KEY)).json()
-        
-        
-        #Loop through each page returned, populating out results list.
-        for result in json_response['d']['results']:
-            results.append({
-            'title': result['Title'],
-            'link': result['Url'],
-            'summary': result['Description']})
-        
-    except requests.exceptions.RequestException as e:
-        print 'Error when querying'
-        print e
-        sys.exit(1)
-    
-    #Return the list of results so the calling function.
-    return results
+    #Returns a list of {'title', 'link', 'summary'} dicts. Pages that could
+    #not be fetched are listed in its .errors rather than stopping the process.
+    return cache.get(search_terms)
 
 def main():
     results = run_query(raw_input("Search Query\n:>"))
-    
+
     for result in results:
         print "Title  - " + result['title']
         print "URL - " + result['link']
         print "Summary - " + result['summary']
 
+    for error in results.errors:
+        print "Error - " + error
+
 if __name__ == '__main__':
     main()
-    
-    
\ No newline at end of file
@@ -0,0 +1,299 @@
+import csv
+import io
+import json
+import os
+import time
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Case, IntegerField, URLField, Value, When
+from django.utils import six, timezone
+from django.utils.dateparse import parse_datetime
+
+from rango.counters import PAGE_URL_KEY
+from rango.freshness import touch_pages
+from rango.models import Category, Page, SearchQueueEntry
+
+#Keeps IN (...) lists under SQLite's limit of 999 bound parameters.
+IN_CHUNK_SIZE = 400
+
+
+def read_rows(path, format=None):
+    """
+    Stream dicts out of a CSV (with a header row) or JSON lines file, or
+    stdin when path is '-'. The format defaults to the file extension.
+    """
+    format = format or os.path.splitext(path)[1].lstrip('.').lower()
+    if format not in ('csv', 'jsonl'):
+        raise ValueError('Unknown format %r, use csv or jsonl.' % format)
+
+    if path == '-':
+        stream = io.open(0, 'rb', closefd=False)
+    else:
+        stream = io.open(path, 'rb')
+    with stream:
+        if format == 'jsonl':
+            for line in stream:
+                line = line.strip()
+                if line:
+                    yield json.loads(line.decode('utf-8'))
+        elif six.PY2:
+            for row in csv.DictReader(stream):
+                yield dict((k.decode('utf-8'), v.decode('utf-8') if v is not None else None)
+                           for k, v in row.items())
+        else:
+            for row in csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline='')):
+                yield row
+
+
+class CatalogueImporter(object):
+    """
+    Loads category/title/url/views rows into Page in batches.
+
+    Categories are resolved through a name -> id map loaded once up front;
+    new ones are saved normally so the rest of rango hears about them.
+    Pages go in with bulk_create, one transaction per batch. With upsert
+    a page whose (category, title) already exists gets its url and views
+    updated instead of a duplicate row.
+
+    With a checkpoint file the number of rows committed so far is recorded
+    after every batch, and a rerun over the same source skips them.
+    """
+
+    def __init__(self, batch_size=1000, upsert=False, checkpoint=None, progress=None):
+        self.batch_size = batch_size
+        self.upsert = upsert
+        self.checkpoint = checkpoint
+        self.progress = progress
+        self.category_ids = None
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'skipped': 0, 'categories': 0, 'seconds': 0.0}
+
+    def run(self, rows, source=None):
+        started = time.time()
+        self.category_ids = dict(Category.objects.values_list('name', 'id'))
+        done = self.load_checkpoint(source)
+
+        batch = []
+        for position, row in enumerate(rows, 1):
+            if position <= done:
+                continue
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                self.save_checkpoint(source, position)
+                self.report(started)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+            self.save_checkpoint(source, position)
+
+        self.stats['seconds'] = time.time() - started
+        self.report(started)
+        return self.stats
+
+    def import_batch(self, rows):
+        #rango.search_queue imports this module, so it can't be imported at the top.
+        from rango import search_queue
+
+        pages = {}
+        for row in rows:
+            page = self.clean(row)
+            if page is None:
+                self.stats['skipped'] += 1
+            else:
+                #The last row wins if a batch repeats a page.
+                pages[(page['category'], page['title'])] = page
+        self.stats['rows'] += len(rows)
+
+        with transaction.atomic():
+            for name in set(category for category, title in pages):
+                if name not in self.category_ids:
+                    category = Category(name=name)
+                    category.save()
+                    self.category_ids[name] = category.id
+                    self.stats['categories'] += 1
+
+            existing = self.existing_pages(pages) if self.upsert else {}
+            new, changed = {}, []
+            for key, page in pages.items():
+                if key in existing:
+                    page_id, url, views = existing[key]
+                    if (url, views) != (page['url'], page['views']):
+                        changed.append((page_id, page))
+                else:
+                    new[key] = Page(category_id=self.category_ids[page['category']], title=page['title'],
+                                    url=page['url'], views=page['views'])
+            Page.objects.bulk_create(new.values(), batch_size=IN_CHUNK_SIZE)
+            self.update_pages(changed)
+
+            #bulk_create and update() send no signals, so the search index
+            #has to be told here. SQLite gives bulk_create no ids back.
+            created = self.existing_pages(new) if new else {}
+            search_queue.enqueue_many(Page, [page_id for page_id, url, views in created.values()] +
+                                            [page_id for page_id, page in changed], SearchQueueEntry.UPDATE)
+            #Likewise the category pages' validators, see rango.freshness.
+            touch_pages(set(self.category_ids[category] for category, title in new) |
+                        set(self.category_ids[page['category']] for page_id, page in changed))
+
+        self.stats['created'] += len(new)
+        self.stats['updated'] += len(changed)
+        #Updated urls must not be served from the goto url cache.
+        cache.delete_many([PAGE_URL_KEY % page_id for page_id, page in changed])
+
+    def update_pages(self, changed):
+        """One UPDATE ... SET col = CASE id WHEN ... per chunk of changed pages."""
+        #Each page binds five parameters here.
+        step = IN_CHUNK_SIZE // 5
+        for i in range(0, len(changed), step):
+            chunk = changed[i:i + step]
+            Page.objects.filter(id__in=[page_id for page_id, page in chunk]).update(
+                url=Case(*[When(id=page_id, then=Value(page['url'])) for page_id, page in chunk],
+                         output_field=URLField()),
+                views=Case(*[When(id=page_id, then=Value(page['views'])) for page_id, page in chunk],
+                           output_field=IntegerField()),
+                modified=timezone.now())
+
+    def existing_pages(self, pages):
+        """Map (category name, title) -> (page id, url, views) for the pages already stored."""
+        names = dict((category_id, name) for name, category_id in self.category_ids.items())
+        keys = list(pages)
+        found = {}
+        for i in range(0, len(keys), IN_CHUNK_SIZE):
+            chunk = keys[i:i + IN_CHUNK_SIZE]
+            rows = Page.objects.filter(
+                category_id__in=set(self.category_ids[name] for name, title in chunk),
+                title__in=set(title for name, title in chunk)).values_list('id', 'category_id', 'title', 'url', 'views')
+            for page_id, category_id, title, url, views in rows:
+                key = (names[category_id], title)
+                if key in pages:
+                    found[key] = (page_id, url, views)
+        return found
+
+    def clean(self, row):
+        category = (row.get('category') or '').strip()
+        title = (row.get('title') or '').strip()
+        url = (row.get('url') or '').strip()
+        if not (category and title and url):
+            return None
+        try:
+            views = int(row.get('views') or 0)
+        except (TypeError, ValueError):
+            return None
+        return {'category': category[:128], 'title': title[:128], 'url': url[:200], 'views': max(views, 0)}
+
+    def load_checkpoint(self, source):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        if state.get('source') != source:
+            return 0
+        return state.get('rows', 0)
+
+    def save_checkpoint(self, source, rows):
+        if not self.checkpoint:
+            return
+        #Write then rename, a crash mid-write must not lose the old checkpoint.
+        tmp = self.checkpoint + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'source': source, 'rows': rows}, f)
+        os.rename(tmp, self.checkpoint)
+
+    def report(self, started):
+        if self.progress:
+            elapsed = max(time.time() - started, 1e-6)
+            self.progress(self.stats, self.stats['rows'] / elapsed)
+
+
+#Columns of a CSV export. Category rows use name/slug/likes, page rows use
+#title/url, and category is the category name on both so the page rows
+#can be fed straight back into import_rango.
+EXPORT_COLUMNS = ['type', 'id', 'category', 'name', 'slug', 'title', 'url', 'views', 'likes', 'modified']
+
+
+def chunked(queryset, fields, chunk_size=1000):
+    """
+    Yield queryset.values(*fields) in primary key order, fetching
+    chunk_size rows at a time with WHERE id > last seen id. Memory stays
+    flat however big the table is, on every backend.
+    """
+    last = 0
+    while True:
+        rows = queryset.filter(pk__gt=last).order_by('pk').values(*fields)[:chunk_size]
+        n = 0
+        for row in rows.iterator():
+            n += 1
+            last = row['id']
+            yield row
+        if n < chunk_size:
+            return
+
+
+def parse_since(value):
+    """An aware datetime from an ISO 8601 string, ValueError if it isn't one."""
+    since = parse_datetime(value)
+    if since is None:
+        raise ValueError('%r is not an ISO 8601 timestamp like 2015-09-01T00:00:00.' % value)
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def export_rows(category=None, since=None, chunk_size=1000):
+    """
+    Every Category and then every Page as dicts, optionally only those of
+    the category with slug `category` and only rows modified at or after
+    `since`.
+    """
+    categories = Category.objects.all()
+    pages = Page.objects.all()
+    if category:
+        categories = categories.filter(slug=category)
+        pages = pages.filter(category__slug=category)
+    if since:
+        categories = categories.filter(modified__gte=since)
+        pages = pages.filter(modified__gte=since)
+
+    for row in chunked(categories, ['id', 'name', 'slug', 'views', 'likes', 'modified'], chunk_size):
+        row['type'] = 'category'
+        row['category'] = row['name']
+        yield row
+    for row in chunked(pages, ['id', 'category__name', 'title', 'url', 'views', 'modified'], chunk_size):
+        row['type'] = 'page'
+        row['category'] = row.pop('category__name')
+        yield row
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+class _Line(object):
+    #csv.writer wants something with write(), hand back what it writes.
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        values = []
+        for column in EXPORT_COLUMNS:
+            value = row.get(column)
+            if value is None:
+                value = ''
+            elif hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            if six.PY2 and isinstance(value, six.text_type):
+                value = value.encode('utf-8')
+            values.append(value)
+        yield writer.writerow(values)
+
+
+EXPORT_FORMATS = {
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
@@ -0,0 +1,170 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction, DatabaseError
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from rango.models import Page
+from rango.signals import counters_flushed
+
+logger = logging.getLogger(__name__)
+
+#SQLite refuses more than 999 bound parameters, so big flushes are chunked.
+UPDATE_CHUNK_SIZE = 500
+
+PAGE_URL_KEY = 'rango:page_url:%s'
+#Other processes' edits of a page's url are picked up after this long.
+PAGE_URL_TIMEOUT = getattr(settings, 'RANGO_PAGE_URL_TIMEOUT', 300)
+
+
+class BufferedCounter(object):
+    """
+    Write-behind counter for an integer column of a model.
+
+    incr() only touches an in-process dict. A background thread writes the
+    buffered increments every flush_interval seconds (or as soon as
+    flush_size clicks are waiting) as UPDATE ... SET col = col + n, one
+    statement per distinct n, so concurrent clicks are never lost.
+    stop() ends the thread and flushes whatever is left, it runs when the
+    process exits.
+    If touch names a timestamp column it is set to now on flushed rows.
+    """
+
+    def __init__(self, model, field, flush_interval=5, flush_size=100, touch=None):
+        self.model = model
+        self.field = field
+        self.touch = touch
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = defaultdict(int)
+        self._count = 0
+        self._flusher = None
+        self._stopping = False
+
+    def incr(self, pk, n=1):
+        with self._lock:
+            self._pending[pk] += n
+            self._count += n
+            full = self._count >= self.flush_size
+        self._start_flusher()
+        if full:
+            self._wake.set()
+
+    def pending(self, pk):
+        with self._lock:
+            return self._pending.get(pk, 0)
+
+    def flush(self):
+        """
+        Write all buffered increments to the db and return them as a
+        pk -> delta dict. On a db error the increments go back into the
+        buffer so the next flush can retry them.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            self._count = 0
+        if not pending:
+            return {}
+
+        #Group the pks by increment so each distinct n is one UPDATE.
+        by_delta = defaultdict(list)
+        for pk, n in pending.items():
+            by_delta[n].append(pk)
+
+        updates = {}
+        if self.touch:
+            updates[self.touch] = timezone.now()
+        try:
+            with transaction.atomic():
+                for n, pks in by_delta.items():
+                    updates[self.field] = F(self.field) + n
+                    for i in range(0, len(pks), UPDATE_CHUNK_SIZE):
+                        self.model.objects.filter(pk__in=pks[i:i + UPDATE_CHUNK_SIZE]).update(**updates)
+        except DatabaseError:
+            logger.exception('Flushing %s.%s failed, keeping %d increments buffered',
+                             self.model.__name__, self.field, len(pending))
+            with self._lock:
+                for pk, n in pending.items():
+                    self._pending[pk] += n
+                    self._count += n
+            return {}
+
+        counters_flushed.send(sender=self.model, field=self.field, deltas=dict(pending))
+        return dict(pending)
+
+    def _start_flusher(self):
+        if self._flusher is not None or self.flush_interval <= 0:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='rango-counter-flush')
+                self._flusher.daemon = True
+                self._flusher.start()
+
+    def stop(self):
+        """Stop the background thread, waiting for it, and write what is still buffered."""
+        self._stopping = True
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            if self._stopping:
+                #stop() writes the rest itself.
+                return
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Background flush of %s.%s failed', self.model.__name__, self.field)
+            finally:
+                #This thread owns its own connection, don't leave it open between flushes.
+                connection.close()
+
+
+page_views = BufferedCounter(
+    Page, 'views', touch='modified',
+    flush_interval=getattr(settings, 'RANGO_VIEW_FLUSH_INTERVAL', 5),
+    flush_size=getattr(settings, 'RANGO_VIEW_FLUSH_SIZE', 100))
+
+#Don't lose the clicks still sitting in the buffer when the worker shuts down,
+#and don't leave the thread running into the interpreter's teardown.
+atexit.register(page_views.stop)
+
+
+def page_url(page_id):
+    """
+    Return the url for page_id from the cache, falling back to a single
+    column lookup on a miss. Returns None if the page doesn't exist.
+    """
+    key = PAGE_URL_KEY % page_id
+    url = cache.get(key)
+    if url is None:
+        try:
+            url = Page.objects.values_list('url', flat=True).get(id=page_id)
+        except Page.DoesNotExist:
+            return None
+        cache.set(key, url, PAGE_URL_TIMEOUT)
+    return url
+
+
+@receiver(post_save, sender=Page)
+def cache_page_url(sender, instance, **kwargs):
+    cache.set(PAGE_URL_KEY % instance.pk, instance.url, PAGE_URL_TIMEOUT)
+
+
+@receiver(post_delete, sender=Page)
+def forget_page_url(sender, instance, **kwargs):
+    cache.delete(PAGE_URL_KEY % instance.pk)
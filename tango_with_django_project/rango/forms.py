@@ -4,6 +4,19 @@ from rango.models import Page, Category, UserProfile
 from registration.forms import RegistrationFormUniqueEmail
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit
+from haystack.forms import ModelSearchForm
+from rango.search_cache import normalise
+from rango.uploads import MAX_SIZE
+from django.template.defaultfilters import filesizeformat
+
+class PictureField(forms.ImageField):
+    #Refuses pictures over rango.uploads.MAX_SIZE before trying to read them.
+    def to_python(self, data):
+        if data is not None and getattr(data, 'size', 0) > MAX_SIZE:
+            raise forms.ValidationError(
+                'Pictures can be at most %s, this one is %s.' % (filesizeformat(MAX_SIZE), filesizeformat(data.size)),
+                code='too_large')
+        return super(PictureField, self).to_python(data)
 
 class CategoryForm(forms.ModelForm):
     name = forms.CharField(max_length=128, help_text="Please enter the category name.")
@@ -73,7 +86,7 @@ class UserProfileRegistrationForm(RegistrationFormUniqueEmail):
     website = forms.CharField(
         required=False)
         
-    picture = forms.ImageField(
+    picture = PictureField(
         required=False)
     
     def clean(self):
@@ -127,7 +140,7 @@ class EditProfileForm(forms.ModelForm):
         required=False, 
         label='Website')
     
-    picture = forms.ImageField(
+    picture = PictureField(
         widget=forms.ClearableFileInput(), 
         required=False, 
         label='Profile Picture')
@@ -154,6 +167,12 @@ class EditProfileForm(forms.ModelForm):
         self.helper.label_class = 'col-lg-2'
         self.helper.field_class = 'col-lg-8'
 
+class NormalisedSearchForm(ModelSearchForm):
+    
+    def clean_q(self):
+        #Equivalent queries are searched the same way, so they can share cached results.
+        return normalise(self.cleaned_data.get('q') or '')
+
 #class UserForm(forms.ModelForm):
 #    password = forms.CharField(widget=forms.PasswordInput())
 #    
@@ -0,0 +1,123 @@
+"""
+Validators for conditional GETs of the index and category pages.
+
+ETags and Last-Modified are worked out from stamps in the db, so every
+process agrees on them whichever one made the change: the category list's
+latest change, which both pages show in their sidebar, and for a
+category page its row, whose pages_modified every write to its pages
+moves, and its like shards. A client holding the current page gets a 304
+for those queries, before the view queries or renders. rango.page_cache
+reuses the ETags to tell which cached pages are still current.
+
+Page saves and deletes and the view counter's flushes move pages_modified
+through the receivers below, the importer calls touch_pages() itself.
+Category writes through update() set modified themselves, like
+compact_likes, and add_like sets its shard's. For deleted categories see
+rango.sidebar.
+
+The index's leaderboards are kept per process and see other processes'
+writes on their next reload, so its validators also cover what they hold.
+"""
+import hashlib
+from datetime import datetime
+
+from django.db.models import Max, Sum
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from rango.counters import UPDATE_CHUNK_SIZE
+from rango.leaderboards import top_categories, top_pages
+from rango.models import Category, Page
+from rango.signals import counters_flushed
+from rango.sidebar import list_state
+
+
+def _latest(*times):
+    times = [t for t in times if t is not None]
+    return max(times) if times else None
+
+
+def _board_changed(board):
+    #Leaderboards date their changes with time.time().
+    return datetime.fromtimestamp(board.changed_at, timezone.utc) if board.changed_at else None
+
+
+def _validators(request, name, compute):
+    #(ETag, Last-Modified) of a page, worked out once per request from what
+    #compute() returns, (what the page shows depends on, when it changed).
+    #The navigation also depends on being logged in, which a date can't
+    #tell apart, so only anonymous pages get a Last-Modified.
+    memo = request.__dict__.setdefault('_rango_validators', {})
+    if name not in memo:
+        parts, modified = compute()
+        authenticated = request.user.is_authenticated()
+        digest = hashlib.md5(repr((parts, authenticated)).encode('utf-8')).hexdigest()[:16]
+        memo[name] = ('%s-%s' % (name, digest), None if authenticated else modified)
+    return memo[name]
+
+
+def index_validators(request):
+    def compute():
+        listed = list_state()
+        boards = (top_categories.top(), top_pages.top())
+        return (listed, boards), _latest(listed, _board_changed(top_categories), _board_changed(top_pages))
+    return _validators(request, 'index', compute)
+
+
+def category_validators(request, category_name_slug):
+    def compute():
+        listed = list_state()
+        #The category's row by its slug, and its few like shards.
+        found = Category.objects.filter(slug=category_name_slug).aggregate(
+            modified=Max('modified'), pages=Max('pages_modified'),
+            liked=Max('categorylikeshard__modified'), likes=Sum('categorylikeshard__count'))
+        parts = (category_name_slug, listed, sorted(found.items()))
+        return parts, _latest(listed, found['modified'], found['pages'], found['liked'])
+    return _validators(request, 'category', compute)
+
+
+def index_etag(request):
+    return index_validators(request)[0]
+
+
+def index_last_modified(request):
+    return index_validators(request)[1]
+
+
+def category_etag(request, category_name_slug):
+    return category_validators(request, category_name_slug)[0]
+
+
+def category_last_modified(request, category_name_slug):
+    return category_validators(request, category_name_slug)[1]
+
+
+def touch_pages(category_ids):
+    """Date a change to the pages of these categories, for writers that send no signals."""
+    category_ids = list(category_ids)
+    now = timezone.now()
+    for i in range(0, len(category_ids), UPDATE_CHUNK_SIZE):
+        Category.objects.filter(id__in=category_ids[i:i + UPDATE_CHUNK_SIZE]).update(pages_modified=now)
+
+
+@receiver(pre_save, sender=Page)
+def page_moving(sender, instance, **kwargs):
+    #A page moved to another category changes the one it leaves too.
+    if instance.pk is not None:
+        Category.objects.filter(page__id=instance.pk).exclude(id=instance.category_id).update(
+            pages_modified=timezone.now())
+
+
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+def page_changed(sender, instance, **kwargs):
+    touch_pages([instance.category_id])
+
+
+@receiver(counters_flushed, sender=Page)
+def views_flushed(sender, field, deltas, **kwargs):
+    page_ids = list(deltas)
+    now = timezone.now()
+    for i in range(0, len(page_ids), UPDATE_CHUNK_SIZE):
+        Category.objects.filter(page__id__in=page_ids[i:i + UPDATE_CHUNK_SIZE]).update(pages_modified=now)
@@ -0,0 +1,245 @@
+"""
+A haystack engine that keeps the search documents in an SQLite FTS5 table,
+so small deployments and the tests don't need an Elasticsearch server.
+
+    HAYSTACK_CONNECTIONS = {
+        'default': {
+            'ENGINE': 'rango.fts_backend.FTSEngine',
+            'PATH': os.path.join(BASE_DIR, 'search.sqlite3'),
+        },
+    }
+
+Results are ranked by BM25. A term ending in * matches as a prefix
+(`pyth*`), "quoted words" as a phrase and -word excludes. Highlighting
+returns a snippet of the matching text with the terms in <em>.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import six
+from django.utils.encoding import force_text
+from haystack import connections
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query
+from haystack.constants import DJANGO_CT, DJANGO_ID, ID
+from haystack.exceptions import SearchBackendError, SkipDocument
+from haystack.inputs import Clean, PythonData
+from haystack.models import SearchResult
+from haystack.utils import get_identifier, get_model_ct
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    django_ct TEXT NOT NULL,
+    django_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_django_ct ON documents (django_ct);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    text, tokenize='unicode61 remove_diacritics 1', prefix='2 3'
+);
+"""
+
+#What is left of a term once FTS5 syntax is stripped out.
+TERM_RE = re.compile(r'[^\w*]+', re.UNICODE)
+NOT_RE = re.compile(r'NOT ("[^"]*"\*?)')
+
+
+class UnsupportedQuery(SearchBackendError):
+    """A query on a field other than the document field, which is all the FTS table holds."""
+
+
+class FTSSearchBackend(BaseSearchBackend):
+    """
+    Documents live in two tables of the database at PATH: `documents`
+    holds each one's id and prepared fields as JSON, and the FTS5 table
+    `documents_fts` the text of its document field under the same rowid.
+
+    Every thread gets its own connection. When PATH is replaced by another
+    file, as rango.reindex does, connections notice and reopen it.
+    """
+
+    def __init__(self, connection_alias, **connection_options):
+        super(FTSSearchBackend, self).__init__(connection_alias, **connection_options)
+        if 'PATH' not in connection_options:
+            raise ImproperlyConfigured("You must specify a 'PATH' in your settings for connection '%s'."
+                                       % connection_alias)
+        self.path = connection_options['PATH']
+        self.timeout = connection_options.get('TIMEOUT', 30)
+        self.log = logging.getLogger('haystack')
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        local = self._local
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            inode = None
+        if getattr(local, 'conn', None) is None or local.inode != inode:
+            if getattr(local, 'conn', None) is not None:
+                local.conn.close()
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            try:
+                conn.executescript(SCHEMA)
+            except sqlite3.OperationalError as e:
+                conn.close()
+                raise ImproperlyConfigured('Could not set up the search tables in %s: %s. '
+                                           'The FTS backend needs SQLite built with FTS5.' % (self.path, e))
+            local.conn = conn
+            local.inode = os.stat(self.path).st_ino
+        return local.conn
+
+    def update(self, index, iterable, commit=True):
+        content_field = index.get_content_field()
+        docs = []
+        for obj in iterable:
+            try:
+                docs.append(index.full_prepare(obj))
+            except SkipDocument:
+                self.log.debug(u'Indexing for object `%s` skipped', obj)
+
+        conn = self.conn
+        with conn:
+            for doc in docs:
+                text = force_text(doc.get(content_field) or '')
+                data = json.dumps(doc, cls=DjangoJSONEncoder)
+                row = conn.execute('SELECT rowid FROM documents WHERE id = ?', (doc[ID],)).fetchone()
+                if row is None:
+                    rowid = conn.execute('INSERT INTO documents (id, django_ct, django_id, data) VALUES (?, ?, ?, ?)',
+                                         (doc[ID], doc[DJANGO_CT], force_text(doc[DJANGO_ID]), data)).lastrowid
+                else:
+                    rowid = row[0]
+                    conn.execute('UPDATE documents SET data = ? WHERE rowid = ?', (data, rowid))
+                    conn.execute('DELETE FROM documents_fts WHERE rowid = ?', (rowid,))
+                conn.execute('INSERT INTO documents_fts (rowid, text) VALUES (?, ?)', (rowid, text))
+
+    def remove(self, obj_or_string, commit=True):
+        doc_id = get_identifier(obj_or_string)
+        conn = self.conn
+        with conn:
+            row = conn.execute('SELECT rowid FROM documents WHERE id = ?', (doc_id,)).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM documents_fts WHERE rowid = ?', row)
+                conn.execute('DELETE FROM documents WHERE rowid = ?', row)
+
+    def clear(self, models=None, commit=True):
+        conn = self.conn
+        with conn:
+            if not models:
+                conn.execute('DELETE FROM documents_fts')
+                conn.execute('DELETE FROM documents')
+                return
+            for model in models:
+                ct = get_model_ct(model)
+                conn.execute('DELETE FROM documents_fts WHERE rowid IN '
+                             '(SELECT rowid FROM documents WHERE django_ct = ?)', (ct,))
+                conn.execute('DELETE FROM documents WHERE django_ct = ?', (ct,))
+
+    @log_query
+    def search(self, query_string, start_offset=0, end_offset=None, highlight=False, models=None,
+               result_class=None, **kwargs):
+        if not query_string:
+            return {'results': [], 'hits': 0}
+
+        if not models:
+            models = connections[self.connection_alias].get_unified_index().get_indexed_models()
+        cts = sorted(get_model_ct(model) for model in models)
+        where = ['documents.django_ct IN (%s)' % ', '.join('?' * len(cts))]
+        params = list(cts)
+        if query_string == '*':
+            columns, column_params = '0.0, NULL', []
+            order = 'documents.rowid'
+        else:
+            #bm25() is lower for better matches.
+            if highlight:
+                columns = "bm25(documents_fts), snippet(documents_fts, 0, ?, ?, '...', 24)"
+                #The text comes from the autoescaped index templates, so the
+                #snippet is already safe HTML.
+                column_params = ['<em>', '</em>']
+            else:
+                columns, column_params = 'bm25(documents_fts), NULL', []
+            where.insert(0, 'documents_fts MATCH ?')
+            params.insert(0, query_string)
+            order = 'bm25(documents_fts), documents.rowid'
+        tables = 'documents_fts JOIN documents ON documents.rowid = documents_fts.rowid'
+        where = ' AND '.join(where)
+
+        limit = -1 if end_offset is None else max(end_offset - start_offset, 0)
+        try:
+            hits = self.conn.execute('SELECT COUNT(*) FROM %s WHERE %s' % (tables, where), params).fetchone()[0]
+            rows = self.conn.execute('SELECT documents.data, %s FROM %s WHERE %s ORDER BY %s LIMIT ? OFFSET ?' % (
+                columns, tables, where, order), column_params + params + [limit, start_offset]).fetchall()
+        except sqlite3.OperationalError as e:
+            #Mostly queries FTS5 can't parse, like a lone NOT.
+            if not self.silently_fail:
+                raise
+            self.log.error(u"Failed to query FTS5 using '%s': %s", query_string, e, exc_info=True)
+            return {'results': [], 'hits': 0}
+
+        result_class = result_class or SearchResult
+        results = []
+        for data, rank, snippet in rows:
+            doc = json.loads(data)
+            app_label, model_name = doc.pop(DJANGO_CT).split('.')
+            django_id = doc.pop(DJANGO_ID)
+            doc.pop(ID, None)
+            if snippet is not None:
+                doc['highlighted'] = {'text': [snippet]}
+            fields = dict((str(key), value) for key, value in doc.items())
+            results.append(result_class(app_label, model_name, django_id, -rank, **fields))
+        return {'results': results, 'hits': hits}
+
+    def more_like_this(self, model_instance, additional_query_string=None, start_offset=0, end_offset=None,
+                       limit_to_registered_models=None, result_class=None, **kwargs):
+        return {'results': [], 'hits': 0}
+
+
+class FTSSearchQuery(BaseSearchQuery):
+    """
+    Turns haystack queries on the document field into FTS5 query syntax.
+    Every term is quoted, so user input can't inject FTS5 operators.
+    """
+
+    def clean(self, query_fragment):
+        terms = []
+        for word in TERM_RE.split(query_fragment):
+            prefix = word.endswith('*')
+            word = word.strip('*')
+            if word:
+                terms.append(u'"%s"%s' % (word, '*' if prefix else ''))
+        return u' '.join(terms)
+
+    def build_exact_query(self, query_string):
+        return u'"%s"' % u' '.join(TERM_RE.split(query_string.replace('*', ' '))).strip()
+
+    def build_not_query(self, query_string):
+        return u'NOT %s' % query_string
+
+    def build_query_fragment(self, field, filter_type, value):
+        if field != 'content':
+            raise UnsupportedQuery('The FTS backend only searches the document field, not %r.' % field)
+        if not hasattr(value, 'input_type_name'):
+            value = Clean(value) if isinstance(value, six.string_types) else PythonData(value)
+        query = value.prepare(self)
+        if value.input_type_name == 'auto_query':
+            #FTS5's NOT is binary, so `-java python` has to become
+            #`("python") NOT "java"`.
+            excluded = NOT_RE.findall(query)
+            included = NOT_RE.sub('', query).strip()
+            if excluded and included:
+                query = u'(%s) %s' % (included, u' '.join(u'NOT %s' % term for term in excluded))
+        if filter_type == 'startswith' and value.post_process is not False:
+            query = u' '.join(term if term.endswith('*') else term + '*' for term in query.split())
+        return query
+
+
+class FTSEngine(BaseEngine):
+    backend = FTSSearchBackend
+    query = FTSSearchQuery
@@ -0,0 +1,184 @@
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from rango.models import Category, Page
+from rango.signals import counters_flushed
+
+SIZE = getattr(settings, 'RANGO_LEADERBOARD_SIZE', 5)
+#Other processes' writes only reach this one through the db, so every
+#board is reloaded at least this often.
+MAX_AGE = getattr(settings, 'RANGO_LEADERBOARD_MAX_AGE', 60)
+
+#What the index template shows; page.category is the category's name.
+CategoryEntry = namedtuple('CategoryEntry', 'id name slug likes')
+PageEntry = namedtuple('PageEntry', 'id title url views category_id category')
+
+
+class Leaderboard(object):
+    """
+    The top `size` rows of a table by one integer column, kept in memory.
+
+    It is loaded from the db when first read (and again after max_age
+    seconds) and then patched in place from saves, deletes and counter
+    flushes. Changes that could let an unseen row climb onto the board,
+    like a member losing points or being deleted, just drop it so the
+    next read reloads.
+    """
+
+    def __init__(self, score, load, size=5, max_age=60):
+        self.score = score
+        self.size = size
+        self.max_age = max_age
+        self._load = load
+        self._lock = threading.Lock()
+        self._top = None
+        self._loaded_at = 0
+        self._shown = None
+        self._changed_at = 0
+
+    def top(self):
+        top = self._top
+        if top is None or time.time() - self._loaded_at > self.max_age:
+            with self._lock:
+                if self._top is None or time.time() - self._loaded_at > self.max_age:
+                    self._set(self._load(self.size))
+                    self._loaded_at = time.time()
+                top = self._top
+        return top
+
+    @property
+    def changed_at(self):
+        """When the entries last changed, reloads that found them the same aside."""
+        return self._changed_at
+
+    def invalidate(self):
+        self._top = None
+
+    def offer(self, entry):
+        """A row was saved with the values in entry."""
+        with self._lock:
+            top = self._top
+            if top is None:
+                return
+            others = [e for e in top if e.id != entry.id]
+            if len(others) < len(top):
+                old = [e for e in top if e.id == entry.id][0]
+                if self._score(entry) < self._score(old) and len(top) >= self.size:
+                    self._top = None
+                    return
+            elif len(top) >= self.size and self._rank(entry) > self._rank(top[-1]):
+                return
+            self._store(others + [entry])
+
+    def discard(self, pk):
+        """The row pk was deleted."""
+        with self._lock:
+            if self._top is not None and any(e.id == pk for e in self._top):
+                self._top = None
+
+    def add(self, deltas):
+        """Scores went up by the pk -> delta amounts in deltas."""
+        with self._lock:
+            top = self._top
+            if top is None:
+                return
+            board = set(e.id for e in top)
+            top = [e._replace(**{self.score: self._score(e) + deltas[e.id]}) if e.id in board and e.id in deltas
+                   else e for e in top]
+            outsiders = [pk for pk in deltas if pk not in board]
+            if outsiders:
+                floor = self._score(min(top, key=self._score)) if len(top) >= self.size else None
+                top += self._load(self.size, outsiders, floor)
+            self._store(top)
+
+    def rename_category(self, category_id, name):
+        """Only meaningful for page boards, whose entries carry the category name."""
+        with self._lock:
+            top = self._top
+            if top is not None and any(e.category_id == category_id for e in top):
+                self._set([e._replace(category=name) if e.category_id == category_id else e for e in top])
+
+    def _score(self, entry):
+        return getattr(entry, self.score)
+
+    def _rank(self, entry):
+        #Same order as the query in _load, newest row first on a tie.
+        return (-self._score(entry), -entry.id)
+
+    def _store(self, entries):
+        entries.sort(key=self._rank)
+        self._set(entries[:self.size])
+
+    def _set(self, entries):
+        #Dropping the board to reload it isn't a change, what it reloads may be.
+        if entries != self._shown:
+            self._shown = entries
+            self._changed_at = time.time()
+        self._top = entries
+
+
+def _load(rows, score, limit, ids=None, min_score=None):
+    """
+    The best `limit` rows of a values_list queryset, optionally only among
+    ids and at or above min_score. The ids are queried in chunks to stay
+    under SQLite's parameter limit.
+    """
+    if min_score is not None:
+        rows = rows.filter(**{score + '__gte': min_score})
+    rows = rows.order_by('-' + score, '-id')
+    if ids is None:
+        return list(rows[:limit])
+    found = []
+    for i in range(0, len(ids), 500):
+        found += rows.filter(id__in=ids[i:i + 500])[:limit]
+    return found
+
+
+def load_categories(limit, ids=None, min_likes=None):
+    rows = Category.objects.values_list('id', 'name', 'slug', 'likes')
+    return [CategoryEntry(*row) for row in _load(rows, 'likes', limit, ids, min_likes)]
+
+
+def load_pages(limit, ids=None, min_views=None):
+    rows = Page.objects.values_list('id', 'title', 'url', 'views', 'category_id', 'category__name')
+    return [PageEntry(*row) for row in _load(rows, 'views', limit, ids, min_views)]
+
+
+top_categories = Leaderboard('likes', load_categories, SIZE, MAX_AGE)
+top_pages = Leaderboard('views', load_pages, SIZE, MAX_AGE)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    top_categories.offer(CategoryEntry(instance.id, instance.name, instance.slug, instance.likes))
+    #The page board shows category names, pick up a rename.
+    top_pages.rename_category(instance.id, instance.name)
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    top_categories.discard(instance.id)
+
+
+@receiver(post_save, sender=Page)
+def page_saved(sender, instance, **kwargs):
+    top_pages.offer(PageEntry(instance.id, instance.title, instance.url, instance.views,
+                              instance.category_id, instance.category.name))
+
+
+@receiver(post_delete, sender=Page)
+def page_deleted(sender, instance, **kwargs):
+    top_pages.discard(instance.id)
+
+
+@receiver(counters_flushed)
+def scores_flushed(sender, field, deltas, **kwargs):
+    if sender is Category and field == 'likes':
+        top_categories.add(deltas)
+    elif sender is Page and field == 'views':
+        top_pages.add(deltas)
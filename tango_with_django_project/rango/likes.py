@@ -0,0 +1,75 @@
+import random
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from rango.counters import UPDATE_CHUNK_SIZE
+from rango.models import Category, CategoryLikeShard
+from rango.signals import counters_flushed
+
+SHARDS = getattr(settings, 'RANGO_LIKE_SHARDS', 8)
+
+
+def total_likes(category_id):
+    """
+    Return Category.likes plus everything still sitting in the shards,
+    or None if there is no such category. It's one query and isn't cached,
+    so likes recorded by other processes show straight away.
+    """
+    found = Category.objects.filter(id=category_id).aggregate(
+        likes=Max('likes'), sharded=Sum('categorylikeshard__count'))
+    if found['likes'] is None:
+        return None
+    return found['likes'] + (found['sharded'] or 0)
+
+
+def add_like(category_id):
+    """
+    Record one like against a random shard of the category and return the
+    new total, or None if there is no such category.
+    """
+    if not Category.objects.filter(id=category_id).exists():
+        return None
+
+    shard = random.randrange(SHARDS)
+    shards = CategoryLikeShard.objects.filter(category_id=category_id, shard=shard)
+    #modified dates the change to the category page's total, see rango.freshness.
+    if not shards.update(count=F('count') + 1, modified=timezone.now()):
+        try:
+            with transaction.atomic():
+                CategoryLikeShard.objects.create(category_id=category_id, shard=shard, count=1)
+        except IntegrityError:
+            #Someone else created this shard between our update and insert.
+            shards.update(count=F('count') + 1, modified=timezone.now())
+
+    return total_likes(category_id)
+
+
+def compact_likes():
+    """
+    Fold the shard counts back into Category.likes and return them as a
+    category_id -> likes dict. Each shard is decremented by exactly what was
+    read, so likes landing while this runs stay in their shard for next time.
+    """
+    shards = list(CategoryLikeShard.objects.exclude(count=0).values_list('id', 'category_id', 'count'))
+    folded = defaultdict(int)
+    by_count = defaultdict(list)
+    for shard_id, category_id, count in shards:
+        folded[category_id] += count
+        by_count[count].append(shard_id)
+
+    now = timezone.now()
+    with transaction.atomic():
+        for category_id, count in folded.items():
+            Category.objects.filter(id=category_id).update(likes=F('likes') + count, modified=now)
+        for count, shard_ids in by_count.items():
+            for i in range(0, len(shard_ids), UPDATE_CHUNK_SIZE):
+                CategoryLikeShard.objects.filter(id__in=shard_ids[i:i + UPDATE_CHUNK_SIZE]).update(
+                    count=F('count') - count)
+
+    if folded:
+        counters_flushed.send(sender=Category, field='likes', deltas=dict(folded))
+    return dict(folded)
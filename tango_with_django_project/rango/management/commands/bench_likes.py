@@ -0,0 +1,68 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+
+from rango.likes import add_like, compact_likes, total_likes
+from rango.models import Category, CategoryLikeShard
+
+
+def legacy_like(category_id):
+    #What like_category used to do: read, add one in Python, save every column.
+    category = Category.objects.get(id=category_id)
+    category.likes = category.likes + 1
+    category.save()
+
+
+class Command(BaseCommand):
+    help = ('Hammers one category with concurrent likes, first the old read/modify/save way and '
+            'then through the sharded counters, and reports lost updates and likes per second. '
+            'Runs against the configured database using a throwaway category.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--likes', type=int, default=200, help='Likes per thread.')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        per_thread = options['likes']
+        expected = threads * per_thread
+
+        for label, like in (('legacy', legacy_like), ('sharded', add_like)):
+            category = Category.objects.create(name='bench-likes-%s' % uuid.uuid4().hex[:12])
+            try:
+                elapsed, errors = self.run(like, category.id, threads, per_thread)
+                compact_likes()
+                recorded = total_likes(category.id)
+            finally:
+                CategoryLikeShard.objects.filter(category=category).delete()
+                category.delete()
+
+            self.stdout.write('%-8s %6d likes sent, %6d recorded, %6d lost, %4d errors, %8.1f likes/s' % (
+                label, expected, recorded, expected - errors - recorded, errors, (expected - errors) / elapsed))
+
+    def run(self, like, category_id, threads, per_thread):
+        errors = [0] * threads
+        start = threading.Event()
+
+        def worker(n):
+            start.wait()
+            try:
+                for i in range(per_thread):
+                    try:
+                        like(category_id)
+                    except DatabaseError:
+                        errors[n] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for t in workers:
+            t.start()
+        began = time.time()
+        start.set()
+        for t in workers:
+            t.join()
+        return time.time() - began, sum(errors)
@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rango import benchmark
+from rango.management.commands.bench_search import sample_queries
+from rango.reindex import default_target, reindex
+
+
+class Command(BaseCommand):
+    help = ('Adds a synthetic catalogue of "bench-" categories to the configured database, or reuses '
+            'the one there, then drives every rango endpoint through the WSGI app with concurrent '
+            'clients and writes throughput, latency percentiles and queries per request as JSON, '
+            'for comparing runs. Use a throwaway database: likes and page views are really counted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1000, help='Pages in the catalogue, 1000 to 1000000.')
+        parser.add_argument('--categories', type=int, help='Defaults to the square root of --pages.')
+        parser.add_argument('--endpoints', nargs='+', choices=list(benchmark.ENDPOINTS),
+                            help='Defaults to all of them.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint.')
+        parser.add_argument('--clients', type=int, default=4, help='Concurrent clients.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-index', action='store_false', dest='index',
+                            help="Don't rebuild the search index after generating the catalogue.")
+        parser.add_argument('--output', help='Write the JSON report here instead of to stdout.')
+        parser.add_argument('--remove', action='store_true', help='Drop the synthetic catalogue and stop.')
+
+    def handle(self, *args, **options):
+        if options['remove']:
+            benchmark.remove()
+            return
+        if not 10 ** 3 <= options['pages'] <= 10 ** 6:
+            raise CommandError('--pages must be between 1000 and 1000000.')
+
+        def progress(stats, rate):
+            self.stderr.write('\r%d pages generated, %.0f/s' % (stats['rows'], rate), ending='')
+
+        categories, pages = benchmark.generate(options['pages'], options['categories'], options['seed'], progress)
+        self.stderr.write('\rCatalogue: %d categories, %d pages.' % (categories, pages))
+        endpoints = options['endpoints'] or list(benchmark.ENDPOINTS)
+        if 'search' in endpoints and options['index']:
+            self.stderr.write('Indexing...')
+            reindex(default_target())
+
+        report = benchmark.run(endpoints, options['requests'], options['clients'], options['seed'],
+                               sample_queries(100) or None)
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
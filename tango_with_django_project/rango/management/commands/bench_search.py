@@ -0,0 +1,82 @@
+import io
+import random
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from haystack import connections
+from haystack.query import SearchQuerySet
+
+from rango.models import Category, Page
+
+
+def sample_queries(count):
+    """Words people would search for: pieces of category names and page titles, some as prefixes."""
+    words = set()
+    for text in list(Category.objects.values_list('name', flat=True)[:500]) + \
+            list(Page.objects.values_list('title', flat=True)[:2000]):
+        words.update(word.lower() for word in text.split() if len(word) > 2 and word.isalpha())
+    words = sorted(words)
+    random.Random(0).shuffle(words)
+    words = words[:count]
+    return words + [word[:3] + '*' for word in words[:count // 4]]
+
+
+def percentile(timings, fraction):
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)]
+
+
+class Command(BaseCommand):
+    help = ('Times the same search queries against one or more haystack connections, for example '
+            '`bench_search default elasticsearch`, and reports latency percentiles. The connections '
+            'should hold the same documents, see reindex.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('connections', nargs='*', default=['default'])
+        parser.add_argument('--queries', help='File with one query per line, defaults to words from the catalogue.')
+        parser.add_argument('--count', type=int, default=100, help='Queries to sample when no file is given.')
+        parser.add_argument('--repeat', type=int, default=5, help='Times each query is run.')
+        parser.add_argument('--limit', type=int, default=10, help='Results fetched per query, like one page of /search/.')
+        parser.add_argument('--highlight', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['queries']:
+            with io.open(options['queries'], encoding='utf-8') as f:
+                queries = [line.strip() for line in f if line.strip()]
+        else:
+            queries = sample_queries(options['count'])
+        if not queries:
+            raise CommandError('No queries to run, index some categories and pages first.')
+        self.stdout.write('%d queries, each run %d times.' % (len(queries), options['repeat']))
+
+        for using in options['connections']:
+            try:
+                #Errors would otherwise be logged and timed as fast empty results.
+                connections[using].get_backend().silently_fail = False
+            except ImproperlyConfigured as e:
+                raise CommandError(str(e))
+            try:
+                timings, hits = self.run(using, queries, options)
+            except Exception as e:
+                self.stdout.write('%-16s unavailable: %s' % (using, e))
+                continue
+            timings.sort()
+            self.stdout.write('%-16s mean %7.2fms  p50 %7.2fms  p95 %7.2fms  p99 %7.2fms  %7.0f queries/s  %d hits' % (
+                using, 1000 * sum(timings) / len(timings), 1000 * percentile(timings, 0.5),
+                1000 * percentile(timings, 0.95), 1000 * percentile(timings, 0.99),
+                len(timings) / sum(timings), hits))
+
+    def run(self, using, queries, options):
+        timings = []
+        hits = 0
+        for n in range(options['repeat']):
+            for query in queries:
+                results = SearchQuerySet(using=using).auto_query(query)
+                if options['highlight']:
+                    results = results.highlight()
+                started = time.time()
+                found = list(results[:options['limit']])
+                timings.append(time.time() - started)
+                if n == 0:
+                    hits += len(found)
+        return timings, hits
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from rango.likes import compact_likes
+
+
+class Command(BaseCommand):
+    help = 'Folds the sharded like counters back into Category.likes. Meant to be run periodically from cron.'
+
+    def handle(self, *args, **options):
+        folded = compact_likes()
+        self.stdout.write('Compacted %d likes across %d categories.' % (sum(folded.values()), len(folded)))
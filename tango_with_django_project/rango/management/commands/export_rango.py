@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rango.bulk import EXPORT_FORMATS, export_rows, parse_since
+
+
+class Command(BaseCommand):
+    help = 'Streams every category and page out as JSON lines or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='jsonl')
+        parser.add_argument('--category', help='Only export the category with this slug and its pages.')
+        parser.add_argument('--since', help='Only export rows modified at or after this ISO 8601 timestamp.')
+        parser.add_argument('--output', help='File to write, defaults to stdout.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows fetched per query.')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = parse_since(options['since'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        lines, content_type = EXPORT_FORMATS[options['format']]
+        rows = export_rows(options['category'], since, options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                for line in lines(rows):
+                    out.write(line)
+        else:
+            for line in lines(rows):
+                self.stdout.write(line, ending='')
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rango.bulk import CatalogueImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = ('Streams pages into rango from a CSV or JSON lines file with category, title, url '
+            'and optional views columns. Categories that don\'t exist yet are created.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for stdin.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format, defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per bulk insert and transaction.')
+        parser.add_argument('--upsert', action='store_true',
+                            help='Update pages whose category and title already exist instead of adding duplicates.')
+        parser.add_argument('--checkpoint',
+                            help='File recording progress, rerunning with it resumes after the last committed batch.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path == '-' and not options['format']:
+            raise CommandError('--format is required when reading stdin.')
+
+        importer = CatalogueImporter(
+            batch_size=options['batch_size'],
+            upsert=options['upsert'],
+            checkpoint=options['checkpoint'],
+            progress=self.progress)
+        try:
+            stats = importer.run(read_rows(path, options['format']), source=path)
+        except (IOError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write('Imported %(rows)d rows in %(seconds).1fs: %(created)d pages created, '
+                          '%(updated)d updated, %(skipped)d skipped, %(categories)d new categories.' % stats)
+
+    def progress(self, stats, rate):
+        self.stdout.write('%d rows, %.0f rows/s' % (stats['rows'], rate))
@@ -0,0 +1,51 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from haystack import connections, DEFAULT_ALIAS
+
+from rango.search_queue import process_queue
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Sends the Category and Page changes queued by rango.search_signals to the search backend '
+            'in batches. Without --loop it empties the queue once and exits, handy from cron. With it a '
+            'failed batch is logged and retried after --interval.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new changes.')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--using', default=DEFAULT_ALIAS, help='Haystack connection to update.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        backend = connections[options['using']].get_backend()
+        #Failures must raise so the batch stays queued, not just be logged.
+        backend.silently_fail = False
+
+        total = 0
+        while True:
+            try:
+                done = process_queue(batch_size, options['using'], backend)
+            except Exception:
+                if not options['loop']:
+                    raise
+                #The batch stays queued, it's sent again once the backend is back.
+                logger.exception('Sending queued changes to the search index failed, retrying in %ss.',
+                                 options['interval'])
+                #Don't keep a db connection that may have been the failure.
+                connection.close()
+                time.sleep(options['interval'])
+                continue
+            total += done
+            if done:
+                self.stdout.write('Sent %d queued changes to the search index.' % done)
+            if done < batch_size:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write('Done, %d changes in total.' % total)
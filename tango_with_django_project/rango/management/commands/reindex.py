@@ -0,0 +1,46 @@
+import multiprocessing
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from haystack import DEFAULT_ALIAS
+
+from rango.reindex import default_target, reindex, LocalTarget
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the search index in parallel: Category and Page are split into primary key ranges '
+            'that a pool of processes index into a fresh Elasticsearch index or FTS database, which then '
+            'replaces the live one. Stop process_search_queue while this runs; changes queued '
+            'meanwhile are applied to the new index once it is restarted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*',
+                            help='Models to index like rango.page, defaults to all. The others keep their live documents.')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Primary keys per chunk.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Documents per backend write.')
+        parser.add_argument('--using', default=DEFAULT_ALIAS, help='Haystack connection to rebuild.')
+        parser.add_argument('--local', metavar='DIRECTORY',
+                            help='Write JSON lines documents under this directory instead of to the search engine.')
+
+    def handle(self, *args, **options):
+        try:
+            models = [apps.get_model(label) for label in options['models']] or None
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+
+        if options['local']:
+            target = LocalTarget(options['local'])
+        else:
+            target = default_target(options['using'])
+
+        stats = reindex(target, models, workers=options['workers'], chunk_size=options['chunk_size'],
+                        batch_size=options['batch_size'], using=options['using'], progress=self.progress)
+        self.stdout.write('Indexed %d documents into %s in %.1fs (%s).' % (
+            sum(stats['documents'].values()), stats['build'], stats['seconds'],
+            ', '.join('%s: %d' % item for item in sorted(stats['documents'].items()))))
+
+    def progress(self, stats):
+        documents = sum(stats['documents'].values())
+        self.stdout.write('%d/%d chunks, %d documents, %.0f documents/s' % (
+            stats['chunks_done'], stats['chunks'], documents, documents / max(stats['seconds'], 1e-6)))
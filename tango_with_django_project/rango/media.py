@@ -0,0 +1,179 @@
+"""
+Serving files from disk without tying up a worker: byte ranges for seeking,
+conditional requests, and the body either handed to the WSGI server's
+file_wrapper (sendfile(2) on gunicorn, uwsgi and most others) or, with
+RANGO_MEDIA_OFFLOAD, to the front proxy altogether.
+"""
+import mimetypes
+import os
+import re
+import stat as stat_module
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag, urlquote
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+#None serves files from Django. 'x-accel-redirect' (nginx) or 'x-sendfile'
+#(Apache mod_xsendfile, lighttpd) leave the body, ranges included, to the proxy.
+OFFLOAD = getattr(settings, 'RANGO_MEDIA_OFFLOAD', None)
+#The internal nginx location that aliases MEDIA_ROOT, for x-accel-redirect.
+ACCEL_PREFIX = getattr(settings, 'RANGO_MEDIA_ACCEL_PREFIX', '/protected-media/')
+MAX_AGE = getattr(settings, 'RANGO_MEDIA_MAX_AGE', 3600)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+#Types Python 2's mimetypes doesn't know.
+for _type, _extension in (('font/woff', '.woff'), ('font/woff2', '.woff2'), ('video/webm', '.webm'),
+                          ('image/svg+xml', '.svg'), ('application/json', '.map')):
+    mimetypes.add_type(_type, _extension)
+
+
+def parse_range(header, size):
+    """
+    The (first, last) byte positions a Range header asks for out of `size`,
+    clipped to the file, or None to send the whole file: no header, one we
+    can't read, or several ranges. Raises ValueError for a range wholly
+    past the end, which is answered with a 416.
+    """
+    match = RANGE_RE.match(header.replace(' ', '')) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        #The last n bytes.
+        length = int(last)
+        if not length:
+            raise ValueError('Empty suffix range.')
+        return max(size - length, 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first > last:
+        if first >= size:
+            raise ValueError('Range starts past the end.')
+        return None
+    return first, last
+
+
+class _Slice(object):
+    #A file that reads as its next `length` bytes only. fileno() is kept so
+    #sendfile wrappers still work, they send Content-Length bytes from tell().
+    def __init__(self, f, length):
+        self._file = f
+        self._left = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self._left:
+            size = self._left
+        data = self._file.read(size)
+        self._left -= len(data)
+        return data
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+class MediaFileResponse(FileResponse):
+    block_size = 64 * 1024
+
+
+def file_response(request, path, stat=None, content_type=None, etag=None, offload=None):
+    """
+    The response for GET or HEAD of the file at `path`: a 304 when the
+    client's copy is current, a 206 or 416 for a Range request (honouring
+    If-Range), otherwise the whole file. `offload` is a (header, value)
+    pair that hands the body to the front proxy instead.
+    """
+    stat = stat or os.stat(path)
+    etag = etag or '%x-%x' % (int(stat.st_mtime), stat.st_size)
+    content_type = content_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    last_modified = http_date(stat.st_mtime)
+    none_match = request.META.get('HTTP_IF_NONE_MATCH')
+
+    if none_match is not None:
+        not_modified = etag in parse_etags(none_match) or none_match.strip() == '*'
+    else:
+        not_modified = not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
+                                              stat.st_mtime, stat.st_size)
+    if not_modified:
+        response = HttpResponseNotModified()
+        response['ETag'] = quote_etag(etag)
+        response['Last-Modified'] = last_modified
+        return response
+
+    if offload:
+        response = HttpResponse(content_type=content_type)
+        kind, target = offload
+        response[kind] = target
+    else:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % stat.st_size
+            return response
+        if byte_range and not _if_range(request.META.get('HTTP_IF_RANGE'), etag, stat.st_mtime):
+            byte_range = None
+
+        first, last = byte_range or (0, stat.st_size - 1)
+        length = last - first + 1 if stat.st_size else 0
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type)
+        else:
+            f = open(path, 'rb')
+            if byte_range:
+                f.seek(first)
+                f = _Slice(f, length)
+            response = MediaFileResponse(f, content_type=content_type)
+        if byte_range:
+            response.status_code = 206
+            response.reason_phrase = 'Partial Content'
+            response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, stat.st_size)
+        response['Content-Length'] = length
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = last_modified
+    return response
+
+
+def _if_range(header, etag, mtime):
+    #Whether a Range may be honoured: no If-Range, or one naming this version.
+    if not header:
+        return True
+    if header.startswith(('"', 'W/')):
+        return etag in parse_etags(header)
+    modified = parse_http_date_safe(header)
+    return modified is not None and int(mtime) <= modified
+
+
+@require_safe
+def serve(request, path):
+    """Serves MEDIA_ROOT, see file_response()."""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404('No such file.')
+    if not stat_module.S_ISREG(stat.st_mode):
+        raise Http404('No such file.')
+
+    offload = None
+    if OFFLOAD == 'x-accel-redirect':
+        offload = ('X-Accel-Redirect', ACCEL_PREFIX + urlquote(path))
+    elif OFFLOAD == 'x-sendfile':
+        offload = ('X-Sendfile', full_path)
+    response = file_response(request, full_path, stat, offload=offload)
+    response['Cache-Control'] = 'public, max-age=%d' % MAX_AGE
+    return response
@@ -0,0 +1,298 @@
+"""
+Per request timings, kept per process and per URL name:
+
+    wall time, SQL queries and time spent in them, template rendering time,
+    hits and misses of django.core.cache.cache
+
+MetricsMiddleware collects them while a request runs, through light
+wrappers around CursorWrapper.execute, Template.render and the default
+cache proxy's get/get_many that do nothing outside a request. Every
+thread adds to its own histograms, so recording takes no lock; render()
+merges them for the staff-only /rango/_metrics page.
+"""
+import math
+import threading
+from collections import OrderedDict, defaultdict
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.cache import DefaultCacheProxy, caches, DEFAULT_CACHE_ALIAS
+from django.db.backends import utils as db_utils
+from django.template.base import Template
+
+ENABLED = getattr(settings, 'RANGO_METRICS', True)
+QUANTILES = (0.5, 0.95, 0.99)
+
+#Bucket i holds values up to SMALLEST * GROWTH ** i, a ~19% relative error.
+#Bucket 0 holds everything up to SMALLEST and is reported as 0.
+SMALLEST = 1e-4
+GROWTH = 2 ** 0.25
+BUCKETS = 100
+_LOG_GROWTH = math.log(GROWTH)
+
+_local = threading.local()
+_registry_lock = threading.Lock()
+_registry = []
+
+
+class Histogram(object):
+    """Counts of values in exponentially growing buckets, plus their count and sum."""
+
+    def __init__(self):
+        self.counts = [0] * (BUCKETS + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        if value <= SMALLEST:
+            i = 0
+        else:
+            i = min(int(math.ceil(math.log(value / SMALLEST) / _LOG_GROWTH)), BUCKETS)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """The upper bound of the bucket holding the q-th value, 0 when empty."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return SMALLEST * GROWTH ** i if i else 0.0
+        return SMALLEST * GROWTH ** BUCKETS
+
+
+class Tally(object):
+    """Exact counts of whole number values, like queries per request, with the same interface as Histogram."""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.count = 0
+        self.sum = 0
+
+    def add(self, value):
+        self.counts[value] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        #list() copies the items in one step, the other thread may be adding.
+        for value, n in list(other.counts.items()):
+            self.counts[value] += n
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """The q-th value itself, 0 when empty."""
+        rank = q * self.count
+        seen = 0
+        for value in sorted(self.counts):
+            seen += self.counts[value]
+            if seen >= rank and self.counts[value]:
+                return value
+        return 0
+
+
+class ViewStats(object):
+    #What one thread has seen of one URL name.
+    SERIES = ('seconds', 'queries', 'query_seconds', 'template_seconds')
+    #Whole numbers, kept exactly rather than in the time buckets.
+    TALLIED = ('queries',)
+
+    def __init__(self):
+        self.histograms = dict((name, Tally() if name in self.TALLIED else Histogram()) for name in self.SERIES)
+        self.requests = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def merge(self, other):
+        for name, histogram in other.histograms.items():
+            self.histograms[name].merge(histogram)
+        self.requests += other.requests
+        self.errors += other.errors
+        self.cache_hits += other.cache_hits
+        self.cache_misses += other.cache_misses
+
+
+class Measurement(object):
+    #The running totals of the request on this thread.
+    __slots__ = ('started', 'queries', 'query_seconds', 'template_seconds', 'template_depth',
+                 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.started = default_timer()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+def _thread_stats():
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        stats = _local.stats = {}
+        with _registry_lock:
+            _registry.append(stats)
+    return stats
+
+
+def record(name, measurement, status):
+    """Add a finished request to this thread's statistics for URL name `name`."""
+    stats = _thread_stats()
+    view = stats.get(name)
+    if view is None:
+        view = stats[name] = ViewStats()
+    histograms = view.histograms
+    histograms['seconds'].add(default_timer() - measurement.started)
+    histograms['queries'].add(measurement.queries)
+    histograms['query_seconds'].add(measurement.query_seconds)
+    histograms['template_seconds'].add(measurement.template_seconds)
+    view.requests += 1
+    view.errors += status >= 500
+    view.cache_hits += measurement.cache_hits
+    view.cache_misses += measurement.cache_misses
+
+
+def snapshot():
+    """Every thread's statistics merged, by URL name."""
+    with _registry_lock:
+        registry = list(_registry)
+    merged = {}
+    for stats in registry:
+        for name, view in list(stats.items()):
+            merged.setdefault(name, ViewStats()).merge(view)
+    return OrderedDict(sorted(merged.items()))
+
+
+def reset():
+    with _registry_lock:
+        for stats in _registry:
+            stats.clear()
+
+
+def render():
+    """snapshot() in the Prometheus text exposition format."""
+    lines = []
+    views = snapshot()
+    for series, help in (('seconds', 'Wall time of requests.'),
+                         ('queries', 'SQL queries per request.'),
+                         ('query_seconds', 'Time per request spent in SQL queries.'),
+                         ('template_seconds', 'Time per request spent rendering templates.')):
+        metric = 'rango_request_%s' % series
+        lines.append('# HELP %s %s' % (metric, help))
+        lines.append('# TYPE %s summary' % metric)
+        for name, view in views.items():
+            histogram = view.histograms[series]
+            for q in QUANTILES:
+                lines.append('%s{view="%s",quantile="%s"} %.6g' % (metric, name, q, histogram.quantile(q)))
+            lines.append('%s_sum{view="%s"} %.6g' % (metric, name, histogram.sum))
+            lines.append('%s_count{view="%s"} %d' % (metric, name, histogram.count))
+    for counter, attribute, help in (('requests', 'requests', 'Requests answered.'),
+                                     ('errors', 'errors', 'Requests answered with a 5xx.'),
+                                     ('cache_hits', 'cache_hits', 'Default cache lookups that hit.'),
+                                     ('cache_misses', 'cache_misses', 'Default cache lookups that missed.')):
+        metric = 'rango_%s_total' % counter
+        lines.append('# HELP %s %s' % (metric, help))
+        lines.append('# TYPE %s counter' % metric)
+        for name, view in views.items():
+            lines.append('%s{view="%s"} %d' % (metric, name, getattr(view, attribute)))
+    return '\n'.join(lines) + '\n'
+
+
+def start():
+    _local.measurement = Measurement()
+
+
+def finish(name, status):
+    measurement = getattr(_local, 'measurement', None)
+    if measurement is not None:
+        _local.measurement = None
+        record(name, measurement, status)
+
+
+#The wrappers below only count while a request is being measured.
+
+_execute = db_utils.CursorWrapper.execute
+_executemany = db_utils.CursorWrapper.executemany
+_template_render = Template.render
+_MISSING = object()
+
+
+def _timed_query(method):
+    def timed(self, *args, **kwargs):
+        measurement = getattr(_local, 'measurement', None)
+        if measurement is None:
+            return method(self, *args, **kwargs)
+        started = default_timer()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            measurement.queries += 1
+            measurement.query_seconds += default_timer() - started
+    return timed
+
+
+def _timed_render(self, context):
+    measurement = getattr(_local, 'measurement', None)
+    if measurement is None:
+        return _template_render(self, context)
+    #Included templates are part of the outermost one's time.
+    measurement.template_depth += 1
+    started = default_timer()
+    try:
+        return _template_render(self, context)
+    finally:
+        measurement.template_depth -= 1
+        if not measurement.template_depth:
+            measurement.template_seconds += default_timer() - started
+
+
+def _counted_get(self, key, default=None, version=None):
+    value = caches[DEFAULT_CACHE_ALIAS].get(key, _MISSING, version=version)
+    measurement = getattr(_local, 'measurement', None)
+    if measurement is not None:
+        if value is _MISSING:
+            measurement.cache_misses += 1
+        else:
+            measurement.cache_hits += 1
+    return default if value is _MISSING else value
+
+
+def _counted_get_many(self, keys, version=None):
+    keys = list(keys)
+    found = caches[DEFAULT_CACHE_ALIAS].get_many(keys, version=version)
+    measurement = getattr(_local, 'measurement', None)
+    if measurement is not None:
+        measurement.cache_hits += len(found)
+        measurement.cache_misses += len(keys) - len(found)
+    return found
+
+
+def install():
+    """Put the wrappers in place, once."""
+    if getattr(db_utils.CursorWrapper.execute, 'rango_metrics', False):
+        return
+    for wrapper in (_counted_get, _counted_get_many, _timed_render):
+        wrapper.rango_metrics = True
+    execute, executemany = _timed_query(_execute), _timed_query(_executemany)
+    execute.rango_metrics = executemany.rango_metrics = True
+    db_utils.CursorWrapper.execute = execute
+    db_utils.CursorWrapper.executemany = executemany
+    Template.render = _timed_render
+    DefaultCacheProxy.get = _counted_get
+    DefaultCacheProxy.get_many = _counted_get_many
+
+
+if ENABLED:
+    install()
@@ -0,0 +1,155 @@
+import json
+import mimetypes
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signing import BadSignature
+from django.utils.six.moves.urllib.parse import unquote
+
+from rango import metrics
+from rango.media import file_response
+from rango.static_assets import ENCODINGS
+
+VISITS_COOKIE = getattr(settings, 'RANGO_VISITS_COOKIE', 'rango_visits')
+VISIT_WINDOW = getattr(settings, 'RANGO_VISIT_WINDOW', 24 * 60 * 60)
+VISITS_SALT = 'rango.visits'
+#Seconds browsers may reuse static files requested by their plain names.
+STATIC_MAX_AGE = getattr(settings, 'RANGO_STATIC_MAX_AGE', 300)
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class VisitTrackingMiddleware(object):
+    """
+    Counts a user's visits in a signed "visits:timestamp" cookie and puts
+    the count on request.visits.
+
+    A hit counts as a new visit once RANGO_VISIT_WINDOW seconds have passed
+    since the last one was counted. The cookie is only sent back when the
+    count changes, and the session store is never touched.
+    """
+
+    def process_request(self, request):
+        visits, counted_at = 0, 0
+        try:
+            value = request.get_signed_cookie(VISITS_COOKIE, salt=VISITS_SALT)
+            visits, counted_at = [int(part) for part in value.split(':')]
+        except (KeyError, BadSignature, ValueError):
+            pass
+
+        now = int(time.time())
+        if not visits or now - counted_at >= VISIT_WINDOW:
+            visits += 1
+            request._rango_new_visit = '%d:%d' % (visits, now)
+        request.visits = visits
+
+    def process_response(self, request, response):
+        new_visit = getattr(request, '_rango_new_visit', None)
+        if new_visit:
+            response.set_signed_cookie(VISITS_COOKIE, new_visit, salt=VISITS_SALT,
+                                       max_age=365 * 24 * 60 * 60, httponly=True)
+        return response
+
+
+def accepted_encodings(header):
+    """The content codings an Accept-Encoding header allows, q=0 ones left out."""
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                pass
+        if coding and q > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticAssetMiddleware(object):
+    """
+    Serves collected static files, see rango.static_assets. Fingerprinted
+    names are sent as immutable for a year, in the best encoding the client
+    accepts that was made for them. Plain names are sent as is, cacheable
+    for RANGO_STATIC_MAX_AGE. Conditional and Range requests are handled
+    by rango.media.file_response(). Anything not in the manifest is left
+    to the rest of the stack.
+
+    The manifest is reread when collectstatic replaces it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._manifest = (None, None, None)
+
+    def manifest(self):
+        #(plain names, fingerprinted names -> encodings) from STATIC_ROOT, or None.
+        try:
+            path = staticfiles_storage.path(staticfiles_storage.manifest_name)
+            stamp = (path, os.stat(path).st_mtime)
+        except (AttributeError, ImproperlyConfigured, OSError):
+            return None
+        with self._lock:
+            if self._manifest[0] != stamp:
+                with open(path, 'rb') as f:
+                    stored = json.loads(f.read().decode('utf-8'))
+                paths = stored.get('paths', {})
+                encodings = stored.get('encodings', {})
+                hashed = dict((name, encodings.get(name, [])) for name in paths.values())
+                self._manifest = (stamp, set(paths), hashed)
+            return self._manifest[1:]
+
+    def process_request(self, request):
+        if request.method not in ('GET', 'HEAD') or not request.path.startswith(settings.STATIC_URL):
+            return None
+        manifest = self.manifest()
+        if manifest is None:
+            return None
+        plain, hashed = manifest
+        name = unquote(request.path[len(settings.STATIC_URL):])
+
+        if name in hashed:
+            accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            encoding = next((e for e in ENCODINGS if e in hashed[name] and (e in accepted or '*' in accepted)), None)
+            cache_control = IMMUTABLE
+        elif name in plain:
+            encoding = None
+            cache_control = 'public, max-age=%d' % STATIC_MAX_AGE
+        else:
+            return None
+
+        path = staticfiles_storage.path(name + (ENCODINGS[encoding] if encoding else ''))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'image/svg+xml'):
+            content_type += '; charset=utf-8'
+        etag = '%x-%x%s' % (int(stat.st_mtime), stat.st_size, '-' + encoding if encoding else '')
+        response = file_response(request, path, stat, content_type, etag)
+        if encoding and response.status_code in (200, 206):
+            response['Content-Encoding'] = encoding
+        response['Cache-Control'] = cache_control
+        if name in hashed and hashed[name]:
+            response['Vary'] = 'Accept-Encoding'
+        return response
+
+
+class MetricsMiddleware(object):
+    """
+    Times every request and counts its queries and cache lookups into
+    rango.metrics, under the name of the URL pattern that answered it.
+    """
+
+    def process_request(self, request):
+        metrics.start()
+
+    def process_response(self, request, response):
+        match = getattr(request, 'resolver_match', None)
+        metrics.finish(match.view_name if match and match.view_name else 'unresolved', response.status_code)
+        return response
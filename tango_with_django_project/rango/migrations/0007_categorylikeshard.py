@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0006_userprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryLikeShard',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(to='rango.Category')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='categorylikeshard',
+            unique_together=set([('category', 'shard')]),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0007_categorylikeshard'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='category',
+            index_together=set([('likes', 'id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='page',
+            index_together=set([('views', 'id'), ('category', 'views', 'id')]),
+        ),
+    ]
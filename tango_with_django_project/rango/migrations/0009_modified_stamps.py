@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0008_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='modified',
+            field=models.DateTimeField(default=django.utils.timezone.now, auto_now=True, db_index=True),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='modified',
+            field=models.DateTimeField(default=django.utils.timezone.now, auto_now=True, db_index=True),
+            preserve_default=False,
+        ),
+    ]
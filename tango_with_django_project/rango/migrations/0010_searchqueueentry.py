@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0009_modified_stamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchQueueEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('model', models.CharField(max_length=100)),
+                ('object_id', models.IntegerField()),
+                ('action', models.CharField(max_length=6, choices=[('update', 'Update'), ('delete', 'Delete')])),
+                ('queued', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchqueueentry',
+            unique_together=set([('model', 'object_id')]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0010_searchqueueentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='thumbnail_sizes',
+            field=models.CharField(max_length=64, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='thumbnail_webp',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import rango.uploads
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0011_userprofile_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='picture',
+            field=models.ImageField(storage=rango.uploads.ContentAddressedStorage(), upload_to='profile_images', blank=True),
+        ),
+    ]
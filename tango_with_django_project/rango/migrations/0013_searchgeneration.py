@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0012_content_addressed_pictures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchGeneration',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('model', models.CharField(unique=True, max_length=100)),
+                ('generation', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rango', '0014_categorylikeshard_modified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='pages_modified',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
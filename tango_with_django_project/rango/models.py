@@ -1,6 +1,9 @@
+from django.core.files.storage import default_storage
 from django.db import models
 from django.template.defaultfilters import slugify
+from django.utils import timezone
 from django.contrib.auth.models import User
+from rango.uploads import ContentAddressedStorage
 
 # Create your models here.
 class Category(models.Model):
@@ -8,6 +11,13 @@ class Category(models.Model):
     views = models.IntegerField(default=0)
     likes = models.IntegerField(default=0)
     slug = models.SlugField(unique=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    #Moved by every write to the category's pages, see rango.freshness.
+    pages_modified = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        #Serves ORDER BY likes DESC, id DESC (leaderboard, sidebar) as a backwards scan.
+        index_together = [('likes', 'id')]
     
     def save(self, *args, **kwargs):
         if self.views < 0:
@@ -28,18 +38,88 @@ class Page(models.Model):
     title = models.CharField(max_length=128)
     url = models.URLField()
     views = models.IntegerField(default=0)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        #The first serves the index page leaderboard, the second a category's
+        #pages by views, both ordered views DESC, id DESC.
+        index_together = [('views', 'id'), ('category', 'views', 'id')]
 
     def __unicode__(self):
         return self.title
 
+class CategoryLikeShard(models.Model):
+    # Likes are spread over several counter rows per category so concurrent
+    # likes don't all queue up on the same Category row. See rango.likes.
+    category = models.ForeignKey(Category)
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('category', 'shard')
+
+    def __unicode__(self):
+        return '%s #%d' % (self.category_id, self.shard)
+
+class SearchQueueEntry(models.Model):
+    # A Category or Page whose search index document needs refreshing or
+    # removing. Written by rango.search_signals and drained in batches by
+    # the process_search_queue command, see rango.search_queue. One row per
+    # object, queueing it again just replaces the action.
+    UPDATE = 'update'
+    DELETE = 'delete'
+    ACTIONS = ((UPDATE, 'Update'), (DELETE, 'Delete'))
+
+    model = models.CharField(max_length=100)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=6, choices=ACTIONS)
+    queued = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('model', 'object_id')
+
+    def __unicode__(self):
+        return '%s %s.%s' % (self.action, self.model, self.object_id)
+
+class SearchGeneration(models.Model):
+    # Moved on whenever the search index changes for a model, which makes
+    # the /search/ results every process has cached for it stale. It's in
+    # the db because the queue worker updating the index is another
+    # process. See rango.search_cache.
+    model = models.CharField(max_length=100, unique=True)
+    generation = models.IntegerField(default=0)
+
+    def __unicode__(self):
+        return '%s #%d' % (self.model, self.generation)
+
 class UserProfile(models.Model):
     # This line is required. Links UserProfile to a User model instance.
     user = models.OneToOneField(User)
 
     # The additional attributes we wish to include.
     website = models.URLField(blank=True)
-    picture = models.ImageField(upload_to='profile_images', blank=True)
+    #Stored once per distinct picture, under its content hash.
+    picture = models.ImageField(upload_to='profile_images', blank=True, storage=ContentAddressedStorage())
+    #Thumbnails of picture made so far, see rango.thumbnails.
+    thumbnail_sizes = models.CharField(max_length=64, blank=True, editable=False)
+    thumbnail_webp = models.BooleanField(default=False, editable=False)
 
     # Override the __unicode__() method to return out something meaningful!
     def __unicode__(self):
-        return self.user.username
\ No newline at end of file
+        return self.user.username
+
+    def avatar_url(self, size, format='jpg'):
+        """
+        The url of the smallest thumbnail at least `size` pixels square, or
+        the largest if none is. Until the thumbnails are made, or for a
+        format that wasn't, it's the original picture's. None without one.
+        """
+        if not self.picture:
+            return None
+        sizes = [int(made) for made in self.thumbnail_sizes.split(',') if made]
+        if not sizes or (format == 'webp' and not self.thumbnail_webp):
+            return self.picture.url
+        from rango.thumbnails import thumbnail_name
+        best = min([made for made in sizes if made >= size] or [max(sizes)])
+        return default_storage.url(thumbnail_name(self.picture.name, best, format))
@@ -0,0 +1,96 @@
+"""
+Whole rendered pages for anonymous visitors, kept in the default cache.
+
+A page is stored under its URL and the request headers its Vary names, the
+way django's cache middleware keys them, together with the ETag it had from
+rango.freshness. It's only served while that ETag is still current, and the
+ETags are worked out from the db, so a write from any process makes the
+pages it changed miss on their next request. The sidebar inside them is
+cached under the same category list state, see rango.sidebar. Nothing needs
+deleting.
+
+The cache sits under the middleware, so what they add per request, like the
+visit counter's cookie or Vary: Cookie, is never stored. Concurrent misses
+on one page in a process wait for a single render of it, for at most WAIT
+seconds, after which they render it themselves.
+"""
+import threading
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_cache_key, learn_cache_key
+from django.utils.decorators import available_attrs
+
+#Entries are checked against their ETag on every hit, this only bounds how
+#long unvisited pages take up room.
+TIMEOUT = getattr(settings, 'RANGO_PAGE_CACHE_TIMEOUT', 600)
+WAIT = getattr(settings, 'RANGO_PAGE_CACHE_WAIT', 5)
+KEY_PREFIX = 'rango:page'
+
+_lock = threading.Lock()
+_flights = {}
+
+
+class _Flight(object):
+    #One render in progress, the requests that missed on the same page wait on it.
+    def __init__(self):
+        self.done = threading.Event()
+
+
+def cached_page(request, etag):
+    """The stored response for this request if it was stored with `etag`, else None."""
+    key = get_cache_key(request, KEY_PREFIX, 'GET', cache=cache)
+    entry = cache.get(key) if key is not None else None
+    if entry is None or entry[0] != etag:
+        return None
+    return entry[1]
+
+
+def store_page(request, etag, response):
+    if (request.method != 'GET' or response.status_code != 200 or response.streaming
+            or response.cookies):
+        return
+    key = learn_cache_key(request, response, TIMEOUT, KEY_PREFIX, cache=cache)
+    cache.set(key, (etag, response), TIMEOUT)
+
+
+def cache_anonymous(etag_func):
+    """
+    Decorator serving a view's GETs to anonymous visitors from the cache.
+    etag_func(request, *args, **kwargs) gives the page's current ETag.
+    """
+    def decorator(view):
+        @wraps(view, assigned=available_attrs(view))
+        def cached(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated():
+                return view(request, *args, **kwargs)
+            etag = etag_func(request, *args, **kwargs)
+            response = cached_page(request, etag)
+            if response is not None:
+                return response
+
+            flight_key = (request.build_absolute_uri(), etag)
+            with _lock:
+                flight = _flights.get(flight_key)
+                leader = flight is None
+                if leader:
+                    flight = _flights[flight_key] = _Flight()
+            if not leader:
+                #A slow or stuck render doesn't hold up the rest for longer than WAIT.
+                if not flight.done.wait(WAIT):
+                    return view(request, *args, **kwargs)
+                #Each waiter gets its own copy, middleware will change its headers.
+                response = cached_page(request, etag)
+                return response if response is not None else view(request, *args, **kwargs)
+
+            try:
+                response = view(request, *args, **kwargs)
+                store_page(request, etag, response)
+            finally:
+                with _lock:
+                    del _flights[flight_key]
+                flight.done.set()
+            return response
+        return cached
+    return decorator
@@ -0,0 +1,45 @@
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+
+
+def encode_cursor(views, pk):
+    """Opaque url-safe token for the position after (views, pk)."""
+    return base64.urlsafe_b64encode(json.dumps([views, pk]).encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """The (views, pk) pair behind a token, or None if it isn't one of ours."""
+    if not token:
+        return None
+    try:
+        token = str(token)
+        views, pk = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('ascii'))
+        return int(views), int(pk)
+    except (TypeError, ValueError, OverflowError, UnicodeError, binascii.Error):
+        return None
+
+
+def keyset_page(pages, after=None, size=50):
+    """
+    One page of `pages` ordered by views DESC, id DESC, starting after the
+    cursor token `after`. Returns the pages and the token for the next
+    page, which is None on the last one.
+
+    Rather than OFFSET, each page seeks to where the previous one ended,
+    so page 1000 costs the same as page 1.
+    """
+    cursor = decode_cursor(after)
+    if cursor:
+        views, pk = cursor
+        #The views__lte half lets the db seek into (category, views, id)
+        #instead of filtering from the top of the category.
+        pages = pages.filter(Q(views__lte=views) & (Q(views__lt=views) | Q(id__lt=pk)))
+    rows = list(pages.order_by('-views', '-id')[:size + 1])
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor(rows[-1].views, rows[-1].id)
+    return rows, next_cursor
@@ -0,0 +1,214 @@
+"""
+Query budgets: the most SQL queries, and rows read back from them, that a
+view or a template tag may take. They're declared next to the code,
+
+    @query_budget(queries=4, rows=60)
+    def index(request): ...
+
+    with query_budget(queries=1, rows=50, name='get_category_list'):
+        ...
+
+or around views rango doesn't own where urls.py maps them. Going over is
+logged as a warning on the rango.query_budget logger, with the statement
+that broke the budget and the stack that ran it. With RANGO_QUERY_BUDGETS
+= 'raise', which QueryBudgetTestRunner sets, it raises QueryBudgetExceeded
+instead so any test going through the view fails. None turns budgets off.
+
+Rows are counted as they're fetched through CursorWrapper, so the rows a
+StreamingHttpResponse reads after its view has returned aren't counted.
+"""
+import logging
+import os
+import threading
+import traceback
+from contextlib import contextmanager
+from functools import wraps
+
+import django
+from django.conf import settings
+from django.db.backends import utils as db_utils
+from django.test.runner import DiscoverRunner
+from django.utils.decorators import available_attrs
+
+logger = logging.getLogger(__name__)
+_local = threading.local()
+
+#Frames from these are left out of the reported stacks.
+_HIDDEN = (os.path.dirname(django.__file__), os.path.splitext(__file__)[0])
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def mode():
+    #Read per use so override_settings and the test runner take effect.
+    return getattr(settings, 'RANGO_QUERY_BUDGETS', 'warn')
+
+
+def _stack():
+    frames = traceback.extract_stack()
+    shown = [frame for frame in frames if not frame[0].startswith(_HIDDEN)]
+    return ''.join(traceback.format_list(shown or frames))
+
+
+class _Scope(object):
+    #One run of a budgeted block, and the first statement to break each limit.
+    __slots__ = ('budget', 'queries', 'rows', 'breaches')
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.queries = 0
+        self.rows = 0
+        self.breaches = {}
+
+    def breach(self, kind):
+        if kind not in self.breaches:
+            self.breaches[kind] = (getattr(_local, 'sql', None), _stack())
+
+
+class QueryBudget(object):
+    """
+    At most `queries` queries and `rows` rows fetched (None is no limit)
+    inside a with block or each call of a decorated function. Blocks nest,
+    a query counts against every budget it runs under.
+    """
+
+    def __init__(self, queries=None, rows=None, name=None):
+        self.queries = queries
+        self.rows = rows
+        self.name = name
+
+    def __enter__(self):
+        scopes = getattr(_local, 'scopes', None)
+        if scopes is None:
+            scopes = _local.scopes = []
+        #An inactive scope still takes its place, so __exit__ stays balanced.
+        scopes.append(_Scope(self) if mode() else None)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        scope = _local.scopes.pop()
+        if scope is not None and scope.breaches and exc_type is None:
+            self.report(scope)
+
+    def __call__(self, func):
+        budget = QueryBudget(self.queries, self.rows, self.name or getattr(func, '__name__', None) or type(func).__name__)
+
+        @wraps(func, assigned=available_attrs(func))
+        def budgeted(*args, **kwargs):
+            with budget:
+                return func(*args, **kwargs)
+        budgeted.query_budget = budget
+        return budgeted
+
+    def report(self, scope):
+        lines = []
+        for kind, used, limit in (('queries', scope.queries, self.queries), ('rows', scope.rows, self.rows)):
+            if kind in scope.breaches:
+                sql, stack = scope.breaches[kind]
+                lines.append('%s used %d %s, its budget is %d. Over budget at:\n  %s\n%s'
+                             % (self.name, used, kind, limit, sql, stack))
+        message = '\n'.join(lines)
+        if mode() == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+query_budget = QueryBudget
+
+
+@contextmanager
+def unbudgeted():
+    """Queries in the block count against no budget, for one-off loads like warming a cache."""
+    scopes = getattr(_local, 'scopes', None)
+    _local.scopes = []
+    try:
+        yield
+    finally:
+        _local.scopes = scopes if scopes is not None else []
+
+
+def _active_scopes():
+    return [scope for scope in getattr(_local, 'scopes', ()) if scope is not None]
+
+
+def _count_rows(n):
+    for scope in _active_scopes():
+        scope.rows += n
+        if scope.budget.rows is not None and scope.rows > scope.budget.rows:
+            scope.breach('rows')
+
+
+#CursorWrapper counts for every scope it runs under, outside any it only
+#adds a thread local lookup.
+
+def _counted_query(method):
+    def counted(self, sql, *args, **kwargs):
+        scopes = _active_scopes()
+        if scopes:
+            _local.sql = sql
+            for scope in scopes:
+                scope.queries += 1
+                if scope.budget.queries is not None and scope.queries > scope.budget.queries:
+                    scope.breach('queries')
+        return method(self, sql, *args, **kwargs)
+    return counted
+
+
+def _fetchone(self):
+    with self.db.wrap_database_errors:
+        row = self.cursor.fetchone()
+    if row is not None:
+        _count_rows(1)
+    return row
+
+
+def _fetchmany(self, *args):
+    with self.db.wrap_database_errors:
+        rows = self.cursor.fetchmany(*args)
+    _count_rows(len(rows))
+    return rows
+
+
+def _fetchall(self):
+    with self.db.wrap_database_errors:
+        rows = self.cursor.fetchall()
+    _count_rows(len(rows))
+    return rows
+
+
+def _iter(self):
+    with self.db.wrap_database_errors:
+        for row in self.cursor:
+            _count_rows(1)
+            yield row
+
+
+def install():
+    """Put the counting wrappers in place, once."""
+    if getattr(getattr(db_utils.CursorWrapper, 'fetchall', None), 'rango_query_budget', False):
+        return
+    _fetchall.rango_query_budget = True
+    db_utils.CursorWrapper.execute = _counted_query(db_utils.CursorWrapper.execute)
+    db_utils.CursorWrapper.executemany = _counted_query(db_utils.CursorWrapper.executemany)
+    db_utils.CursorWrapper.fetchone = _fetchone
+    db_utils.CursorWrapper.fetchmany = _fetchmany
+    db_utils.CursorWrapper.fetchall = _fetchall
+    db_utils.CursorWrapper.__iter__ = _iter
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """The default runner, with budgets raising so a test over one fails."""
+
+    def setup_test_environment(self, **kwargs):
+        super(QueryBudgetTestRunner, self).setup_test_environment(**kwargs)
+        self._budget_mode = mode()
+        settings.RANGO_QUERY_BUDGETS = 'raise'
+
+    def teardown_test_environment(self, **kwargs):
+        settings.RANGO_QUERY_BUDGETS = self._budget_mode
+        super(QueryBudgetTestRunner, self).teardown_test_environment(**kwargs)
+
+
+install()
@@ -0,0 +1,297 @@
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import time
+
+from django import db
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Min
+from haystack import connections, DEFAULT_ALIAS
+
+from rango.fts_backend import FTSSearchBackend, SCHEMA
+from rango.search_queue import model_label
+from rango.signals import search_index_updated
+
+
+def pk_ranges(queryset, chunk_size):
+    """
+    Split a queryset into [lo, hi) primary key ranges about chunk_size
+    ids wide. Gaps in the ids just make some chunks smaller.
+    """
+    bounds = queryset.aggregate(lo=Min('pk'), hi=Max('pk'))
+    if bounds['lo'] is None:
+        return []
+    return [(lo, min(lo + chunk_size, bounds['hi'] + 1))
+            for lo in range(bounds['lo'], bounds['hi'] + 1, chunk_size)]
+
+
+class ElasticsearchTarget(object):
+    """
+    Builds into a new Elasticsearch index named after the connection's
+    INDEX_NAME plus a millisecond timestamp, and then points INDEX_NAME, as an alias,
+    at it. Searches keep hitting the old index until the swap, which is a
+    single update_aliases call.
+    """
+
+    def __init__(self, using=DEFAULT_ALIAS):
+        self.using = using
+        self.alias = connections[using].options['INDEX_NAME']
+
+    def backend(self, index_name):
+        engine = connections[self.using]
+        backend = engine.backend(self.using, **dict(engine.options, INDEX_NAME=index_name))
+        backend.silently_fail = False
+        return backend
+
+    def create(self):
+        build = '%s_%d' % (self.alias, time.time() * 1000)
+        #Creates the index with haystack's settings and field mapping.
+        self.backend(build).setup()
+        return build
+
+    def writer(self, build, chunk):
+        backend = self.backend(build)
+        backend.setup_complete = True
+        return _CommitLater(backend)
+
+    def copy_live(self, build, labels):
+        #Only this target needs the client, the FTS setup runs without it.
+        from elasticsearch import helpers
+        conn = self.backend(build).conn
+        if conn.indices.exists(index=self.alias):
+            helpers.reindex(conn, self.alias, build,
+                            query={'query': {'terms': {'django_ct': labels}}})
+
+    def swap(self, build):
+        conn = self.backend(build).conn
+        conn.indices.refresh(index=build)
+        old = []
+        actions = [{'add': {'index': build, 'alias': self.alias}}]
+        if conn.indices.exists_alias(name=self.alias):
+            old = list(conn.indices.get_alias(name=self.alias))
+            actions += [{'remove': {'index': name, 'alias': self.alias}} for name in old]
+        elif conn.indices.exists(index=self.alias):
+            #A plain index from before the first reindex. It's dropped in
+            #the same call that makes its name an alias, so there's no
+            #moment with neither.
+            actions.append({'remove_index': {'index': self.alias}})
+        conn.indices.update_aliases(body={'actions': actions})
+        for name in old:
+            conn.indices.delete(index=name)
+
+    def discard(self, build):
+        self.backend(build).conn.indices.delete(index=build, ignore=404)
+
+
+class _CommitLater(object):
+    #Each ES refresh is expensive, swap() does a single one at the end.
+    def __init__(self, backend):
+        self.backend = backend
+
+    def update(self, index, iterable):
+        self.backend.update(index, iterable, commit=False)
+
+
+class FTSTarget(object):
+    """
+    Builds into a new SQLite file next to the FTS backend's PATH and then
+    renames it over PATH. Open connections notice the new file and reopen.
+    """
+
+    def __init__(self, using=DEFAULT_ALIAS):
+        self.using = using
+        self.path = connections[using].options['PATH']
+
+    def create(self):
+        build = '%s.%d' % (self.path, time.time() * 1000)
+        conn = sqlite3.connect(build)
+        conn.executescript(SCHEMA)
+        conn.close()
+        return build
+
+    def writer(self, build, chunk):
+        engine = connections[self.using]
+        backend = engine.backend(self.using, **dict(engine.options, PATH=build))
+        backend.silently_fail = False
+        return backend
+
+    def copy_live(self, build, labels):
+        if not os.path.exists(self.path):
+            return
+        conn = sqlite3.connect(build)
+        try:
+            with conn:
+                conn.execute('ATTACH DATABASE ? AS live', (self.path,))
+                copied = 'SELECT rowid FROM live.documents WHERE django_ct IN (%s)' % ', '.join('?' * len(labels))
+                conn.execute('INSERT INTO documents (rowid, id, django_ct, django_id, data) '
+                             'SELECT rowid, id, django_ct, django_id, data FROM live.documents '
+                             'WHERE rowid IN (%s)' % copied, labels)
+                conn.execute('INSERT INTO documents_fts (rowid, text) '
+                             'SELECT rowid, text FROM live.documents_fts WHERE rowid IN (%s)' % copied, labels)
+        finally:
+            conn.close()
+
+    def swap(self, build):
+        os.rename(build, self.path)
+
+    def discard(self, build):
+        if os.path.exists(build):
+            os.remove(build)
+
+
+class LocalTarget(object):
+    """
+    Stand-in for a real search engine, for tests and dry runs: every build
+    is a directory of JSON lines files holding the prepared documents, one
+    file per chunk, and `directory/name` is a symlink to the live one.
+    """
+
+    def __init__(self, directory, name='haystack'):
+        self.directory = directory
+        self.name = name
+
+    @property
+    def current(self):
+        return os.path.join(self.directory, self.name)
+
+    def create(self):
+        build = '%s_%d' % (self.name, time.time() * 1000)
+        os.makedirs(os.path.join(self.directory, build))
+        return build
+
+    def writer(self, build, chunk):
+        return _JsonLinesWriter(os.path.join(self.directory, build, '%s-%s.jsonl' % chunk))
+
+    def copy_live(self, build, labels):
+        if not os.path.isdir(self.current):
+            return
+        for filename in os.listdir(self.current):
+            if filename.rsplit('-', 1)[0] in labels:
+                shutil.copy(os.path.join(self.current, filename), os.path.join(self.directory, build))
+
+    def swap(self, build):
+        old = os.path.realpath(self.current) if os.path.islink(self.current) else None
+        tmp = self.current + '.tmp'
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(build, tmp)
+        #rename() replaces the old link in one step.
+        os.rename(tmp, self.current)
+        if old and old != os.path.realpath(self.current):
+            shutil.rmtree(old)
+
+    def discard(self, build):
+        shutil.rmtree(os.path.join(self.directory, build), ignore_errors=True)
+
+    def documents(self):
+        """Every document in the live build."""
+        docs = []
+        for filename in sorted(os.listdir(self.current)):
+            with io.open(os.path.join(self.current, filename), encoding='utf-8') as f:
+                docs += [json.loads(line) for line in f]
+        return docs
+
+
+class _JsonLinesWriter(object):
+    def __init__(self, path):
+        self.path = path
+
+    def update(self, index, iterable):
+        with io.open(self.path, 'a', encoding='utf-8') as f:
+            for obj in iterable:
+                f.write(json.dumps(index.full_prepare(obj), cls=DjangoJSONEncoder, ensure_ascii=False) + u'\n')
+
+
+def default_target(using=DEFAULT_ALIAS):
+    """The target that rebuilds the haystack connection `using`."""
+    if issubclass(connections[using].backend, FTSSearchBackend):
+        return FTSTarget(using)
+    return ElasticsearchTarget(using)
+
+
+def _index_chunk(args):
+    """Index one pk range, runs in a pool worker. Returns the label and document count."""
+    target, build, label, lo, hi, batch_size, using = args
+    index = connections[using].get_unified_index().get_index(apps.get_model(label))
+    writer = target.writer(build, (label, lo))
+    rows = index.index_queryset(using=using).filter(pk__gte=lo, pk__lt=hi).order_by('pk')
+    count = 0
+    batch = []
+    for obj in rows.iterator():
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            writer.update(index, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        writer.update(index, batch)
+        count += len(batch)
+    return label, count
+
+
+def _close_connections():
+    #Forked workers must not share the parent's db sockets.
+    db.connections.close_all()
+
+
+def reindex(target, models=None, workers=1, chunk_size=5000, batch_size=500, using=DEFAULT_ALIAS, progress=None):
+    """
+    Rebuild the search index for models (default: everything indexed)
+    into a fresh build of target, then swap it in; a failed build is
+    discarded and the live index left alone. The live documents of the
+    other indexed models are copied into the build first, so rebuilding
+    one model keeps the rest searchable. Each model is split
+    into pk ranges which a pool of `workers` processes index in parallel;
+    with one worker it all runs in this process. progress, if given, is
+    called with the stats after every chunk. Returns the stats.
+    """
+    started = time.time()
+    unified_index = connections[using].get_unified_index()
+    if models is None:
+        models = unified_index.get_indexed_models()
+    others = [model_label(model) for model in unified_index.get_indexed_models() if model not in models]
+
+    build = target.create()
+    try:
+        if others:
+            #Copied before any chunk is written, new FTS rows then can't take a copied rowid.
+            target.copy_live(build, others)
+        chunks = []
+        for model in models:
+            index = unified_index.get_index(model)
+            chunks += [(target, build, model_label(model), lo, hi, batch_size, using)
+                       for lo, hi in pk_ranges(index.index_queryset(using=using), chunk_size)]
+        stats = {'build': build, 'chunks': len(chunks), 'chunks_done': 0, 'documents': {}, 'seconds': 0.0}
+
+        if workers > 1:
+            _close_connections()
+            pool = multiprocessing.Pool(workers, initializer=_close_connections)
+            results = pool.imap_unordered(_index_chunk, chunks)
+        else:
+            pool = None
+            results = (_index_chunk(chunk) for chunk in chunks)
+        try:
+            for label, count in results:
+                stats['chunks_done'] += 1
+                stats['documents'][label] = stats['documents'].get(label, 0) + count
+                stats['seconds'] = time.time() - started
+                if progress:
+                    progress(stats)
+        finally:
+            if pool is not None:
+                #Every result is in by now unless something failed, then stop the rest.
+                pool.terminate()
+                pool.join()
+    except BaseException:
+        target.discard(build)
+        raise
+
+    target.swap(build)
+    for model in models:
+        search_index_updated.send(sender=model, object_ids=None)
+    stats['seconds'] = time.time() - started
+    return stats
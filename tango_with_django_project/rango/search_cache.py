@@ -0,0 +1,122 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.dispatch import receiver
+
+from rango.models import SearchGeneration
+from rango.search_queue import model_label
+from rango.signals import search_index_updated
+
+SIZE = getattr(settings, 'RANGO_SEARCH_CACHE_SIZE', 500)
+TTL = getattr(settings, 'RANGO_SEARCH_CACHE_TTL', 300)
+
+#Words that only make a query longer. They are dropped unless the query
+#has nothing else, and kept inside "quoted phrases".
+STOPWORDS = frozenset('a an and are as at be but by for from how i in into is it of on or '
+                      'that the this to was what when where which who why will with'.split())
+
+#A "quoted phrase", -"excluded phrase" or any other run of non-space.
+TOKEN_RE = re.compile(r'-?"[^"]*"|\S+')
+
+
+def normalise(query):
+    """
+    The canonical form of a search box query: lower case, stopwords and
+    repeated terms dropped, terms sorted. Every query that normalises
+    the same matches the same documents, so they can share results.
+    """
+    tokens = TOKEN_RE.findall(query.lower())
+    terms = set(token for token in tokens if token.lstrip('-') not in STOPWORDS) or set(tokens)
+    return ' '.join(sorted(terms))
+
+
+def generations(labels):
+    """The current generation of each model label, see bump_generation(). One query."""
+    found = dict(SearchGeneration.objects.filter(model__in=labels).values_list('model', 'generation'))
+    return tuple(found.get(label, 0) for label in labels)
+
+
+def bump_generation(label):
+    """
+    Make every cached result that covers model `label` stale, in this
+    process and every other one, as they all read the generations from
+    the db.
+    """
+    generation = SearchGeneration.objects.filter(model=label)
+    if not generation.update(generation=F('generation') + 1):
+        try:
+            with transaction.atomic():
+                SearchGeneration.objects.create(model=label, generation=1)
+        except IntegrityError:
+            #Created by someone else between our update and insert.
+            generation.update(generation=F('generation') + 1)
+
+
+class ResultCache(object):
+    """
+    At most `size` search results kept for `ttl` seconds each, least
+    recently used dropped first. Each entry is stored with the generations
+    of the models it searched, taken before the search ran, and is ignored
+    once any of them moves on.
+    """
+
+    def __init__(self, size=500, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = dict.fromkeys(['hits', 'misses', 'expired', 'invalidated', 'evicted'], 0)
+
+    def get(self, key, gens):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            value, expires, entry_gens = entry
+            if expires < time.time():
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            if entry_gens != gens:
+                self._stats['invalidated'] += 1
+                self._stats['misses'] += 1
+                return None
+            #Back in at the most recently used end.
+            self._entries[key] = entry
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, gens, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + self.ttl, gens)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def clear(self):
+        """Forget every entry and zero the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._stats = dict.fromkeys(self._stats, 0)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries), max_size=self.size, ttl=self.ttl)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.0
+        return stats
+
+
+search_results = ResultCache(SIZE, TTL)
+
+
+@receiver(search_index_updated)
+def invalidate_results(sender, **kwargs):
+    bump_generation(model_label(sender))
@@ -0,0 +1,117 @@
+import logging
+import operator
+from collections import defaultdict
+from functools import reduce
+
+from django.apps import apps
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+from haystack import connections, DEFAULT_ALIAS
+from haystack.exceptions import NotHandled
+
+from rango.bulk import IN_CHUNK_SIZE
+from rango.models import SearchQueueEntry
+from rango.signals import search_index_updated
+
+logger = logging.getLogger(__name__)
+
+
+def model_label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.model_name)
+
+
+def enqueue(model, pk, action):
+    """
+    Note that the search document for model `pk` needs an update or a
+    delete. An object already waiting in the queue just has its action
+    replaced, so a burst of saves costs the backend a single update.
+    """
+    entries = SearchQueueEntry.objects.filter(model=model_label(model), object_id=pk)
+    now = timezone.now()
+    if not entries.update(action=action, queued=now):
+        try:
+            with transaction.atomic():
+                SearchQueueEntry.objects.create(model=model_label(model), object_id=pk, action=action, queued=now)
+        except IntegrityError:
+            #Queued by someone else between our update and insert.
+            entries.update(action=action, queued=now)
+
+
+def enqueue_many(model, pks, action):
+    """
+    enqueue() for a batch of objects, a few queries per chunk instead of
+    two per object, for writers that send no signals like bulk_create.
+    """
+    label = model_label(model)
+    pks = list(pks)
+    now = timezone.now()
+    for i in range(0, len(pks), IN_CHUNK_SIZE):
+        chunk = pks[i:i + IN_CHUNK_SIZE]
+        entries = SearchQueueEntry.objects.filter(model=label, object_id__in=chunk)
+        queued = set(entries.values_list('object_id', flat=True))
+        entries.update(action=action, queued=now)
+        missing = [pk for pk in chunk if pk not in queued]
+        try:
+            with transaction.atomic():
+                SearchQueueEntry.objects.bulk_create(
+                    SearchQueueEntry(model=label, object_id=pk, action=action, queued=now) for pk in missing)
+        except IntegrityError:
+            #Some were queued by someone else meanwhile, take them one at a time.
+            for pk in missing:
+                enqueue(model, pk, action)
+
+
+def process_queue(batch_size=500, using=DEFAULT_ALIAS, backend=None):
+    """
+    Send the oldest batch_size queued changes to the search backend and
+    return how many there were. Updates go out as one backend.update()
+    per model. An entry is only dropped once the backend took it, and not
+    at all if it was queued again while we were busy.
+    """
+    entries = list(SearchQueueEntry.objects.order_by('queued', 'id')
+                   .values_list('id', 'model', 'object_id', 'action', 'queued')[:batch_size])
+    if not entries:
+        return 0
+
+    if backend is None:
+        backend = connections[using].get_backend()
+    unified_index = connections[using].get_unified_index()
+
+    grouped = defaultdict(lambda: ([], []))
+    for entry_id, label, object_id, action, queued in entries:
+        updates, deletes = grouped[label]
+        (deletes if action == SearchQueueEntry.DELETE else updates).append(object_id)
+
+    for label, (updates, deletes) in grouped.items():
+        try:
+            model = apps.get_model(label)
+            index = unified_index.get_index(model)
+        except (LookupError, NotHandled):
+            logger.warning('Dropping queued search updates for %s, it is not indexed.', label)
+            continue
+
+        if updates:
+            objects = []
+            for i in range(0, len(updates), IN_CHUNK_SIZE):
+                objects += index.index_queryset(using=using).filter(pk__in=updates[i:i + IN_CHUNK_SIZE])
+            if objects:
+                backend.update(index, objects)
+            #Rows that vanished since they were queued are deleted, or no
+            #longer wanted by index_queryset(); either way they go.
+            found = set(obj.pk for obj in objects)
+            deletes = deletes + [pk for pk in updates if pk not in found]
+        for pk in deletes:
+            backend.remove('%s.%s' % (label, pk))
+        search_index_updated.send(sender=model, object_ids=sorted(set(updates) | set(deletes)))
+
+    _done(entries)
+    return len(entries)
+
+
+def _done(entries):
+    #Each entry binds two parameters.
+    step = IN_CHUNK_SIZE // 2
+    for i in range(0, len(entries), step):
+        match = [Q(id=entry_id, queued=queued) for entry_id, label, object_id, action, queued in entries[i:i + step]]
+        SearchQueueEntry.objects.filter(reduce(operator.or_, match)).delete()
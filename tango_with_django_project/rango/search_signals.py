@@ -0,0 +1,39 @@
+from django.db.models.signals import post_save, post_delete
+from haystack.signals import BaseSignalProcessor
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    """
+    Like haystack's RealtimeSignalProcessor, but instead of calling the
+    search backend from inside the request each save or delete of an
+    indexed model is written to the SearchQueueEntry table. Run
+    `manage.py process_search_queue --loop` to send them on in batches.
+
+    The queue row is written in the same transaction as the change, so a
+    rolled back save never reaches the index and a committed one is never
+    lost if the search engine is down.
+    """
+
+    def setup(self):
+        post_save.connect(self.handle_save)
+        post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        post_save.disconnect(self.handle_save)
+        post_delete.disconnect(self.handle_delete)
+
+    def handle_save(self, sender, instance, **kwargs):
+        self.enqueue(sender, instance, 'update')
+
+    def handle_delete(self, sender, instance, **kwargs):
+        self.enqueue(sender, instance, 'delete')
+
+    def enqueue(self, sender, instance, action):
+        #Haystack loads this class while the app registry is still being
+        #populated, so rango's models can't be imported at the top.
+        from rango.search_queue import enqueue
+
+        for using in self.connection_router.for_write(instance=instance):
+            if sender in self.connections[using].get_unified_index().get_indexed_models():
+                enqueue(sender, instance.pk, action)
+                return
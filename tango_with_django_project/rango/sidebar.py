@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from rango.models import Category
+
+SIDEBAR_LIMIT = getattr(settings, 'RANGO_SIDEBAR_CATEGORIES', 50)
+#Fragments are looked up by the list's current state, this only bounds how
+#long old ones take up room.
+TIMEOUT = getattr(settings, 'RANGO_SIDEBAR_TIMEOUT', 60)
+
+FRAGMENT_KEY = 'rango:cats:%s'
+
+#Marker the active category's <li> is found by, see cats.html.
+ITEM_MARKER = '<li data-cat="%d">'
+
+
+def list_state():
+    """
+    The latest Category.modified, which moves with any change to the
+    category list. One lookup on its index, whatever the table's size.
+    """
+    return Category.objects.aggregate(modified=Max('modified'))['modified']
+
+
+def category_list_html(active_id=None):
+    """
+    The rendered rango/cats.html with the most liked categories, cached
+    under list_state(), so a change from any process is seen at once, and
+    the same state as the page validators in rango.freshness. The active
+    category is marked with a string replace so the same fragment serves
+    every page.
+    """
+    modified = list_state()
+    key = FRAGMENT_KEY % (modified.strftime('%Y%m%d%H%M%S%f') if modified else 0)
+    html = cache.get(key)
+    if html is None:
+        cats = list(Category.objects.order_by('-likes', '-id').only('id', 'name', 'slug')[:SIDEBAR_LIMIT + 1])
+        html = render_to_string('rango/cats.html', {
+            'cats': cats[:SIDEBAR_LIMIT],
+            'more': len(cats) > SIDEBAR_LIMIT})
+        cache.set(key, html, TIMEOUT)
+
+    if active_id is not None:
+        marker = ITEM_MARKER % active_id
+        html = html.replace(marker, marker.replace('<li ', '<li class="active" '), 1)
+    return html
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    #A deleted row leaves nothing to date the change by, so the latest
+    #remaining category's modified moves instead.
+    remaining = list(Category.objects.order_by('-modified').values_list('id', flat=True)[:1])
+    Category.objects.filter(id__in=remaining).update(modified=timezone.now())
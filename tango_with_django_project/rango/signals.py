@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+#Sent after a buffered counter has written its pending increments to the db.
+#deltas maps primary key -> amount added to the counter column.
+counters_flushed = Signal(providing_args=['field', 'deltas'])
+
+#Sent after documents for the model `sender` were written to or removed
+#from the search backend. object_ids lists their primary keys, or is None
+#when the whole model was reindexed.
+search_index_updated = Signal(providing_args=['object_ids'])
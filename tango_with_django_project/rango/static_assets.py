@@ -0,0 +1,112 @@
+"""
+`manage.py collectstatic` copies STATICFILES_DIRS to STATIC_ROOT, where
+every file also gets a fingerprinted copy (css/bootstrap.3f2a9c0d11e4.css)
+and compressible ones a .gz and, if the brotli package is installed, a .br
+variant of it. staticfiles.json maps each name to its fingerprinted copy
+and lists the variants made. StaticAssetMiddleware serves them from that.
+"""
+import gzip
+import io
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#Formats that are compressed already, or too small to gain anything.
+INCOMPRESSIBLE = frozenset(getattr(settings, 'RANGO_STATIC_INCOMPRESSIBLE', (
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.webm', '.mp4', '.woff', '.woff2', '.gz', '.br', '.zip')))
+MIN_SIZE = 256
+
+#Content-Encoding -> file suffix, in the order they're preferred.
+ENCODINGS = OrderedDict([('br', '.br'), ('gzip', '.gz')])
+
+
+def gzip_compress(data):
+    out = io.BytesIO()
+    #No name or time in the header, the same input always gives the same bytes.
+    with gzip.GzipFile(filename='', mode='wb', fileobj=out, compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def brotli_compress(data):
+    return brotli.compress(data, quality=11)
+
+
+COMPRESSORS = {'gzip': gzip_compress, 'br': brotli_compress if brotli else None}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage that also writes precompressed variants of
+    the fingerprinted files, kept only where they are smaller, and records
+    them in the manifest under "encodings".
+
+    Names that were never collected are served unfingerprinted instead of
+    failing, so pages still render before the first collectstatic.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CompressedManifestStaticFilesStorage, self).__init__(*args, **kwargs)
+        self.encodings = self.load_encodings()
+
+    def load_encodings(self):
+        content = self.read_manifest()
+        if content is None:
+            return {}
+        return json.loads(content).get('encodings', {})
+
+    def stored_name(self, name):
+        if self.hash_key(name) not in self.hashed_files and not self.exists(name):
+            return name
+        return super(CompressedManifestStaticFilesStorage, self).stored_name(name)
+
+    def post_process(self, *args, **kwargs):
+        self.encodings = {}
+        for name, hashed_name, processed in super(CompressedManifestStaticFilesStorage, self).post_process(*args, **kwargs):
+            #The manifest is saved once this loop has finished, so it sees every variant.
+            if hashed_name and not isinstance(processed, Exception):
+                made = self.compress(hashed_name, processed)
+                if made:
+                    self.encodings[hashed_name] = made
+            yield name, hashed_name, processed
+
+    def compress(self, name, changed=True):
+        """Write the variants of `name` worth having, returns their encodings."""
+        if name.lower().endswith(tuple(INCOMPRESSIBLE)):
+            return []
+        data = None
+        made = []
+        for encoding, suffix in ENCODINGS.items():
+            compressor = COMPRESSORS[encoding]
+            if compressor is None:
+                continue
+            if not changed and self.exists(name + suffix):
+                made.append(encoding)
+                continue
+            if data is None:
+                with self.open(name) as f:
+                    data = f.read()
+                if len(data) < MIN_SIZE:
+                    return []
+            compressed = compressor(data)
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            if len(compressed) < len(data) * 0.95:
+                self._save(name + suffix, ContentFile(compressed))
+                made.append(encoding)
+        return made
+
+    def save_manifest(self):
+        payload = {'paths': self.hashed_files, 'encodings': self.encodings,
+                   'version': self.manifest_version}
+        if self.exists(self.manifest_name):
+            self.delete(self.manifest_name)
+        self._save(self.manifest_name, ContentFile(json.dumps(payload).encode('utf-8')))
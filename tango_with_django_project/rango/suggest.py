@@ -0,0 +1,261 @@
+import gc
+import heapq
+import threading
+import time
+from collections import namedtuple
+from itertools import chain
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from rango.models import Category
+from rango.query_budget import unbudgeted
+from rango.signals import counters_flushed
+
+TOP_K = getattr(settings, 'RANGO_SUGGEST_TOP_K', 8)
+MAX_AGE = getattr(settings, 'RANGO_SUGGEST_MAX_AGE', 300)
+
+#Just what the category_list template needs, so results never touch the db.
+Suggestion = namedtuple('Suggestion', 'id name slug likes')
+
+
+def _fold(name):
+    return name.lower()
+
+
+def _rank(entry):
+    #Most liked first, then alphabetical so ties are stable.
+    return (-entry.likes, _fold(entry.name), entry.id)
+
+
+class _Node(object):
+    #entries holds the categories ending here, usually one but names that
+    #only differ by case fold onto the same node.
+    __slots__ = ('children', 'entries', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.entries = ()
+        self.top = []
+
+
+class PrefixIndex(object):
+    """
+    Case-folded trie over category names. Every node keeps the top_k
+    entries below it ranked by likes, so a lookup is one walk down the
+    prefix and a slice - no db query and no scan over the matches.
+
+    The trie is built from the db on first use and kept current by the
+    Category signals below, which only fire in this process. Once it is
+    max_age seconds old a background thread builds a new one to pick up
+    other processes' writes, searches keep using the old one until it is
+    swapped in. Writers take a lock; readers don't need one because each
+    node's top list is replaced, never mutated.
+    """
+
+    def __init__(self, top_k=8, max_age=300):
+        self.top_k = top_k
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._root = None
+        self._entries = {}
+        self._loaded_at = 0
+        self._refresher = None
+        #Changes made while the refresher reads the db, replayed onto its trie.
+        #Saves and deletes replay harmlessly, likes flushed just as the read
+        #starts may count twice until the next refresh.
+        self._journal = None
+
+    def search(self, prefix, limit=None):
+        root = self.ensure_built()
+        node = root
+        for ch in _fold(prefix):
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        return node.top[:limit or self.top_k]
+
+    def reset(self):
+        """Forget everything, the next search rebuilds from the db."""
+        with self._lock:
+            self._root = None
+            self._entries = {}
+
+    def update(self, entry):
+        with self._lock:
+            if self._root is None:
+                return
+            if self._journal is not None:
+                self._journal.append((self.update, entry))
+            if entry.id in self._entries:
+                self._remove(self._entries[entry.id])
+            self._insert(entry)
+
+    def remove(self, category_id):
+        with self._lock:
+            if self._root is None:
+                return
+            if self._journal is not None:
+                self._journal.append((self.remove, category_id))
+            if category_id in self._entries:
+                self._remove(self._entries[category_id])
+
+    def add_likes(self, deltas):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((self.add_likes, deltas))
+            for category_id, n in deltas.items():
+                entry = self._entries.get(category_id)
+                if entry is not None:
+                    self._remove(entry)
+                    self._insert(entry._replace(likes=entry.likes + n))
+
+    def ensure_built(self):
+        """Load the trie from the db on first use, and refresh() it once it is older than max_age."""
+        root = self._root
+        if root is None:
+            with self._lock:
+                if self._root is None:
+                    self._load()
+                root = self._root
+        elif time.time() - self._loaded_at > self.max_age:
+            self.refresh()
+        return root
+
+    def refresh(self):
+        """Start rebuilding the trie in a background thread, unless one already is. Returns the thread."""
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh, name='rango-suggest-refresh')
+                self._refresher.daemon = True
+                self._journal = []
+                self._refresher.start()
+            return self._refresher
+
+    def _refresh(self):
+        try:
+            root, entries = self._read()
+            with self._lock:
+                journal, self._journal = self._journal, None
+                self._root, self._entries = root, entries
+                self._loaded_at = time.time()
+                for change, arg in journal:
+                    change(arg)
+        finally:
+            with self._lock:
+                self._journal = None
+                self._refresher = None
+            #This thread's connection isn't needed again.
+            connection.close()
+
+    def _load(self):
+        self._root, self._entries = self._read()
+        self._loaded_at = time.time()
+
+    def _read(self):
+        #Reading every category isn't the request's cost.
+        with unbudgeted():
+            return self._build(Suggestion(*row) for row in
+                               Category.objects.values_list('id', 'name', 'slug', 'likes').iterator())
+
+    def _build(self, entries):
+        #A big trie is millions of small objects, the cyclic gc would keep
+        #rescanning them all while they are allocated.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._fill(entries)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _fill(self, entries):
+        #Builds a new (root, entries) without touching the live trie.
+        root = _Node()
+        by_id = {}
+        for entry in entries:
+            node = root
+            for ch in _fold(entry.name):
+                child = node.children.get(ch)
+                if child is None:
+                    child = node.children[ch] = _Node()
+                node = child
+            node.entries += (entry,)
+            by_id[entry.id] = entry
+
+        #Fill in the top lists bottom up, children before their parents.
+        stack = [(root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if children_done:
+                self._rerank(node)
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children.values())
+        return root, by_id
+
+    def _rerank(self, node):
+        #Most nodes are links in a chain of single letters, they can share
+        #their only child's list instead of ranking it again.
+        if not node.entries and len(node.children) == 1:
+            node.top = next(iter(node.children.values())).top
+            return
+        if not node.children and len(node.entries) == 1:
+            node.top = list(node.entries)
+            return
+        candidates = chain(node.entries, *[child.top for child in node.children.values()])
+        node.top = heapq.nsmallest(self.top_k, candidates, key=_rank)
+
+    def _path(self, name, create=False):
+        path = [self._root]
+        for ch in _fold(name):
+            children = path[-1].children
+            if ch not in children:
+                if not create:
+                    return None
+                children[ch] = _Node()
+            path.append(children[ch])
+        return path
+
+    def _insert(self, entry):
+        path = self._path(entry.name, create=True)
+        path[-1].entries += (entry,)
+        self._entries[entry.id] = entry
+        for node in reversed(path):
+            self._rerank(node)
+
+    def _remove(self, entry):
+        del self._entries[entry.id]
+        path = self._path(entry.name)
+        if path is None:
+            return
+        path[-1].entries = tuple(e for e in path[-1].entries if e.id != entry.id)
+        folded = _fold(entry.name)
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            if depth and not node.entries and not node.children:
+                #Prune nodes that no longer lead anywhere.
+                del path[depth - 1].children[folded[depth - 1]]
+            else:
+                self._rerank(node)
+
+
+category_index = PrefixIndex(TOP_K, MAX_AGE)
+
+
+@receiver(post_save, sender=Category)
+def index_category(sender, instance, **kwargs):
+    category_index.update(Suggestion(instance.id, instance.name, instance.slug, instance.likes))
+
+
+@receiver(post_delete, sender=Category)
+def unindex_category(sender, instance, **kwargs):
+    category_index.remove(instance.id)
+
+
+@receiver(counters_flushed, sender=Category)
+def reindex_likes(sender, field, deltas, **kwargs):
+    if field == 'likes':
+        category_index.add_likes(deltas)
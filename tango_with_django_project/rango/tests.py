@@ -1,6 +1,63 @@
-from django.test import TestCase
-from django.core.urlresolvers import reverse
-from rango.models import Category
+import csv
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.test import RequestFactory, TestCase
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.urlresolvers import resolve, reverse
+from django.db import connection, DEFAULT_DB_ALIAS
+from django import db
+from django.db.models import F
+from django.db.backends import utils as db_utils
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.core.files.base import ContentFile
+from django.http import HttpResponse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.contrib.auth.models import AnonymousUser, User
+from django.core import signing
+from django.core.management import call_command, CommandError
+from django.utils import six, timezone
+from rango.models import Category, Page, CategoryLikeShard, SearchQueueEntry, UserProfile
+from rango import counters, freshness
+from rango.likes import add_like, compact_likes, total_likes, SHARDS
+from rango.suggest import category_index, PrefixIndex
+from rango.views import get_category_list
+from rango import sidebar
+from rango.leaderboards import top_categories, top_pages
+from rango.pagination import decode_cursor, encode_cursor, keyset_page
+from rango.middleware import VISITS_COOKIE, VISITS_SALT, VISIT_WINDOW
+from rango.bulk import CatalogueImporter, read_rows, export_rows
+from rango.search_queue import process_queue
+from rango.management.commands import process_search_queue
+from rango.reindex import default_target, pk_ranges, reindex, LocalTarget
+from rango.fts_backend import UnsupportedQuery
+from haystack import connections as search_connections
+from haystack.query import SearchQuerySet
+from rango.search_cache import normalise, search_results, ResultCache
+from rango.websearch import iter_array, RevalidatingCache, SearchResults, WebSearchClient
+from rango.websearch_stub import StubSearchServer
+from rango import bing_search
+from rango import benchmark, media, metrics, thumbnails
+from rango.thumbnails import make_thumbnails, thumbnail_name
+from rango.uploads import HashingUploadHandler, OversizedUpload, MAX_SIZE
+from rango.forms import EditProfileForm
+from rango import page_cache
+from rango.page_cache import cache_anonymous
+from rango.query_budget import QueryBudgetExceeded, query_budget, unbudgeted
+from PIL import Image
 
 def add_cat(name, views, likes):
     c = Category.objects.get_or_create(name=name)[0]
@@ -9,6 +66,9 @@ def add_cat(name, views, likes):
     c.save()
     return c
 
+def add_page(cat, title, url, views=0):
+    return Page.objects.create(category=cat, title=title, url=url, views=views)
+
 class CategoryMethodTests(TestCase):
     
     def test_ensure_views_are_positive(self):
@@ -41,6 +101,11 @@ class CategoryMethodTests(TestCase):
 
 class IndexViewTests(TestCase):
     
+    def setUp(self):
+        cache.clear()
+        top_categories.invalidate()
+        top_pages.invalidate()
+    
     def test_index_view_with_no_categories(self):
         """
         If no questions exist, an appropriate message should be displayed
@@ -66,3 +131,1813 @@ class IndexViewTests(TestCase):
         
         num_cats = len(response.context['categories'])
         self.assertEqual(num_cats, 4)
+
+class TrackUrlTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        counters.page_views.flush()
+    
+    def test_goto_buffers_click_without_db_access(self):
+        """
+        goto should redirect to the page url from the cache and only buffer
+        the click; the views column changes once the counter is flushed.
+        """
+        page = add_page(add_cat('python', 0, 0), 'Python', 'http://www.python.org/', 3)
+        
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('goto'), {'page_id': page.id})
+        self.assertRedirects(response, 'http://www.python.org/', fetch_redirect_response=False)
+        self.assertEqual(Page.objects.get(id=page.id).views, 3)
+        
+        counters.page_views.flush()
+        self.assertEqual(Page.objects.get(id=page.id).views, 4)
+    
+    def test_goto_with_unknown_page(self):
+        """
+        An unknown or malformed page_id sends the user back to the index
+        and records nothing.
+        """
+        response = self.client.get(reverse('goto'), {'page_id': 999})
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        response = self.client.get(reverse('goto'), {'page_id': 'abc'})
+        self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+        self.assertEqual(counters.page_views.flush(), {})
+    
+    def test_flush_batches_by_increment(self):
+        """
+        Pages with the same number of pending clicks are written by a single
+        UPDATE, so the flush costs one query per distinct increment.
+        """
+        cat = add_cat('django', 0, 0)
+        pages = [add_page(cat, 'Page %d' % i, 'http://example.com/%d' % i) for i in range(4)]
+        for page in pages[:3]:
+            counters.page_views.incr(page.id)
+        counters.page_views.incr(pages[3].id, 5)
+        
+        with CaptureQueriesContext(connection) as queries:
+            deltas = counters.page_views.flush()
+        updates = [q for q in queries.captured_queries if 'UPDATE "rango_page"' in q['sql']]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(deltas[pages[3].id], 5)
+        self.assertEqual([p.views for p in Page.objects.order_by('id')], [1, 1, 1, 5])
+    
+    def test_stop_ends_the_flusher_and_writes_the_rest(self):
+        """
+        stop(), run at exit, waits for the background thread to finish and
+        flushes what it left, so no thread is running into the teardown.
+        """
+        page = add_page(add_cat('python', 0, 0), 'Python', 'http://www.python.org/')
+        counter = counters.BufferedCounter(Page, 'views', flush_interval=60)
+        counter.incr(page.id, 2)
+        self.assertTrue(counter._flusher.is_alive())
+        
+        counter.stop()
+        self.assertFalse(counter._flusher.is_alive())
+        self.assertEqual(Page.objects.get(id=page.id).views, 2)
+
+class LikeCategoryTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user('liker', 'liker@example.com', 'secret')
+        self.client.login(username='liker', password='secret')
+    
+    def test_like_lands_in_shard(self):
+        """
+        Liking a category returns the new total and leaves the Category row
+        alone; the like is stored in one of the category's shards.
+        """
+        cat = add_cat('python', 0, 0)
+        Category.objects.filter(id=cat.id).update(likes=10)
+        
+        response = self.client.get(reverse('like_category'), {'category_id': cat.id})
+        self.assertEqual(response.content, b'11')
+        response = self.client.get(reverse('like_category'), {'category_id': cat.id})
+        self.assertEqual(response.content, b'12')
+        
+        self.assertEqual(Category.objects.get(id=cat.id).likes, 10)
+        self.assertEqual(sum(CategoryLikeShard.objects.values_list('count', flat=True)), 2)
+    
+    def test_like_unknown_category(self):
+        """
+        Liking a category that doesn't exist returns zero and records nothing.
+        """
+        response = self.client.get(reverse('like_category'), {'category_id': 42})
+        self.assertEqual(response.content, b'0')
+        self.assertFalse(CategoryLikeShard.objects.exists())
+    
+    def test_compaction_preserves_total(self):
+        """
+        compact_likes folds the shards into Category.likes without changing
+        the total a reader sees.
+        """
+        cat = add_cat('django', 0, 0)
+        for i in range(20):
+            add_like(cat.id)
+        
+        self.assertEqual(compact_likes(), {cat.id: 20})
+        self.assertEqual(Category.objects.get(id=cat.id).likes, 20)
+        self.assertEqual(sum(CategoryLikeShard.objects.values_list('count', flat=True)), 0)
+        self.assertEqual(total_likes(cat.id), 20)
+        self.assertEqual(compact_likes(), {})
+    
+    def test_total_sees_likes_from_other_processes(self):
+        """
+        The total is read from the db, so likes another worker wrote into
+        the shards count at once, as does a compaction run from cron.
+        """
+        cat = add_cat('python', 0, 0)
+        self.assertEqual(add_like(cat.id), 1)
+        #A shard number add_like never picks, so it can't collide.
+        CategoryLikeShard.objects.create(category=cat, shard=SHARDS, count=4)
+        self.assertEqual(total_likes(cat.id), 5)
+        Category.objects.filter(id=cat.id).update(likes=F('likes') + 2)
+        self.assertEqual(add_like(cat.id), 8)
+
+class SuggestCategoryTests(TestCase):
+    
+    def setUp(self):
+        category_index.reset()
+    
+    def tearDown(self):
+        category_index.reset()
+    
+    def test_suggestions_ranked_by_likes(self):
+        """
+        Suggestions match the prefix case-insensitively, are ordered by likes
+        and come from memory once the index is built.
+        """
+        for name, likes in (('Python', 5), ('pyramid', 9), ('Pylons', 1), ('Django', 50)):
+            Category.objects.create(name=name, likes=likes)
+        category_index.ensure_built()
+        
+        with self.assertNumQueries(0):
+            names = [c.name for c in get_category_list(8, 'PY')]
+        self.assertEqual(names, ['pyramid', 'Python', 'Pylons'])
+        self.assertEqual([c.name for c in get_category_list(2, 'py')], ['pyramid', 'Python'])
+        self.assertEqual(get_category_list(8, 'x'), [])
+        self.assertEqual(get_category_list(8, ''), [])
+    
+    def test_index_follows_saves_and_deletes(self):
+        """
+        Creating, renaming and deleting categories keeps the index current.
+        """
+        python = Category.objects.create(name='Python')
+        category_index.ensure_built()
+        
+        Category.objects.create(name='Perl', likes=3)
+        self.assertEqual([c.name for c in category_index.search('p')], ['Perl', 'Python'])
+        
+        python.name = 'Ruby'
+        python.save()
+        self.assertEqual([c.name for c in category_index.search('p')], ['Perl'])
+        self.assertEqual([c.slug for c in category_index.search('r')], ['ruby'])
+        
+        Category.objects.get(name='Perl').delete()
+        self.assertEqual(category_index.search('p'), [])
+    
+    def test_index_reloads_when_old(self):
+        """
+        Writes the signals don't see, like another process's, are picked up
+        once the index is older than its max_age. The rebuild runs in the
+        background, searches meanwhile get the old index without a query,
+        and changes made during it aren't lost.
+        """
+        Category.objects.create(name='Python')
+        category_index.ensure_built()
+        Category.objects.bulk_create([Category(name='Perl', slug='perl', likes=3)])
+        self.assertEqual([c.name for c in category_index.search('p')], ['Python'])
+        
+        #The test db is in this thread's connection, lend it to the refresher.
+        test_db = db.connections[DEFAULT_DB_ALIAS]
+        test_db.allow_thread_sharing = True
+        self.addCleanup(setattr, test_db, 'allow_thread_sharing', False)
+        start, read = threading.Event(), threading.Event()
+        
+        def read_in_step():
+            start.wait(5)
+            db.connections[DEFAULT_DB_ALIAS] = test_db
+            try:
+                return PrefixIndex._read(category_index)
+            finally:
+                read.set()
+        category_index._read = read_in_step
+        self.addCleanup(delattr, category_index, '_read')
+        
+        category_index._loaded_at -= category_index.max_age + 1
+        with category_index._lock:
+            with self.assertNumQueries(0):
+                self.assertEqual([c.name for c in category_index.search('p')], ['Python'])
+            refresher = category_index._refresher
+            start.set()
+            read.wait(5)
+            Category.objects.create(name='PHP', likes=1)
+        refresher.join()
+        self.assertEqual([c.name for c in category_index.search('p')], ['Perl', 'PHP', 'Python'])
+    
+    def test_suggest_view(self):
+        """
+        The suggest_category view renders the matching categories.
+        """
+        add_cat('Python', 0, 0)
+        response = self.client.get(reverse('suggest_category'), {'suggestion': 'pyt'})
+        self.assertContains(response, '/rango/category/python')
+
+class SidebarTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+    
+    def test_fragment_is_cached(self):
+        """
+        The rendered category list is cached, the second render only looks
+        up the list's state and the active category is highlighted on top
+        of it.
+        """
+        python = add_cat('Python', 0, 0)
+        add_cat('Django', 0, 0)
+        sidebar.category_list_html()
+        
+        with self.assertNumQueries(1):
+            html = sidebar.category_list_html(python.id)
+        self.assertIn('<li class="active" data-cat="%d">' % python.id, html)
+        self.assertEqual(html.count('class="active"'), 1)
+    
+    def test_changes_invalidate_the_fragment(self):
+        """
+        Creating, renaming or deleting a category invalidates the fragment.
+        """
+        python = add_cat('Python', 0, 0)
+        self.assertIn('Python', sidebar.category_list_html())
+        
+        add_cat('Django', 0, 0)
+        self.assertIn('Django', sidebar.category_list_html())
+        
+        python.name = 'Ruby'
+        python.save()
+        html = sidebar.category_list_html()
+        self.assertIn('/rango/category/ruby/', html)
+        self.assertNotIn('Python', html)
+        
+        python.delete()
+        self.assertNotIn('Ruby', sidebar.category_list_html())
+    
+    def test_writes_without_signals_are_seen(self):
+        """
+        An update() that sets modified, like another process's write, is
+        seen on the next render.
+        """
+        python = add_cat('Python', 0, 0)
+        self.assertIn('Python', sidebar.category_list_html())
+        
+        Category.objects.filter(id=python.id).update(name='Ruby', modified=timezone.now())
+        html = sidebar.category_list_html()
+        self.assertIn('Ruby', html)
+        self.assertNotIn('Python', html)
+    
+    def test_sidebar_is_capped(self):
+        """
+        Only the most liked categories are listed.
+        """
+        for i in range(sidebar.SIDEBAR_LIMIT + 5):
+            Category.objects.create(name='Category %d' % i, likes=i)
+        html = sidebar.category_list_html()
+        self.assertEqual(html.count('data-cat='), sidebar.SIDEBAR_LIMIT)
+        self.assertIn('Category %d<' % (sidebar.SIDEBAR_LIMIT + 4), html)
+        self.assertNotIn('Category 0<', html)
+
+class LeaderboardTests(TestCase):
+    
+    def setUp(self):
+        counters.page_views.flush()
+        top_categories.invalidate()
+        top_pages.invalidate()
+    
+    def test_boards_follow_writes(self):
+        """
+        Once loaded, the boards are patched from saves, renames, like
+        compaction and view flushes without querying the db again.
+        """
+        cats = [Category.objects.create(name='Category %d' % i, likes=i) for i in range(7)]
+        pages = [add_page(cats[0], 'Page %d' % i, 'http://example.com/%d' % i, i) for i in range(7)]
+        self.assertEqual([c.likes for c in top_categories.top()], [6, 5, 4, 3, 2])
+        self.assertEqual([p.views for p in top_pages.top()], [6, 5, 4, 3, 2])
+        
+        Category.objects.create(name='Popular', likes=100)
+        cats[0].name = 'Renamed'
+        cats[0].save()
+        with self.assertNumQueries(0):
+            self.assertEqual(top_categories.top()[0].name, 'Popular')
+            self.assertEqual(top_pages.top()[0].category, 'Renamed')
+        
+        counters.page_views.incr(pages[6].id)
+        counters.page_views.incr(pages[1].id, 10)
+        counters.page_views.flush()
+        self.assertEqual([(p.title, p.views) for p in top_pages.top()][:3],
+                         [('Page 1', 11), ('Page 6', 7), ('Page 5', 5)])
+        
+        add_like(cats[1].id)
+        add_like(cats[1].id)
+        add_like(cats[1].id)
+        compact_likes()
+        self.assertEqual([c.likes for c in top_categories.top()], [100, 6, 5, 4, 4])
+    
+    def test_losing_a_member_reloads(self):
+        """
+        Deleting a board member forces a reload so the next row moves up.
+        """
+        pages = [add_page(add_cat('python', 0, 0), 'Page %d' % i, 'http://example.com/%d' % i, i)
+                 for i in range(7)]
+        top_pages.top()
+        pages[6].delete()
+        self.assertEqual([p.views for p in top_pages.top()], [5, 4, 3, 2, 1])
+    
+    def test_index_uses_leaderboards(self):
+        """
+        A warm homepage doesn't sort anything in the db.
+        """
+        add_page(add_cat('python', 0, 0), 'Python', 'http://www.python.org/', 3)
+        self.client.get(reverse('index'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertContains(response, 'Python')
+        self.assertFalse([q for q in queries.captured_queries if 'ORDER BY' in q['sql']])
+
+class CategoryPaginationTests(TestCase):
+    
+    def setUp(self):
+        self.cat = add_cat('python', 0, 0)
+        #Lots of ties on views so the id tie-break matters.
+        for i in range(10):
+            add_page(self.cat, 'Page %d' % i, 'http://example.com/%d' % i, i // 3)
+    
+    def test_walk_every_page(self):
+        """
+        Following the cursors visits every page exactly once in
+        views DESC, id DESC order.
+        """
+        expected = list(Page.objects.filter(category=self.cat).order_by('-views', '-id'))
+        seen, after = [], None
+        while True:
+            pages, after = keyset_page(Page.objects.filter(category=self.cat), after, 3)
+            self.assertTrue(len(pages) <= 3)
+            seen += pages
+            if after is None:
+                break
+        self.assertEqual(seen, expected)
+    
+    def test_cursor_tokens(self):
+        """
+        Cursors round trip and anything else is ignored.
+        """
+        self.assertEqual(decode_cursor(encode_cursor(12, 345)), (12, 345))
+        for junk in ('', 'abc', '!!!', encode_cursor('x', 1), encode_cursor(float('inf'), 1)):
+            self.assertEqual(decode_cursor(junk), None)
+        pages, after = keyset_page(Page.objects.filter(category=self.cat), 'garbage', 3)
+        self.assertEqual(pages[0].title, 'Page 9')
+        response = self.client.get(reverse('category_pages', args=['python']),
+                                   {'after': encode_cursor(float('inf'), 1)})
+        self.assertEqual(response.status_code, 200)
+    
+    def test_json_listing(self):
+        """
+        The JSON variant returns the same pages and the next cursor.
+        """
+        response = self.client.get(reverse('category_pages', args=['python']))
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(data['pages']), 10)
+        self.assertEqual(data['pages'][0]['title'], 'Page 9')
+        self.assertEqual(data['next'], None)
+        
+        response = self.client.get(reverse('category_pages', args=['ruby']))
+        self.assertEqual(response.status_code, 404)
+
+class VisitTrackingTests(TestCase):
+    
+    def setUp(self):
+        #The pages themselves may be cached, the count is read from the context.
+        cache.clear()
+    
+    def set_visits_cookie(self, value):
+        signer = signing.get_cookie_signer(salt=VISITS_COOKIE + VISITS_SALT)
+        self.client.cookies[VISITS_COOKIE] = signer.sign(value)
+    
+    def test_first_visit_sets_cookie_once(self):
+        """
+        The first hit counts a visit and sets the cookie, later hits inside
+        the window neither change the count nor send a cookie or a session.
+        """
+        response = self.client.get(reverse('about'))
+        self.assertEqual(response.context['visits'], 1)
+        self.assertIn(VISITS_COOKIE, response.cookies)
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('about'))
+        self.assertEqual(response.context['visits'], 1)
+        self.assertFalse(response.cookies)
+        self.assertFalse([q for q in queries.captured_queries if 'django_session' in q['sql']])
+    
+    def test_new_visit_after_window(self):
+        """
+        A hit after the window has passed counts as another visit.
+        """
+        self.set_visits_cookie('3:%d' % (time.time() - VISIT_WINDOW - 1))
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['visits'], 4)
+        self.assertTrue(response.cookies[VISITS_COOKIE].value.startswith('4:'))
+    
+    def test_tampered_cookie_starts_over(self):
+        """
+        A cookie that isn't signed by us is ignored.
+        """
+        self.client.cookies[VISITS_COOKIE] = '1000:0'
+        response = self.client.get(reverse('about'))
+        self.assertEqual(response.context['visits'], 1)
+
+class ImportTests(TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+    
+    def write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'wb') as f:
+            f.write(content.encode('utf-8'))
+        return path
+    
+    def test_import_csv_and_jsonl(self):
+        """
+        Both formats create the missing categories and the pages, rows
+        missing a field are skipped.
+        """
+        csv_path = self.write('pages.csv', u'category,title,url,views\n'
+                                           u'Python,Docs,http://docs.python.org/,5\n'
+                                           u'Caf\xe9,Menu,http://example.com/menu,\n'
+                                           u'Python,,http://example.com/missing,1\n')
+        jsonl_path = self.write('pages.jsonl', u'{"category": "Django", "title": "Docs", "url": "http://djangoproject.com/"}\n')
+        
+        call_command('import_rango', csv_path, stdout=open(os.devnull, 'w'))
+        stats = CatalogueImporter().run(read_rows(jsonl_path))
+        
+        self.assertEqual(stats['created'], 1)
+        self.assertEqual(sorted(Category.objects.values_list('name', flat=True)), [u'Caf\xe9', u'Django', u'Python'])
+        self.assertEqual(Page.objects.get(title='Docs', category__name='Python').views, 5)
+        self.assertEqual(Page.objects.count(), 3)
+    
+    def test_upsert_updates_in_place(self):
+        """
+        With upsert an existing (category, title) is updated, not duplicated,
+        and unchanged rows aren't written at all.
+        """
+        page = add_page(add_cat('Python', 0, 0), 'Docs', 'http://old.example.com/', 1)
+        rows = [{'category': 'Python', 'title': 'Docs', 'url': 'http://docs.python.org/', 'views': '7'},
+                {'category': 'Python', 'title': 'Wiki', 'url': 'http://wiki.python.org/', 'views': '2'}]
+        
+        stats = CatalogueImporter(upsert=True).run(rows)
+        self.assertEqual((stats['created'], stats['updated']), (1, 1))
+        page = Page.objects.get(id=page.id)
+        self.assertEqual((page.url, page.views), ('http://docs.python.org/', 7))
+        self.assertEqual(counters.page_url(page.id), 'http://docs.python.org/')
+        
+        stats = CatalogueImporter(upsert=True).run(rows)
+        self.assertEqual((stats['created'], stats['updated']), (0, 0))
+    
+    def test_imported_pages_are_queued_for_search(self):
+        """
+        bulk_create and the batched UPDATE send no signals, so the importer
+        queues the pages it created or changed for the search index itself.
+        """
+        page = add_page(add_cat('Python', 0, 0), 'Docs', 'http://old.example.com/', 1)
+        unchanged = add_page(Category.objects.get(name='Python'), 'Blog', 'http://blog.python.org/', 0)
+        SearchQueueEntry.objects.all().delete()
+        rows = [{'category': 'Python', 'title': 'Docs', 'url': 'http://docs.python.org/', 'views': '7'},
+                {'category': 'Python', 'title': 'Blog', 'url': 'http://blog.python.org/', 'views': '0'},
+                {'category': 'Python', 'title': 'Wiki', 'url': 'http://wiki.python.org/', 'views': '2'}]
+        
+        CatalogueImporter(upsert=True).run(rows)
+        wiki = Page.objects.get(title='Wiki')
+        queued = SearchQueueEntry.objects.filter(model='rango.page').values_list('object_id', 'action')
+        self.assertEqual(sorted(queued), sorted([(page.id, 'update'), (wiki.id, 'update')]))
+        self.assertNotIn(unchanged.id, [object_id for object_id, action in queued])
+    
+    def test_imports_move_the_category_stamp(self):
+        """
+        Imported pages change their category page's validators, see rango.freshness.
+        """
+        add_cat('Python', 0, 0)
+        add_cat('Django', 0, 0)
+        Category.objects.update(pages_modified=timezone.now() - timedelta(days=1))
+        before = dict(Category.objects.values_list('name', 'pages_modified'))
+        CatalogueImporter().run([{'category': 'Python', 'title': 'Docs', 'url': 'http://docs.python.org/'}])
+        after = dict(Category.objects.values_list('name', 'pages_modified'))
+        self.assertGreater(after['Python'], before['Python'])
+        self.assertEqual(after['Django'], before['Django'])
+    
+    def test_checkpoint_resumes(self):
+        """
+        A rerun with the same checkpoint skips the rows already committed.
+        """
+        checkpoint = os.path.join(self.tmp, 'checkpoint.json')
+        rows = [{'category': 'Python', 'title': 'Page %d' % i, 'url': 'http://example.com/%d' % i}
+                for i in range(10)]
+        
+        CatalogueImporter(batch_size=4, checkpoint=checkpoint).run(rows[:6], source='pages')
+        stats = CatalogueImporter(batch_size=4, checkpoint=checkpoint).run(rows, source='pages')
+        self.assertEqual(stats['rows'], 4)
+        self.assertEqual(Page.objects.count(), 10)
+
+class ExportTests(TestCase):
+    
+    def setUp(self):
+        python = add_cat('Python', 0, 0)
+        django = add_cat('Django', 0, 0)
+        for i in range(5):
+            add_page(python, 'Python %d' % i, 'http://example.com/python/%d' % i, i)
+        add_page(django, 'Django docs', 'http://djangoproject.com/', 3)
+    
+    def test_export_everything_in_chunks(self):
+        """
+        Small chunks still yield every category and page exactly once.
+        """
+        rows = list(export_rows(chunk_size=2))
+        self.assertEqual([r['type'] for r in rows], ['category'] * 2 + ['page'] * 6)
+        self.assertEqual(len(set(r['id'] for r in rows if r['type'] == 'page')), 6)
+        self.assertEqual(rows[-1]['category'], 'Django')
+    
+    def test_filters(self):
+        """
+        Exports can be limited to one category and to recent changes.
+        """
+        rows = list(export_rows(category='django'))
+        self.assertEqual([(r['type'], r['category']) for r in rows], [('category', 'Django'), ('page', 'Django')])
+        
+        later = timezone.now()
+        Page.objects.filter(title='Python 3').update(modified=later)
+        rows = list(export_rows(since=later))
+        self.assertEqual([r.get('title') for r in rows], ['Python 3'])
+    
+    def test_command_csv_round_trips(self):
+        """
+        A CSV export can be imported again without creating duplicates.
+        """
+        out = six.StringIO()
+        call_command('export_rango', format='csv', stdout=out)
+        rows = list(csv.DictReader(six.StringIO(out.getvalue())))
+        self.assertEqual(len(rows), 8)
+        
+        stats = CatalogueImporter(upsert=True).run(rows)
+        self.assertEqual((stats['created'], stats['updated'], stats['skipped']), (0, 0, 2))
+    
+    def test_endpoint_is_staff_only(self):
+        """
+        The streaming endpoint is for staff, and returns JSON lines.
+        """
+        response = self.client.get(reverse('export'))
+        self.assertNotEqual(response.status_code, 200)
+        
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.login(username='admin', password='secret')
+        response = self.client.get(reverse('export'), {'category': 'python'})
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(json.loads(lines[1])['title'], 'Python 0')
+        self.assertEqual(self.client.get(reverse('export'), {'since': 'yesterday'}).status_code, 400)
+
+class RecordingBackend(object):
+    """Stands in for the search backend and remembers what it was sent."""
+    
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.updates = []
+        self.removed = []
+    
+    def update(self, index, iterable, commit=True):
+        if self.fail:
+            raise IOError('search engine is down')
+        self.updates.append((index.get_model(), sorted(obj.pk for obj in iterable)))
+    
+    def remove(self, obj_or_string, commit=True):
+        self.removed.append(obj_or_string)
+
+class SearchQueueTests(TestCase):
+    
+    def queued(self):
+        return sorted(SearchQueueEntry.objects.values_list('model', 'action'))
+    
+    def test_saves_are_queued_and_coalesced(self):
+        """
+        Saving the same object repeatedly leaves one entry, and the batch
+        goes out as one update per model.
+        """
+        python = add_cat('Python', 0, 0)
+        python.save()
+        django = add_cat('Django', 0, 0)
+        page = add_page(python, 'Docs', 'http://docs.python.org/')
+        page.save()
+        CategoryLikeShard.objects.create(category=python, shard=0, count=1)
+        self.assertEqual(self.queued(), [('rango.category', 'update')] * 2 + [('rango.page', 'update')])
+        
+        backend = RecordingBackend()
+        self.assertEqual(process_queue(backend=backend), 3)
+        self.assertEqual(sorted(backend.updates, key=lambda update: update[0].__name__), [(Category, [python.id, django.id]), (Page, [page.id])])
+        self.assertFalse(SearchQueueEntry.objects.exists())
+        self.assertEqual(process_queue(backend=backend), 0)
+    
+    def test_delete_replaces_update(self):
+        """
+        An object saved then deleted before the worker runs is only removed.
+        """
+        page = add_page(add_cat('Python', 0, 0), 'Docs', 'http://docs.python.org/')
+        page_id = page.id
+        page.delete()
+        SearchQueueEntry.objects.filter(model='rango.category').delete()
+        self.assertEqual(self.queued(), [('rango.page', 'delete')])
+        
+        backend = RecordingBackend()
+        process_queue(backend=backend)
+        self.assertEqual(backend.updates, [])
+        self.assertEqual(backend.removed, ['rango.page.%d' % page_id])
+    
+    def test_failed_batch_stays_queued(self):
+        """
+        Nothing is dropped when the backend fails, so the next run retries.
+        """
+        add_cat('Python', 0, 0)
+        with self.assertRaises(IOError):
+            process_queue(backend=RecordingBackend(fail=True))
+        self.assertEqual(self.queued(), [('rango.category', 'update')])
+    
+    def test_worker_loop_outlives_backend_errors(self):
+        """
+        process_search_queue --loop logs a failed batch and retries it
+        rather than exiting.
+        """
+        add_cat('Python', 0, 0)
+        backends = [RecordingBackend(fail=True), RecordingBackend()]
+        
+        def process(batch_size, using, backend):
+            if not backends:
+                raise KeyboardInterrupt
+            return process_queue(batch_size, using, backends.pop(0))
+        self.addCleanup(setattr, process_search_queue, 'process_queue', process_search_queue.process_queue)
+        process_search_queue.process_queue = process
+        
+        logged = []
+        
+        class Handler(logging.Handler):
+            def emit(self, record):
+                logged.append(record)
+        
+        handler = Handler()
+        process_search_queue.logger.addHandler(handler)
+        self.addCleanup(process_search_queue.logger.removeHandler, handler)
+        with self.assertRaises(KeyboardInterrupt):
+            call_command('process_search_queue', loop=True, interval=0, stdout=six.StringIO())
+        self.assertEqual(len(logged), 1)
+        self.assertIn('search engine is down', str(logged[0].exc_info[1]))
+        self.assertEqual(self.queued(), [])
+    
+    def test_requeued_while_processing_is_kept(self):
+        """
+        A save that lands while its old entry is being sent is not lost.
+        """
+        python = add_cat('Python', 0, 0)
+        
+        class SavingBackend(RecordingBackend):
+            def update(self, index, iterable, commit=True):
+                super(SavingBackend, self).update(index, iterable, commit)
+                python.save()
+        
+        process_queue(backend=SavingBackend())
+        self.assertEqual(self.queued(), [('rango.category', 'update')])
+
+class ReindexTests(TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        python = add_cat('Python', 0, 0)
+        for i in range(7):
+            add_page(python, 'Python %d' % i, 'http://example.com/python/%d' % i)
+    
+    def test_pk_ranges(self):
+        """
+        Ranges cover every id once, however sparse the ids are.
+        """
+        Page.objects.filter(title__in=['Python 1', 'Python 2']).delete()
+        ranges = pk_ranges(Page.objects.all(), 2)
+        ids = Page.objects.values_list('id', flat=True)
+        self.assertEqual(sorted(i for i in ids for lo, hi in ranges if lo <= i < hi), sorted(ids))
+        self.assertEqual(pk_ranges(Page.objects.none(), 2), [])
+    
+    def test_rebuild_and_swap(self):
+        """
+        Every document lands in a fresh build that then becomes the live one,
+        and the build it replaced is removed.
+        """
+        target = LocalTarget(self.directory)
+        stats = reindex(target, chunk_size=3, batch_size=2)
+        self.assertEqual(stats['documents'], {'rango.category': 1, 'rango.page': 7})
+        self.assertEqual(stats['chunks_done'], stats['chunks'])
+        first = os.path.realpath(target.current)
+        docs = target.documents()
+        self.assertEqual(sorted(d['id'] for d in docs if d['django_ct'] == 'rango.page'),
+                         sorted('rango.page.%d' % p.id for p in Page.objects.all()))
+        
+        Page.objects.filter(title='Python 0').delete()
+        reindex(target, models=[Page], chunk_size=100)
+        self.assertEqual(len(target.documents()), 7)
+        self.assertFalse(os.path.exists(first))
+    
+    def test_one_model_keeps_the_others(self):
+        """
+        Rebuilding only pages leaves the live categories searchable.
+        """
+        use_search_file(self)
+        target = default_target()
+        reindex(target)
+        Page.objects.filter(title='Python 0').delete()
+        reindex(target, models=[Page])
+        self.assertEqual([r.object.name for r in SearchQuerySet().models(Category).filter(content='python')],
+                         ['Python'])
+        self.assertEqual(SearchQuerySet().models(Page).filter(content='python').count(), 6)
+    
+    def test_failed_build_is_discarded(self):
+        """
+        A build that fails part way is removed and the live index is kept.
+        """
+        target = LocalTarget(self.directory)
+        reindex(target)
+        live = os.path.realpath(target.current)
+        
+        def fail(stats):
+            raise RuntimeError('indexing failed')
+        self.assertRaises(RuntimeError, reindex, target, chunk_size=3, progress=fail)
+        self.assertEqual(os.path.realpath(target.current), live)
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([target.name, os.path.basename(live)]))
+    
+    def test_command(self):
+        """
+        The command reports progress and a summary.
+        """
+        out = six.StringIO()
+        call_command('reindex', 'rango.page', local=self.directory, workers=1, chunk_size=4, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('1/2 chunks'))
+        self.assertIn('rango.page: 7', lines[-1])
+
+def use_search_file(test):
+    """Point the default search connection at a throwaway FTS database for one test."""
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory)
+    backend = search_connections['default'].get_backend()
+    test.addCleanup(setattr, backend, 'path', backend.path)
+    backend.path = search_connections['default'].options['PATH'] = os.path.join(directory, 'search.sqlite3')
+    test.addCleanup(search_connections['default'].options.__setitem__, 'PATH', backend.path)
+    return backend
+
+class FTSBackendTests(TestCase):
+    
+    def setUp(self):
+        self.backend = use_search_file(self)
+        self.python = add_cat('Python', 0, 0)
+        self.pages = [add_page(self.python, title, url) for title, url in [
+            ('Official Python Tutorial', 'http://docs.python.org/tutorial/'),
+            ('Python <b>Cookbook</b>', 'http://code.activestate.com/recipes/langs/python/'),
+            ('Learning Java', 'http://java.com/'),
+        ]]
+        unified_index = search_connections['default'].get_unified_index()
+        self.backend.update(unified_index.get_index(Category), [self.python])
+        self.backend.update(unified_index.get_index(Page), self.pages)
+    
+    def search(self, query, **kwargs):
+        return [r.pk for r in SearchQuerySet().auto_query(query).filter(**kwargs)]
+    
+    def test_ranking_prefix_phrase_and_exclusion(self):
+        """
+        Matches come back best first, and the query syntax reaches FTS5.
+        """
+        results = SearchQuerySet().auto_query('python')
+        self.assertEqual(results.count(), 3)
+        self.assertEqual(results[0].model, Category)
+        self.assertEqual(self.search('tutor*'), [str(self.pages[0].id)])
+        self.assertEqual(self.search('"tutorial python"'), [])
+        self.assertEqual(self.search('"official python"'), [str(self.pages[0].id)])
+        self.assertEqual(sorted(self.search('-cookbook python')),
+                         sorted([str(self.python.id), str(self.pages[0].id)]))
+        self.assertEqual(self.search('NEAR( OR "'), [])
+    
+    def test_field_queries_are_refused(self):
+        """
+        Only the document field is searchable, filtering on another field
+        raises a search backend error rather than ignoring the filter.
+        """
+        self.assertRaises(UnsupportedQuery, SearchQuerySet().filter(title='python').count)
+    
+    def test_highlight(self):
+        """
+        Matched terms are wrapped in <em>, the rest stays escaped.
+        """
+        result = SearchQuerySet().auto_query('cookbook').highlight()[0]
+        self.assertEqual(result.highlighted['text'][0].split('\n')[0], 'Python &lt;b&gt;<em>Cookbook</em>&lt;/b&gt;')
+    
+    def test_update_remove_and_clear(self):
+        """
+        Documents are replaced rather than duplicated and can be removed.
+        """
+        page = self.pages[2]
+        page.title = 'Learning Python'
+        self.backend.update(search_connections['default'].get_unified_index().get_index(Page), [page])
+        self.assertEqual(SearchQuerySet().auto_query('learning').count(), 1)
+        self.assertEqual(SearchQuerySet().auto_query('python').count(), 4)
+        self.backend.remove(page)
+        self.assertEqual(SearchQuerySet().auto_query('learning').count(), 0)
+        self.backend.clear([Page])
+        self.assertEqual([r.model for r in SearchQuerySet().auto_query('python')], [Category])
+    
+    def test_reindex_and_search_view(self):
+        """
+        A rebuild replaces the database file under the running backend, and
+        /search/ shows highlighted results from it.
+        """
+        add_page(self.python, 'Dive Into Python', 'http://diveintopython.net/')
+        stats = reindex(default_target())
+        self.assertEqual(stats['documents'], {'rango.category': 1, 'rango.page': 4})
+        response = self.client.get('/search/', {'q': 'dive'})
+        self.assertContains(response, '<em>Dive</em> Into Python')
+
+class SearchCacheTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        search_results.clear()
+        use_search_file(self)
+        python = add_cat('Python', 0, 0)
+        add_page(python, 'Official Python Tutorial', 'http://docs.python.org/tutorial/')
+        process_queue()
+    
+    def test_normalise(self):
+        """
+        Case, spacing, stopwords and word order don't matter, phrases do.
+        """
+        self.assertEqual(normalise('The  Python TUTORIAL '), 'python tutorial')
+        self.assertEqual(normalise('tutorial for python python'), 'python tutorial')
+        self.assertEqual(normalise('"Dive into" -the python'), '"dive into" python')
+        self.assertEqual(normalise('to be or not'), 'not')
+        self.assertEqual(normalise('to be'), 'be to')
+    
+    def test_lru_and_ttl(self):
+        """
+        The least recently used entry goes first, and entries expire.
+        """
+        results = ResultCache(size=2, ttl=60)
+        results.set('a', (), 1)
+        results.set('b', (), 2)
+        results.get('a', ())
+        results.set('c', (), 3)
+        self.assertEqual((results.get('a', ()), results.get('b', ()), results.get('c', ())), (1, None, 3))
+        self.assertEqual(results.stats()['evicted'], 1)
+        
+        results.ttl = -1
+        results.set('d', (), 4)
+        self.assertIsNone(results.get('d', ()))
+        self.assertEqual(results.stats()['expired'], 1)
+    
+    def test_equivalent_queries_share_results(self):
+        """
+        A repeated search is answered without the backend, the only queries
+        are the ones checking the generations and the sidebar's list state.
+        """
+        response = self.client.get('/search/', {'q': 'Python tutorial'})
+        self.assertContains(response, 'Official Python Tutorial')
+        with self.assertNumQueries(2):
+            response = self.client.get('/search/', {'q': 'the  tutorial PYTHON'})
+        self.assertContains(response, 'Official Python Tutorial')
+        stats = search_results.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+    
+    def test_index_updates_invalidate(self):
+        """
+        Once the queue worker indexes a page, searches covering pages miss.
+        """
+        self.client.get('/search/', {'q': 'python'})
+        self.client.get('/search/', {'q': 'python', 'models': 'rango.category'})
+        add_page(Category.objects.get(name='Python'), 'Python Cookbook', 'http://example.com/cookbook/')
+        process_queue()
+        
+        response = self.client.get('/search/', {'q': 'python'})
+        self.assertContains(response, 'Python Cookbook')
+        self.client.get('/search/', {'q': 'python', 'models': 'rango.category'})
+        stats = search_results.stats()
+        self.assertEqual((stats['hits'], stats['invalidated']), (1, 1))
+    
+    def test_stats_are_staff_only(self):
+        """
+        Hit and miss counts are for staff.
+        """
+        self.assertNotEqual(self.client.get(reverse('search_cache_stats')).status_code, 200)
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.login(username='admin', password='secret')
+        self.assertEqual(json.loads(self.client.get(reverse('search_cache_stats')).content.decode('utf-8'))['misses'], 0)
+
+class WebSearchTests(TestCase):
+    
+    def setUp(self):
+        self.server = StubSearchServer(total=25)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+    
+    def client_for(self, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        client = WebSearchClient(self.server.url, pages=3, per_page=10, **kwargs)
+        self.addCleanup(client.close)
+        return client
+    
+    def test_iter_array_streams(self):
+        """
+        Objects are decoded however the body is split into chunks.
+        """
+        body = json.dumps({'d': {'results': [{'Title': u'caf\xe9 %d' % i} for i in range(3)]}}, ensure_ascii=False)
+        body = body.encode('utf-8')
+        chunks = [body[i:i + 5] for i in range(0, len(body), 5)]
+        self.assertEqual([r['Title'] for r in iter_array(chunks)], [u'caf\xe9 0', u'caf\xe9 1', u'caf\xe9 2'])
+        with self.assertRaises(ValueError):
+            list(iter_array([body[:len(body) // 2]]))
+    
+    def test_pages_are_fetched_concurrently(self):
+        """
+        All pages are requested at once and come back in order.
+        """
+        self.server.delay = 0.2
+        started = time.time()
+        results = self.client_for().search('rango')
+        self.assertLess(time.time() - started, 0.55)
+        self.assertTrue(results.ok)
+        self.assertEqual([r['link'] for r in results], ['http://example.com/%d' % i for i in range(25)])
+        self.assertEqual(self.server.max_in_flight, 3)
+    
+    def test_retries_with_backoff(self):
+        """
+        Failed requests are retried on the pooled session.
+        """
+        self.server.fail = 2
+        results = self.client_for().search('rango', pages=1)
+        self.assertTrue(results.ok)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(self.server.requests, 3)
+    
+    def test_errors_are_values(self):
+        """
+        Timeouts, bad responses and dead servers end up in .errors.
+        """
+        self.server.broken = True
+        results = self.client_for().search('rango', pages=1)
+        #The objects before the cut still arrive.
+        self.assertEqual((len(results), len(results.errors)), (4, 1))
+        
+        self.server.broken = False
+        self.server.fail = 10
+        self.assertEqual(len(self.client_for(retries=1).search('rango').errors), 3)
+        
+        self.server.fail = 0
+        self.server.delay = 1
+        results = self.client_for(timeout=0.2, retries=0).search('rango', pages=1)
+        self.assertIn('timed out', results.errors[0])
+        
+        original = bing_search.client
+        self.addCleanup(setattr, bing_search, 'client', original)
+        bing_search.client = WebSearchClient('http://127.0.0.1:1/Web', retries=0)
+        self.assertEqual(len(bing_search.run_query('rango').errors), 3)
+
+class RevalidatingCacheTests(TestCase):
+    
+    def setUp(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+    
+    def fetch(self, terms):
+        self.calls.append(terms)
+        self.release.wait()
+        return SearchResults([{'title': '%s %d' % (terms, len(self.calls))}])
+    
+    def wait_for_refresh(self, results):
+        for i in range(100):
+            if not results._refreshing:
+                return
+            time.sleep(0.01)
+    
+    def test_fresh_answers_are_reused(self):
+        """
+        Answers are shared by terms that only differ in case and spacing.
+        """
+        results = RevalidatingCache(self.fetch, ttl=60)
+        self.assertEqual(results.get('Rango')[0]['title'], 'Rango 1')
+        self.assertEqual(results.get(' rango ')[0]['title'], 'Rango 1')
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual((results.stats()['hits'], results.stats()['misses']), (1, 1))
+    
+    def test_stale_answers_refresh_once_in_the_background(self):
+        """
+        Stale answers come back at once while a single refresh runs.
+        """
+        results = RevalidatingCache(self.fetch, ttl=0, stale_ttl=60)
+        results.get('rango')
+        self.release.clear()
+        self.assertEqual([results.get('rango')[0]['title'] for i in range(3)], ['rango 1'] * 3)
+        self.release.set()
+        self.wait_for_refresh(results)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(results.get('rango')[0]['title'], 'rango 2')
+        self.wait_for_refresh(results)
+        
+        results.stale_ttl = 0
+        self.assertEqual(results.get('rango')[0]['title'], 'rango 4')
+    
+    def test_concurrent_misses_share_one_fetch(self):
+        """
+        Callers missing on the same terms at once wait for one fetch.
+        """
+        results = RevalidatingCache(self.fetch)
+        self.release.clear()
+        answers = []
+        threads = [threading.Thread(target=lambda: answers.append(results.get('rango'))) for i in range(5)]
+        for t in threads:
+            t.start()
+        for i in range(100):
+            if results.stats()['coalesced'] == 4:
+                break
+            time.sleep(0.01)
+        self.release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual([a[0]['title'] for a in answers], ['rango 1'] * 5)
+    
+    def test_errors_are_not_cached(self):
+        """
+        An answer with errors is returned but asked for again next time.
+        """
+        results = RevalidatingCache(lambda terms: self.calls.append(terms) or SearchResults([], ['page 1: down']))
+        self.assertEqual(results.get('rango').errors, ['page 1: down'])
+        results.get('rango')
+        self.assertEqual((len(self.calls), results.stats()['errors']), (2, 2))
+
+class ThumbnailTests(TestCase):
+    
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media = override_settings(MEDIA_ROOT=self.media, RANGO_THUMBNAIL_WORKERS=0)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user('snap', password='secret')
+        self.profile = UserProfile.objects.create(user=self.user)
+    
+    def png(self, name='me.png', size=(300, 200), colour=(200, 40, 40, 128)):
+        out = six.BytesIO()
+        Image.new('RGBA', size, colour).save(out, 'PNG')
+        return SimpleUploadedFile(name, out.getvalue(), content_type='image/png')
+    
+    def url(self, size, format='jpg'):
+        return '/media/' + thumbnail_name(self.profile.picture.name, size, format)
+    
+    def test_thumbnails_of_every_size_next_to_the_original(self):
+        self.profile.picture = self.png()
+        self.profile.save()
+        name = self.profile.picture.name
+        self.assertEqual(make_thumbnails(self.profile.id, name), (64, 128, 256))
+        
+        for size in (64, 128, 256):
+            for format in ('jpg', 'webp'):
+                path = os.path.join(self.media, thumbnail_name(name, size, format))
+                self.assertEqual(Image.open(path).size, (size, size))
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.thumbnail_sizes, '64,128,256')
+        self.assertEqual(self.profile.avatar_url(100), self.url(128))
+        self.assertEqual(self.profile.avatar_url(48, 'webp'), self.url(64, 'webp'))
+        self.assertEqual(self.profile.avatar_url(512), self.url(256))
+    
+    def test_original_until_thumbnails_are_made(self):
+        self.assertEqual(self.profile.avatar_url(64), None)
+        self.profile.picture = self.png()
+        self.profile.save()
+        old = self.profile.picture.name
+        self.assertEqual(self.profile.avatar_url(64), '/media/' + old)
+        
+        #A job for a picture that has since been replaced records nothing.
+        make_thumbnails(self.profile.id, old)
+        self.profile.picture = self.png('new.png', colour=(0, 0, 255, 255))
+        self.profile.save()
+        thumbnails.schedule(self.profile)
+        self.assertEqual(self.profile.avatar_url(64), self.url(64))
+        make_thumbnails(self.profile.id, old)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_url(64), self.url(64))
+        self.assertNotEqual(self.url(64), '/media/' + thumbnail_name(old, 64))
+    
+    def test_upload_from_profile_page(self):
+        self.client.login(username='snap', password='secret')
+        response = self.client.post(reverse('profile'), {
+            'first_name': 'Snap', 'last_name': 'Shot', 'email': 'snap@example.com', 'picture': self.png()})
+        self.assertEqual(response.status_code, 302)
+        
+        response = self.client.get(reverse('profile'))
+        self.profile.refresh_from_db()
+        self.assertContains(response, '<source srcset="%s" type="image/webp">' % self.url(128, 'webp'))
+        self.assertContains(response, 'src="%s"' % self.url(128))
+
+class UploadTests(TestCase):
+    
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media = override_settings(MEDIA_ROOT=self.media, RANGO_THUMBNAIL_WORKERS=0)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.storage = UserProfile._meta.get_field('picture').storage
+    
+    def upload(self, data, max_size=1024, chunk_size=100, announced=None):
+        #Feed data through the handler the way the multipart parser does.
+        handler = HashingUploadHandler(max_size=max_size)
+        try:
+            handler.new_file('picture', 'Me.PNG', 'image/png', announced)
+        except StopFutureHandlers:
+            pass
+        for start in range(0, len(data), chunk_size):
+            handler.receive_data_chunk(data[start:start + chunk_size], start)
+        return handler.file_complete(len(data))
+    
+    def test_same_content_is_stored_once(self):
+        data = b'picture' * 100
+        first = self.storage.save('profile_images/Me.PNG', ContentFile(data))
+        second = self.storage.save('profile_images/other.png', self.upload(data))
+        
+        digest = hashlib.sha256(data).hexdigest()
+        self.assertEqual(first, 'profile_images/%s/%s/%s.png' % (digest[:2], digest[2:4], digest))
+        self.assertEqual(second, first)
+        self.assertEqual(os.listdir(os.path.dirname(self.storage.path(first))), [os.path.basename(first)])
+        with self.storage.open(first) as f:
+            self.assertEqual(f.read(), data)
+    
+    def test_upload_is_hashed_while_streamed_to_disk(self):
+        data = os.urandom(1000)
+        upload = self.upload(data)
+        self.assertEqual(upload.sha256, hashlib.sha256(data).hexdigest())
+        temporary = upload.temporary_file_path()
+        
+        name = self.storage.save('profile_images/Me.PNG', upload)
+        self.assertTrue(name.endswith(upload.sha256 + '.png'))
+        #Moved into place rather than copied.
+        self.assertFalse(os.path.exists(temporary))
+        upload.close()
+    
+    def test_oversized_uploads_are_dropped_and_refused(self):
+        for upload in (self.upload(b'x' * 1025), self.upload(b'x' * 10, announced=5000)):
+            self.assertIsInstance(upload, OversizedUpload)
+            self.assertEqual(upload.read(), b'')
+        
+        form = EditProfileForm(files={'picture': OversizedUpload('big.png', 'image/png', MAX_SIZE + 1)})
+        self.assertFalse(form.is_valid())
+        self.assertIn('at most', form.errors['picture'][0])
+    
+    def test_oversized_body_is_refused_unread(self):
+        """
+        A body too big for an acceptable picture gets a 413 from the
+        profile view before any of it is read or the view runs.
+        """
+        User.objects.create_user('jo', 'jo@example.com', 'secret')
+        request = RequestFactory().post(reverse('profile'), {'picture': SimpleUploadedFile('me.png', b'x')})
+        request.user = User.objects.get(username='jo')
+        request.META['CONTENT_LENGTH'] = str(MAX_SIZE * 2)
+        unread = request._stream.remaining
+        
+        response = resolve(reverse('profile')).func(request)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(request._stream.remaining, unread)
+    
+    def test_other_views_keep_the_default_handlers(self):
+        """
+        Only the picture upload views install the hashing handler.
+        """
+        request = RequestFactory().post('/rango/add_category/')
+        self.assertNotIn(HashingUploadHandler, [type(handler) for handler in request.upload_handlers])
+
+class StaticAssetTests(TestCase):
+    
+    def setUp(self):
+        source, root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        self.addCleanup(shutil.rmtree, root)
+        os.makedirs(os.path.join(source, 'css'))
+        self.css = b'body { background: url("../images/rango.jpg"); }\n' + b'p { margin: 0; }\n' * 100
+        with open(os.path.join(source, 'css', 'site.css'), 'wb') as f:
+            f.write(self.css)
+        os.makedirs(os.path.join(source, 'images'))
+        with open(os.path.join(source, 'images', 'rango.jpg'), 'wb') as f:
+            f.write(os.urandom(1000))
+        
+        static = override_settings(STATIC_ROOT=root, STATICFILES_DIRS=(source,),
+            STATICFILES_FINDERS=('django.contrib.staticfiles.finders.FileSystemFinder',))
+        static.enable()
+        self.addCleanup(static.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.site_css = staticfiles_storage.stored_name('css/site.css')
+    
+    def get(self, name, encoding='gzip, deflate, br', **extra):
+        return self.client.get(settings.STATIC_URL + name, HTTP_ACCEPT_ENCODING=encoding, **extra)
+    
+    def test_collectstatic_fingerprints_and_compresses(self):
+        self.assertRegexpMatches(self.site_css, r'^css/site\.[0-9a-f]{12}\.css$')
+        self.assertEqual(staticfiles_storage.url('css/site.css'), '/static/' + self.site_css)
+        with staticfiles_storage.open(self.site_css + '.gz') as f:
+            css = gzip.GzipFile(fileobj=f).read()
+        #References in css point at the fingerprinted files too.
+        self.assertIn(staticfiles_storage.stored_name('images/rango.jpg').encode('ascii'), css)
+        
+        manifest = json.loads(staticfiles_storage.read_manifest())
+        self.assertIn('gzip', manifest['encodings'][self.site_css])
+        self.assertNotIn(staticfiles_storage.stored_name('images/rango.jpg'), manifest['encodings'])
+        #Names that were never collected don't break templates.
+        self.assertEqual(staticfiles_storage.url('css/missing.css'), '/static/css/missing.css')
+    
+    def test_fingerprinted_files_are_immutable_and_precompressed(self):
+        response = self.get(self.site_css, 'gzip;q=1.0, identity; q=0.5, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertTrue(response['Content-Type'].startswith('text/css'))
+        body = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertLess(len(body), len(self.css) // 4)
+        
+        response = self.get(self.site_css, '')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn(b'p { margin: 0; }', b''.join(response.streaming_content))
+        
+        etag = self.get(self.site_css)['ETag']
+        self.assertEqual(self.get(self.site_css, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+    
+    def test_plain_names_are_cached_briefly(self):
+        response = self.get('css/site.css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=300')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(self.get('css/nothing.css').status_code, 404)
+
+class MediaServingTests(TestCase):
+    
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media_root = override_settings(MEDIA_ROOT=self.media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        os.makedirs(os.path.join(self.media, 'video'))
+        self.data = os.urandom(1000)
+        with open(os.path.join(self.media, 'video', 'stair.webm'), 'wb') as f:
+            f.write(self.data)
+        self.url = reverse('media', args=['video/stair.webm'])
+    
+    def body(self, response):
+        return b''.join(response.streaming_content)
+    
+    def test_byte_ranges(self):
+        response = self.client.get(self.url)
+        self.assertEqual((response.status_code, response['Accept-Ranges']), (200, 'bytes'))
+        self.assertEqual(response['Content-Type'], 'video/webm')
+        self.assertEqual(self.body(response), self.data)
+        
+        for header, first, last in (('bytes=100-199', 100, 199), ('bytes=900-', 900, 999),
+                                    ('bytes=-10', 990, 999), ('bytes=990-5000', 990, 999)):
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response['Content-Range'], 'bytes %d-%d/1000' % (first, last))
+            self.assertEqual(self.body(response), self.data[first:last + 1])
+            self.assertEqual(int(response['Content-Length']), last - first + 1)
+        
+        response = self.client.get(self.url, HTTP_RANGE='bytes=1000-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */1000'))
+        #A Range for another version of the file gets the whole of this one.
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+    
+    def test_conditional_requests(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        self.assertEqual(self.client.get(reverse('media', args=['../settings.py'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('media', args=['video'])).status_code, 404)
+    
+    def test_offload_to_the_front_proxy(self):
+        self.addCleanup(setattr, media, 'OFFLOAD', media.OFFLOAD)
+        media.OFFLOAD = 'x-accel-redirect'
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/video/stair.webm')
+        self.assertEqual(response.content, b'')
+        
+        media.OFFLOAD = 'x-sendfile'
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.media, 'video', 'stair.webm'))
+
+class MetricsTests(TestCase):
+    
+    def setUp(self):
+        metrics.reset()
+        add_cat('Python', 10, 5)
+    
+    def test_histogram_quantiles(self):
+        histogram = metrics.Histogram()
+        for ms in range(1, 101):
+            histogram.add(ms / 1000.0)
+        for q, expected in ((0.5, 0.05), (0.95, 0.095), (0.99, 0.099)):
+            self.assertAlmostEqual(histogram.quantile(q), expected, delta=expected * 0.2)
+        self.assertEqual((histogram.count, round(histogram.sum, 6)), (100, 5.05))
+        
+        fast = metrics.Histogram()
+        fast.add(0)
+        self.assertEqual(fast.quantile(0.5), 0.0)
+    
+    def test_query_counts_are_exact(self):
+        tally = metrics.Tally()
+        for queries in [0] * 50 + [3] * 45 + [17] * 5:
+            tally.add(queries)
+        self.assertEqual([tally.quantile(q) for q in (0.5, 0.95, 0.99)], [0, 3, 17])
+        self.assertEqual((tally.count, tally.sum), (100, 220))
+        self.assertEqual(metrics.Tally().quantile(0.5), 0)
+    
+    def test_requests_are_measured_per_url_name(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        self.client.get(reverse('category', args=['python']))
+        
+        stats = metrics.snapshot()
+        index = stats['index']
+        self.assertEqual(index.requests, 2)
+        self.assertEqual(index.histograms['seconds'].count, 2)
+        self.assertGreater(index.histograms['queries'].sum, 0)
+        self.assertGreater(index.histograms['query_seconds'].sum, 0)
+        self.assertGreater(index.histograms['template_seconds'].sum, 0)
+        self.assertGreater(index.cache_hits + index.cache_misses, 0)
+        self.assertEqual(stats['category'].requests, 1)
+    
+    def test_threads_record_separately(self):
+        def request():
+            metrics.start()
+            metrics.finish('about', 500)
+        threads = [threading.Thread(target=request) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        about = metrics.snapshot()['about']
+        self.assertEqual((about.requests, about.errors), (4, 4))
+    
+    def test_metrics_page_is_for_staff(self):
+        self.client.get(reverse('index'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.login(username='admin', password='secret')
+        response = self.client.get(reverse('metrics'))
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE rango_request_seconds summary', response.content.decode('utf-8'))
+        self.assertRegexpMatches(response.content.decode('utf-8'),
+                                 r'rango_request_queries\{view="index",quantile="0.95"\} [0-9.e+-]+\n')
+        self.assertIn('rango_requests_total{view="index"} 1\n', response.content.decode('utf-8'))
+
+class BenchmarkTests(TestCase):
+    
+    def test_synthetic_catalogue_is_skewed(self):
+        self.assertEqual(benchmark.generate(500, 20), (20, 500))
+        sizes = sorted((category.page_set.count() for category in Category.objects.all()), reverse=True)
+        self.assertGreater(sizes[0], 5 * sizes[-1])
+        likes = sorted(Category.objects.values_list('likes', flat=True), reverse=True)
+        self.assertEqual(likes[:3], [1000, 500, 333])
+        #The same catalogue is reused, not added again.
+        self.assertEqual(benchmark.generate(500, 20), (20, 500))
+        benchmark.remove()
+        self.assertEqual((Category.objects.count(), Page.objects.count()), (0, 0))
+    
+    def test_json_report(self):
+        out = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(out))
+        call_command('bench_rango', pages=1000, endpoints=['index', 'category', 'track_url', 'like_category'],
+                     requests=12, clients=1, output=out, stderr=six.StringIO())
+        with open(out) as f:
+            report = json.load(f)
+        self.assertEqual(report['pages'], 1000)
+        self.assertEqual(sorted(report['endpoints']), ['category', 'index', 'like_category', 'track_url'])
+        for name, endpoint in report['endpoints'].items():
+            self.assertEqual((endpoint['requests'], endpoint['errors']), (12, 0), name)
+            self.assertLessEqual(endpoint['latency_ms']['p50'], endpoint['latency_ms']['p99'])
+            self.assertGreater(endpoint['queries_per_request']['mean'], 0, name)
+        #Views and likes were really counted.
+        self.assertTrue(counters.page_views.flush())
+        self.assertGreater(sum(Category.objects.values_list('likes', flat=True)), 0)
+    
+    def test_catalogue_size_is_checked(self):
+        for pages in (999, 10 ** 6 + 1):
+            with self.assertRaisesMessage(CommandError, '--pages must be between 1000 and 1000000.'):
+                call_command('bench_rango', pages=pages, stderr=six.StringIO())
+        self.assertEqual(Page.objects.count(), 0)
+
+@contextmanager
+def record_queries():
+    """
+    Collect the (sql, params) of every query run inside the block, with the
+    params still separate so the statement can be EXPLAINed afterwards.
+    """
+    recorded = []
+    execute = db_utils.CursorWrapper.execute
+    
+    def recording_execute(self, sql, params=None):
+        recorded.append((sql, params))
+        return execute(self, sql, params)
+    
+    db_utils.CursorWrapper.execute = recording_execute
+    try:
+        yield recorded
+    finally:
+        db_utils.CursorWrapper.execute = execute
+
+class QueryPlanTests(TestCase):
+    """
+    Runs every rango view on cold caches and EXPLAINs each query it issues.
+    A hot query that reads a whole table or sorts in a temp b-tree fails.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        counters.page_views.flush()
+        top_categories.invalidate()
+        top_pages.invalidate()
+        
+        user = User.objects.create_user('planner', 'planner@example.com', 'secret')
+        UserProfile.objects.create(user=user)
+        for i in range(20):
+            cat = Category.objects.create(name='Category %d' % i, likes=i)
+            for j in range(10):
+                add_page(cat, 'Page %d-%d' % (i, j), 'http://example.com/%d/%d' % (i, j), j)
+        self.category = Category.objects.get(name='Category 3')
+        self.page = Page.objects.filter(category=self.category)[0]
+        #The trie is loaded once at startup, that full read isn't a hot query.
+        category_index.reset()
+        category_index.ensure_built()
+        cache.clear()
+    
+    def tearDown(self):
+        category_index.reset()
+        counters.page_views.flush()
+    
+    def requests(self):
+        slug = self.category.slug
+        return [
+            ('index', reverse('index'), {}),
+            ('about', reverse('about'), {}),
+            ('category', reverse('category', args=[slug]), {}),
+            ('category_pages', reverse('category_pages', args=[slug]), {'after': encode_cursor(5, self.page.id)}),
+            ('goto', reverse('goto'), {'page_id': self.page.id}),
+            ('suggest_category', reverse('suggest_category'), {'suggestion': 'cat'}),
+            ('like_category', reverse('like_category'), {'category_id': self.category.id}),
+            ('add_category', reverse('add_category'), {}),
+            ('add_page', reverse('add_page', args=[slug]), {}),
+            ('profile', reverse('profile'), {}),
+            ('restricted', reverse('restricted'), {}),
+        ]
+    
+    def explain(self, sql, params):
+        cursor = connection.cursor()
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN ' + sql, params)
+        return [row[0] for row in cursor.fetchall()]
+    
+    def problems(self, plan):
+        if connection.vendor == 'sqlite':
+            #An aggregate reading all of an index is reported as a covering index scan.
+            full_scan = re.compile(r'^SCAN (TABLE )?\w+( USING COVERING INDEX \w+)?$')
+            return [step for step in plan if full_scan.match(step) or 'TEMP B-TREE' in step]
+        return [step for step in plan if 'Seq Scan' in step or re.match(r'\s*(->  )?Sort ', step)]
+    
+    def test_view_queries_use_indexes(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest('No plan checks for %s' % connection.vendor)
+        if connection.vendor == 'postgresql':
+            #The test tables are tiny, make the planner show which indexes it could use.
+            connection.cursor().execute('SET enable_seqscan = off')
+        self.client.login(username='planner', password='secret')
+        
+        failures = []
+        for name, url, params in self.requests():
+            with record_queries() as queries:
+                response = self.client.get(url, params)
+            self.assertIn(response.status_code, (200, 302), name)
+            for sql, sql_params in queries:
+                if sql.lstrip().split(' ', 1)[0].upper() not in ('SELECT', 'UPDATE', 'DELETE'):
+                    continue
+                bad = self.problems(self.explain(sql, sql_params))
+                if bad:
+                    failures.append('%s: %s\n    %s' % (name, sql, '\n    '.join(bad)))
+        
+        self.assertFalse(failures, 'Hot queries without a usable index:\n' + '\n'.join(failures))
+
+class QueryBudgetTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        top_categories.invalidate()
+        top_pages.invalidate()
+        #Enough to fill every list the pages show, one more than fits.
+        Category.objects.bulk_create([Category(name='Budget %d' % i, slug='budget-%d' % i, likes=i)
+                                      for i in range(sidebar.SIDEBAR_LIMIT + 2)])
+        self.category = Category.objects.get(name='Budget 3')
+        Page.objects.bulk_create([Page(category=self.category, title='Page %d' % i,
+                                       url='http://example.com/%d' % i, views=i) for i in range(120)])
+    
+    def test_every_view_has_a_budget(self):
+        from rango import urls
+        callbacks = [pattern.callback for pattern in urls.urlpatterns]
+        callbacks += [reverse_match.func for reverse_match in
+                      (resolve(reverse('haystack_search')), resolve(reverse('registration_register')))]
+        missing = [getattr(callback, '__name__', callback) for callback in callbacks
+                   if not hasattr(callback, 'query_budget')]
+        self.assertEqual(missing, [])
+    
+    @override_settings(RANGO_QUERY_BUDGETS='raise')
+    def test_views_stay_in_budget_on_cold_caches(self):
+        User.objects.create_user('budget', 'budget@example.com', 'secret')
+        self.client.login(username='budget', password='secret')
+        slug = self.category.slug
+        for url in (reverse('index'), reverse('category', args=[slug]),
+                    reverse('category_pages', args=[slug]), reverse('about')):
+            cache.clear()
+            top_categories.invalidate()
+            top_pages.invalidate()
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+    
+    @override_settings(RANGO_QUERY_BUDGETS='raise')
+    def test_over_budget_raises_with_the_query_and_stack(self):
+        def n_plus_one():
+            with query_budget(queries=2, name='n_plus_one'):
+                for page in Page.objects.filter(category=self.category)[:3]:
+                    page.category.name
+        
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            n_plus_one()
+        message = str(raised.exception)
+        self.assertIn('n_plus_one used 4 queries, its budget is 2', message)
+        self.assertIn('rango_category', message)
+        self.assertIn('in n_plus_one', message)
+        
+        #Rows are counted as they're fetched, nested blocks count for both.
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            with query_budget(rows=100, name='outer'):
+                with query_budget(rows=200, name='inner'):
+                    list(Page.objects.all())
+        self.assertIn('outer used 120 rows, its budget is 100', str(raised.exception))
+        
+        with query_budget(queries=0, rows=0):
+            with unbudgeted():
+                list(Page.objects.all())
+    
+    @override_settings(RANGO_QUERY_BUDGETS='warn')
+    def test_over_budget_is_logged_outside_tests(self):
+        logged = []
+        
+        class Handler(logging.Handler):
+            def emit(self, record):
+                logged.append(record.getMessage())
+        
+        logger = logging.getLogger('rango.query_budget')
+        handler = Handler()
+        logger.addHandler(handler)
+        try:
+            with query_budget(queries=0, name='quiet'):
+                Category.objects.count()
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(len(logged), 1)
+        self.assertIn('quiet used 1 queries', logged[0])
+        self.assertIn('COUNT', logged[0])
+
+class ConditionalGetTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        top_categories.invalidate()
+        top_pages.invalidate()
+        counters.page_views.flush()
+        self.python = add_cat('Python', 0, 0)
+        self.django = add_cat('Django', 0, 0)
+        self.page = add_page(self.python, 'Docs', 'http://docs.python.org/', 5)
+    
+    def tearDown(self):
+        counters.page_views.flush()
+    
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    
+    def test_unchanged_index_is_not_modified_for_one_query(self):
+        url = reverse('index')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+        
+        with self.assertNumQueries(1):
+            again = self.revalidate(url, response)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+        self.assertEqual(again['ETag'], response['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        
+        add_page(self.django, 'Tutorial', 'http://djangoproject.com/', 1)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+    
+    def test_category_validators_only_move_for_that_category(self):
+        url = reverse('category', args=[self.python.slug])
+        response = self.client.get(url)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+        
+        #Another category's pages aren't shown here.
+        add_page(self.django, 'Tutorial', 'http://djangoproject.com/', 1)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        
+        #Its own pages, likes and buffered views are.
+        for change in (lambda: add_page(self.python, 'PEP 8', 'http://pep8.org/'),
+                       lambda: add_like(self.python.id),
+                       lambda: (counters.page_views.incr(self.page.id), counters.page_views.flush())):
+            change()
+            changed = self.revalidate(url, response)
+            self.assertEqual(changed.status_code, 200)
+            self.assertNotEqual(changed['ETag'], response['ETag'])
+            response = changed
+        
+        #So is every category's name, in the sidebar.
+        self.django.name = 'Django Framework'
+        self.django.save()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+    
+    def test_logged_in_pages_have_their_own_etag(self):
+        User.objects.create_user('fresh', 'fresh@example.com', 'secret')
+        url = reverse('category', args=[self.python.slug])
+        anonymous = self.client.get(url)
+        self.client.login(username='fresh', password='secret')
+        
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=anonymous['ETag'],
+                                   HTTP_IF_MODIFIED_SINCE=anonymous['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Logout')
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+    
+    def test_writes_without_signals_are_seen(self):
+        """
+        The validators come from the db, so a write by another process, which
+        sends no signal here, still changes them.
+        """
+        url = reverse('category', args=[self.python.slug])
+        response = self.client.get(url)
+        Page.objects.filter(id=self.page.id).update(views=F('views') + 1)
+        freshness.touch_pages([self.python.id])
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        
+        index = self.client.get(reverse('index'))
+        Category.objects.filter(id=self.django.id).update(name='Django Framework', modified=timezone.now())
+        self.assertEqual(self.revalidate(reverse('index'), index).status_code, 200)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+    
+    def test_deletes_change_the_etag(self):
+        url = reverse('category', args=[self.python.slug])
+        response = self.client.get(url)
+        index = self.client.get(reverse('index'))
+        self.page.delete()
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        
+        self.django.delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+        self.assertEqual(self.revalidate(reverse('index'), index).status_code, 200)
+
+class PageCacheTests(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        top_categories.invalidate()
+        top_pages.invalidate()
+        self.python = add_cat('Python', 0, 0)
+        self.django = add_cat('Django', 0, 0)
+        for i in range(5):
+            add_page(self.python, 'Python %d' % i, 'http://python.org/%d' % i, 10 + i)
+        self.urls = {'index': reverse('index'),
+                     'python': reverse('category', args=[self.python.slug]),
+                     'django': reverse('category', args=[self.django.slug])}
+    
+    def rendered(self):
+        #Which pages had to be rendered rather than come from the cache.
+        return sorted(name for name, url in self.urls.items() if self.client.get(url).context is not None)
+    
+    def test_anonymous_pages_are_served_from_the_cache(self):
+        first = self.client.get(self.urls['python'])
+        del self.client.cookies[VISITS_COOKIE]
+        #Just the validators.
+        with self.assertNumQueries(2):
+            again = self.client.get(self.urls['python'])
+        self.assertIsNone(again.context)
+        self.assertEqual(again.content, first.content)
+        self.assertEqual(again['ETag'], first['ETag'])
+        #A new visitor's cookie is still set on a cached page.
+        self.assertIn(VISITS_COOKIE, again.cookies)
+    
+    def test_writes_only_invalidate_the_pages_they_change(self):
+        self.assertEqual(self.rendered(), ['django', 'index', 'python'])
+        self.assertEqual(self.rendered(), [])
+        
+        #Too few views to reach the index's leaderboard.
+        add_page(self.python, 'Python 5', 'http://python.org/5', 1)
+        self.assertEqual(self.rendered(), ['python'])
+        
+        add_like(self.django.id)
+        self.assertEqual(self.rendered(), ['django'])
+        
+        #Folded likes reorder the index and every sidebar.
+        compact_likes()
+        self.assertEqual(self.rendered(), ['django', 'index', 'python'])
+        
+        self.django.name = 'Django Framework'
+        self.django.save()
+        self.urls['django'] = reverse('category', args=[self.django.slug])
+        self.assertEqual(self.rendered(), ['django', 'index', 'python'])
+    
+    def test_logged_in_pages_are_not_cached(self):
+        self.client.get(self.urls['index'])
+        User.objects.create_user('cached', 'cached@example.com', 'secret')
+        self.client.login(username='cached', password='secret')
+        response = self.client.get(self.urls['index'])
+        self.assertIsNotNone(response.context)
+        self.assertContains(response, 'Logout')
+        self.client.logout()
+        self.assertNotContains(self.client.get(self.urls['index']), 'Logout')
+    
+    def test_concurrent_misses_render_once(self):
+        renders = []
+        
+        @cache_anonymous(lambda request: 'v1')
+        def slow_view(request):
+            renders.append(1)
+            time.sleep(0.2)
+            return HttpResponse('slow')
+        
+        responses = []
+        
+        def visit():
+            request = RequestFactory().get('/slow/')
+            request.user = AnonymousUser()
+            responses.append(slow_view(request))
+        
+        threads = [threading.Thread(target=visit) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(renders), 1)
+        self.assertEqual([response.content for response in responses], [b'slow'] * 5)
+        self.assertEqual(len(set(id(response) for response in responses)), 5)
+    
+    def test_waiters_render_after_the_wait(self):
+        release = threading.Event()
+        renders = []
+        
+        @cache_anonymous(lambda request: 'v1')
+        def stuck_view(request):
+            renders.append(1)
+            if len(renders) == 1:
+                release.wait(5)
+            return HttpResponse('stuck')
+        
+        def visit():
+            request = RequestFactory().get('/stuck/')
+            request.user = AnonymousUser()
+            stuck_view(request)
+        
+        self.addCleanup(setattr, page_cache, 'WAIT', page_cache.WAIT)
+        page_cache.WAIT = 0.1
+        leader = threading.Thread(target=visit)
+        leader.start()
+        while not renders:
+            time.sleep(0.01)
+        waiter = threading.Thread(target=visit)
+        waiter.start()
+        waiter.join(2)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(len(renders), 2)
+        release.set()
+        leader.join()
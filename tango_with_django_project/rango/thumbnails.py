@@ -0,0 +1,120 @@
+import io
+import logging
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image, ImageOps
+
+from rango.models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+#Square edge lengths in pixels, every picture gets one of each.
+SIZES = tuple(sorted(getattr(settings, 'RANGO_THUMBNAIL_SIZES', (64, 128, 256))))
+QUALITY = 85
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def thumbnail_name(name, size, format='jpg'):
+    """profile_images/me.png -> profile_images/me.64.jpg, next to the original."""
+    return '%s.%d.%s' % (os.path.splitext(name)[0], size, format)
+
+
+def _encode(image, format):
+    out = io.BytesIO()
+    if format == 'webp':
+        image.save(out, 'WEBP', quality=QUALITY)
+    else:
+        if image.mode != 'RGB':
+            #JPEG has no alpha, flatten transparent pictures onto white.
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1] if image.mode in ('RGBA', 'LA') else None)
+            image = background
+        image.save(out, 'JPEG', quality=QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def _store(name, data):
+    #Pictures are stored under their content hash, so an existing thumbnail
+    #was made from the same picture by an earlier upload.
+    if default_storage.exists(name):
+        return
+    stored = default_storage.save(name, ContentFile(data))
+    if stored != name:
+        logger.warning('Thumbnail %s was stored as %s.', name, stored)
+
+
+def make_thumbnails(profile_id, name):
+    """
+    Write a JPEG and, when Pillow can, a WebP thumbnail of every size in
+    SIZES for the picture `name` next to it in default_storage, then
+    record them on the profile. Nothing is recorded if the profile has
+    moved on to another picture meanwhile. Returns the sizes made.
+    """
+    storage = UserProfile._meta.get_field('picture').storage
+    with storage.open(name, 'rb') as f:
+        original = Image.open(f)
+        original.load()
+    original = ImageOps.exif_transpose(original) if hasattr(ImageOps, 'exif_transpose') else original
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'A' in original.mode or 'transparency' in original.info else 'RGB')
+
+    webp = True
+    for size in SIZES:
+        thumbnail = ImageOps.fit(original, (size, size), Image.LANCZOS)
+        _store(thumbnail_name(name, size), _encode(thumbnail, 'jpg'))
+        if webp:
+            try:
+                data = _encode(thumbnail, 'webp')
+            except (IOError, KeyError):
+                #Pillow built without libwebp.
+                webp = False
+            else:
+                _store(thumbnail_name(name, size, 'webp'), data)
+
+    UserProfile.objects.filter(id=profile_id, picture=name).update(
+        thumbnail_sizes=','.join(str(size) for size in SIZES), thumbnail_webp=webp)
+    return SIZES
+
+
+def _run(profile_id, name):
+    try:
+        make_thumbnails(profile_id, name)
+    except Exception:
+        logger.exception('Making thumbnails of %s failed.', name)
+    finally:
+        #Pool threads must not keep a db connection open forever.
+        connection.close()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPool(getattr(settings, 'RANGO_THUMBNAIL_WORKERS', 2))
+    return _pool
+
+
+def schedule(profile):
+    """
+    Make thumbnails of profile's newly saved picture in the background.
+    Until they are ready the profile's avatar falls back to the original.
+    With RANGO_THUMBNAIL_WORKERS = 0 the work is done before returning.
+    """
+    UserProfile.objects.filter(id=profile.id).update(thumbnail_sizes='', thumbnail_webp=False)
+    profile.thumbnail_sizes, profile.thumbnail_webp = '', False
+    if not profile.picture:
+        return
+    if getattr(settings, 'RANGO_THUMBNAIL_WORKERS', 2):
+        _get_pool().apply_async(_run, (profile.id, profile.picture.name))
+    else:
+        make_thumbnails(profile.id, profile.picture.name)
+        profile.refresh_from_db()
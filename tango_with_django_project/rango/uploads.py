@@ -0,0 +1,225 @@
+"""
+Profile pictures are stored once per distinct content:
+
+    profile_images/3f/a2/3fa2...e9.png
+
+HashingUploadHandler streams the uploads of the views decorated with
+hashed_uploads to a temporary file, hashing them as they go and giving up
+on writing anything past MAX_SIZE, and ContentAddressedStorage moves that
+file under its hash, or drops it if the same picture is already there.
+"""
+import errno
+import hashlib
+import os
+import tempfile
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.core.signals import setting_changed
+from django.http import HttpResponse, QueryDict
+from django.template.defaultfilters import filesizeformat
+from django.utils._os import abspathu
+from django.utils.datastructures import MultiValueDict
+from django.utils.decorators import available_attrs
+from django.utils.deconstruct import deconstructible
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+#Bytes, larger uploads are refused by the upload handler and the forms.
+MAX_SIZE = getattr(settings, 'RANGO_UPLOAD_MAX_SIZE', 5 * 1024 * 1024)
+#Room in a request body for the form's other fields and the multipart
+#framing, on top of a picture of MAX_SIZE.
+FORM_OVERHEAD = 64 * 1024
+#Hex digits per directory level, and levels, under the upload_to directory.
+SHARD_WIDTH = 2
+SHARD_DEPTH = 2
+
+
+def content_name(directory, digest, name):
+    """The storage name for content hashing to `digest`, keeping name's extension."""
+    shards = [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+    extension = os.path.splitext(name)[1].lower()
+    return os.path.join(directory, *(shards + [digest + extension]))
+
+
+class HashedUploadedFile(TemporaryUploadedFile):
+    #An upload on disk with the sha256 of its content worked out while it arrived.
+    sha256 = None
+
+
+class OversizedUpload(UploadedFile):
+    """
+    Stands in for an upload over MAX_SIZE, of which nothing was kept. Its
+    size is what arrived, so a form can say why it was refused.
+    """
+
+    def __init__(self, name, content_type, size):
+        super(OversizedUpload, self).__init__(None, name, content_type, size)
+
+    def chunks(self, chunk_size=None):
+        return iter(())
+
+    def read(self, *args):
+        return b''
+
+    def seek(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Writes uploads straight to a temporary file while hashing them, never
+    holding one in memory. A request body too big to hold an upload under
+    MAX_SIZE isn't read at all: the handler hands back empty form data and
+    sets refused. Once an upload in a body that was let through passes
+    MAX_SIZE, or is announced as bigger, the file is thrown away and the
+    rest of it is read off the wire and dropped, leaving an OversizedUpload
+    for the form to reject.
+    """
+
+    def __init__(self, request=None, max_size=None):
+        super(HashingUploadHandler, self).__init__(request)
+        self.max_size = MAX_SIZE if max_size is None else max_size
+        self.refused = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > self.max_size + FORM_OVERHEAD:
+            self.refused = True
+            return QueryDict('', encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None,
+                 content_type_extra=None):
+        super(HashingUploadHandler, self).new_file(field_name, file_name, content_type,
+                                                   content_length, charset, content_type_extra)
+        self.hash = hashlib.sha256()
+        self.file = None
+        if content_length is None or content_length <= self.max_size:
+            self.file = HashedUploadedFile(self.file_name, self.content_type, 0, self.charset,
+                                           self.content_type_extra)
+        #This handler takes the whole file, the default ones after it have nothing to do.
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.file is None:
+            return None
+        if start + len(raw_data) > self.max_size:
+            self.file.close()
+            self.file = None
+            return None
+        self.hash.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.file is None:
+            return OversizedUpload(self.file_name, self.content_type, file_size)
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.hash.hexdigest()
+        return self.file
+
+
+def hashed_uploads(view):
+    """
+    Decorator putting HashingUploadHandler in front of a view's upload
+    handlers, and answering 413 without reading the body when it is too
+    big for an acceptable upload. Other views keep django's handlers.
+    The handler has to be in place before anything reads request.POST, so
+    the CSRF check moves from the middleware to inside this decorator.
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view, assigned=available_attrs(view))
+    def handled(request, *args, **kwargs):
+        handler = HashingUploadHandler(request)
+        request.upload_handlers.insert(0, handler)
+        if request.method == 'POST':
+            #Parse the body now, through the handler, to see if it was refused.
+            request.POST
+            if handler.refused:
+                return HttpResponse('Uploads can be at most %s.' % filesizeformat(MAX_SIZE),
+                                    content_type='text/plain', status=413)
+        return protected(request, *args, **kwargs)
+    return handled
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Files are saved under the sha256 of their content, sharded two levels
+    deep below the directory they were meant for. Saving content that is
+    already stored returns the existing name without writing it again, so
+    a file may be shared and must not be deleted while anything uses it.
+    """
+
+    def __init__(self, location=None, base_url=None, *args, **kwargs):
+        super(ContentAddressedStorage, self).__init__(location, base_url, *args, **kwargs)
+        self._defaults = location is None, base_url is None
+        setting_changed.connect(self._setting_changed)
+
+    def _setting_changed(self, setting, value, **kwargs):
+        #Follow MEDIA_ROOT and MEDIA_URL unless told otherwise, as default_storage does.
+        if setting == 'MEDIA_ROOT' and self._defaults[0]:
+            self.base_location = value
+            self.location = abspathu(value)
+        elif setting == 'MEDIA_URL' and self._defaults[1]:
+            self.base_url = value
+
+    def get_available_name(self, name, max_length=None):
+        #The final name comes from the content, see _save.
+        return name
+
+    def _save(self, name, content):
+        digest = getattr(content, 'sha256', None)
+        if digest and hasattr(content, 'temporary_file_path'):
+            temporary, owned = content.temporary_file_path(), False
+        else:
+            digest, temporary = self._spool(content)
+            owned = True
+
+        name = content_name(os.path.dirname(name), digest, name)
+        full_path = self.path(name)
+        try:
+            if os.path.exists(full_path):
+                return name
+            directory = os.path.dirname(full_path)
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            #Whoever finishes last wins, with the same bytes.
+            file_move_safe(temporary, full_path, allow_overwrite=True)
+            temporary = None
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+            return name
+        finally:
+            if owned and temporary is not None:
+                os.remove(temporary)
+
+    def _spool(self, content):
+        #Copy content next to where it will end up while hashing it.
+        hash = hashlib.sha256()
+        if not os.path.isdir(self.location):
+            os.makedirs(self.location)
+        fd, path = tempfile.mkstemp(prefix='.upload-', dir=self.location)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    hash.update(chunk)
+                    f.write(chunk)
+        except Exception:
+            os.remove(path)
+            raise
+        return hash.hexdigest(), path
@@ -14,11 +14,15 @@ urlpatterns = patterns('',
     url(r'^benweb/$', views.benweb, name='benweb'),
     url(r'^add_category/$', views.add_category, name='add_category'),
     url(r'^category/(?P<category_name_slug>[\w\-]+)/add_page/$', views.add_page, name='add_page'),
+    url(r'^category/(?P<category_name_slug>[\w\-]+)/pages/$', views.category_pages, name='category_pages'),
     url(r'^restricted/$', views.restricted, name='restricted'),
     url(r'^goto/$', views.track_url, name='goto'),
     url(r'^profile/$', views.profile_view, name='profile'),
     url(r'^like_category/$', views.like_category, name='like_category'),
     url(r'^suggest_category/$', views.suggest_category, name='suggest_category'),
+    url(r'^export/$', views.export, name='export'),
+    url(r'^search_cache/$', views.search_cache_stats, name='search_cache_stats'),
+    url(r'^_metrics$', views.metrics_view, name='metrics'),
     #url(r'^logout/$', views.user_logout, name="logout"),
     #url(r'^register/$', views.register, name="register"),
     #url(r'^login/$', views.user_login, name="login"),
@@ -1,53 +1,72 @@
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, HttpResponseRedirect
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from rango.models import Category, Page, UserProfile
-from rango.forms import CategoryForm, PageForm, EditUserForm, EditProfileForm
+from rango.forms import CategoryForm, PageForm, EditUserForm, EditProfileForm, NormalisedSearchForm
+from rango import counters, freshness, metrics, thumbnails
+from rango.page_cache import cache_anonymous
+from rango.bulk import EXPORT_FORMATS, export_rows, parse_since
+from rango.leaderboards import SIZE as LEADERBOARD_SIZE, top_categories, top_pages
+from rango.likes import add_like, total_likes
+from rango.pagination import keyset_page
+from rango.query_budget import query_budget
+from rango.search_cache import generations, search_results
+from rango.search_queue import model_label
+from rango.uploads import hashed_uploads
+from rango.sidebar import SIDEBAR_LIMIT
+from rango.suggest import category_index
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from datetime import datetime
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from haystack import connections as search_connections
+from haystack.views import SearchView
 
+CATEGORY_PAGE_SIZE = getattr(settings, 'RANGO_CATEGORY_PAGE_SIZE', 50)
+
+#Query budgets, see rango.query_budget. Any page may load the session and its
+#user, the state of the category list the sidebar is cached under, and the
+#sidebar's categories when the cached fragment is cold.
+PAGE_QUERIES = 4
+PAGE_ROWS = 3 + SIDEBAR_LIMIT + 1
+
+#One query and row for the validators, see rango.freshness.
+@query_budget(queries=PAGE_QUERIES + 3, rows=PAGE_ROWS + 2 * LEADERBOARD_SIZE + 1)
+#Browsers revalidate every time, a current copy costs them a 304, see rango.freshness.
+@cache_control(no_cache=True)
+@condition(etag_func=freshness.index_etag, last_modified_func=freshness.index_last_modified)
+@cache_anonymous(freshness.index_etag)
 def index(request):
-    category_list = Category.objects.order_by('-likes')[:5]
-    page_list = Page.objects.order_by('-views')[:5]
+    #Both lists are in-memory leaderboards, see rango.leaderboards.
+    category_list = top_categories.top()
+    page_list = top_pages.top()
     
     context_dict = {'categories': category_list, 'pages': page_list}
     
-    visits = request.session.get('visits')
-    if not visits:
-        visits = 1
-    reset_last_visit_time = False
-    
-    last_visit = request.session.get('last_visit')
-    if last_visit:
-        last_visit_time = datetime.strptime(last_visit[:-7], "%Y-%m-%d %H:%M:%S")
-        
-        if (datetime.now() - last_visit_time).seconds > 0:
-            #...reassign the value of the cookie to +1 of what it was before...
-            visits += 1
-            #... and update the last visit cookie too.
-            reset_last_visit_time = True
-    else:
-        #Cookie last_visit doesn't exist, so create it to the current date/time.
-        reset_last_visit_time = True
-    
-    if reset_last_visit_time:
-        request.session['last_visit'] = str(datetime.now())
-        request.session['visits'] = visits
-    context_dict['visits'] = visits
+    #Counted by rango.middleware.VisitTrackingMiddleware in a signed cookie.
+    context_dict['visits'] = request.visits
     
     response = render(request, 'rango/index.html', context_dict)
     return response
 
+@query_budget(queries=PAGE_QUERIES, rows=PAGE_ROWS)
 def about(request):
-    #Note that this logic increments visits on the index page, and presents here.
-    visits = request.session.get('visits')
-    context_dict = {'visits': visits}
+    #Visits are counted by rango.middleware.VisitTrackingMiddleware, and presented here.
+    context_dict = {'visits': request.visits}
     return render(request, 'rango/about.html', context_dict)
 
+@query_budget(queries=PAGE_QUERIES, rows=PAGE_ROWS)
 def benweb(request):
     context_dict = {}
     return render(request, 'benweb/index.html', context_dict)
 
+#Two queries and rows for the validators.
+@query_budget(queries=PAGE_QUERIES + 7, rows=PAGE_ROWS + CATEGORY_PAGE_SIZE + 7)
+@cache_control(no_cache=True)
+@condition(etag_func=freshness.category_etag, last_modified_func=freshness.category_last_modified)
+@cache_anonymous(freshness.category_etag)
 def category(request, category_name_slug):
     #This is our first page generated from stuff pulled from the DB. 
     #See how it pulls the information and stores relevant information in the context dict.
@@ -63,13 +82,17 @@ def category(request, category_name_slug):
         #So the .get() method returns one model instance or raises an exception.
         category = Category.objects.get(slug=category_name_slug)
         context_dict['category_name'] = category.name
+        context_dict['likes'] = total_likes(category.id)
         
-        #Retrieve all of the associated pages.
-        #Note that filter returns >= 1 model instance.
-        pages = Page.objects.filter(category=category).order_by('-views')
+        #Retrieve one page worth of the associated pages, most viewed first.
+        #The after cursor in the url says where the previous page ended.
+        pages, next_cursor = keyset_page(
+            Page.objects.filter(category=category), request.GET.get('after'), CATEGORY_PAGE_SIZE)
         
         #Adds our results list to the template context under name pages.
         context_dict['pages'] = pages
+        context_dict['next_cursor'] = next_cursor
+        context_dict['paged'] = 'after' in request.GET
         #We also add the category object form the database to the context dictionary.
         #We'll use this in the template to verify that the category exists.
         context_dict['category'] = category
@@ -81,6 +104,28 @@ def category(request, category_name_slug):
     #Go render the response and return it to the client.
     return render(request, 'rango/category.html', context_dict)
 
+@query_budget(queries=2, rows=CATEGORY_PAGE_SIZE + 2)
+def category_pages(request, category_name_slug):
+    #JSON flavour of the category page listing, used for infinite scroll.
+    try:
+        category = Category.objects.get(slug=category_name_slug)
+    except Category.DoesNotExist:
+        return JsonResponse({'error': 'No such category.'}, status=404)
+    
+    pages, next_cursor = keyset_page(
+        Page.objects.filter(category=category), request.GET.get('after'), CATEGORY_PAGE_SIZE)
+    goto = reverse('goto')
+    return JsonResponse({
+        'pages': [{
+            'id': page.id,
+            'title': page.title,
+            'url': page.url,
+            'views': page.views,
+            'goto': '%s?page_id=%d' % (goto, page.id)} for page in pages],
+        'next': next_cursor})
+
+#Saving the category, then the index page it renders.
+@query_budget(queries=PAGE_QUERIES + 9, rows=PAGE_ROWS + 2 * LEADERBOARD_SIZE + 2)
 @login_required
 def add_category(request):
     #HTTP POST?
@@ -106,6 +151,8 @@ def add_category(request):
     #Render the form with error messages (if any)
     return render(request, 'rango/add_category.html', {'form': form})
 
+#Saving the page, then the category page it renders.
+@query_budget(queries=PAGE_QUERIES + 11, rows=PAGE_ROWS + CATEGORY_PAGE_SIZE + 6)
 @login_required
 def add_page(request, category_name_slug):
     try:
@@ -139,14 +186,74 @@ def add_page(request, category_name_slug):
     
     return render(request, 'rango/add_page.html', context_dict)
 
+#Only the staff check, the rows are read while the response streams.
+@query_budget(queries=2, rows=2)
+@staff_member_required
+def export(request):
+    #Streams the whole catalogue, see rango.bulk for the formats and filters.
+    format = request.GET.get('format', 'jsonl')
+    if format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('Unknown format, use csv or jsonl.')
+    since = None
+    if request.GET.get('since'):
+        try:
+            since = parse_since(request.GET['since'])
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+    
+    lines, content_type = EXPORT_FORMATS[format]
+    response = StreamingHttpResponse(lines(export_rows(request.GET.get('category'), since)),
+                                     content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="rango.%s"' % format
+    return response
+
+class CachedSearchView(SearchView):
+    """
+    haystack's SearchView with every page of results kept in the
+    search_results cache, keyed by the normalised query, the models
+    searched and the page number.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('form_class', NormalisedSearchForm)
+        super(CachedSearchView, self).__init__(*args, **kwargs)
+    
+    def build_page(self):
+        if not self.query:
+            return super(CachedSearchView, self).build_page()
+        labels = sorted(self.form.cleaned_data.get('models') or
+                        [model_label(m) for m in search_connections['default'].get_unified_index().get_indexed_models()])
+        key = (self.query, tuple(labels), self.request.GET.get('page') or '1')
+        gens = generations(labels)
+        page = search_results.get(key, gens)
+        if page is None:
+            page = super(CachedSearchView, self).build_page()
+            search_results.set(key, gens, page)
+        return page
+
+@query_budget(queries=2, rows=2)
+@staff_member_required
+def search_cache_stats(request):
+    return JsonResponse(search_results.stats())
+
+@query_budget(queries=2, rows=2)
+@staff_member_required
+def metrics_view(request):
+    #Prometheus text format, see rango.metrics.
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@query_budget(queries=PAGE_QUERIES, rows=PAGE_ROWS)
 @login_required
 def restricted(request):
     return render(request, 'rango/restricted.html', {})
 
+@query_budget(queries=PAGE_QUERIES + 5, rows=PAGE_ROWS + 1)
 @login_required
+@hashed_uploads
 def profile_view(request):
     user = request.user
-    profile = UserProfile.objects.get(user=request.user)
+    #The avatar tag reads profile.user, it comes with the profile.
+    profile = UserProfile.objects.select_related('user').get(user=request.user)
     user_initial = {
         'first_name':user.first_name, 
         'last_name':user.last_name, 
@@ -168,6 +275,8 @@ def profile_view(request):
             if 'picture' in request.FILES:
                 profile.picture = profileform.cleaned_data['picture']
             profile.save()
+            if 'picture' in request.FILES:
+                thumbnails.schedule(profile)
             
             return HttpResponseRedirect('/rango/profile')
     
@@ -177,58 +286,60 @@ def profile_view(request):
 
     context = {
         "userform": userform,
-        "profileform": profileform}
+        "profileform": profileform,
+        "profile": profile}
     
     return render(request, 'registration/profile.html', context)
 
+@query_budget(queries=1, rows=1)
 def track_url(request):
-    page_id = None
     url = '/rango/'
     if request.method == 'GET':
         if 'page_id' in request.GET:
-            page_id = request.GET['page_id']
             try:
-                page = Page.objects.get(id=page_id)
-                page.views += 1
-                page.save()
-                url = page.url
-            except:
-                pass
+                page_id = int(request.GET['page_id'])
+            except ValueError:
+                page_id = None
+            #The url comes from the cache and the click is only buffered,
+            #the counter writes the views back to the db in batches.
+            page_url = page_id and counters.page_url(page_id)
+            if page_url:
+                counters.page_views.incr(page_id)
+                url = page_url
     
     return redirect(url)
 
+@query_budget(queries=9, rows=4)
 @login_required
 def like_category(request):
-    category_id = None
     likes = 0
     if request.method == 'GET':
         if 'category_id' in request.GET:
-            category_id = request.GET['category_id']
             try:
-                category = Category.objects.get(id=int(category_id))
-                likes = category.likes + 1
-                category.likes = likes
-                category.save()
-            except:
-                pass
+                category_id = int(request.GET['category_id'])
+            except ValueError:
+                category_id = None
+            #The like lands in one of the category's counter shards rather
+            #than rewriting the Category row, see rango.likes.
+            if category_id:
+                likes = add_like(category_id) or 0
     return HttpResponse(likes)
 
 def get_category_list(max_results=0, starts_with=''):
     cat_list = []
     if starts_with:
-        cat_list = Category.objects.filter(name__istartswith=starts_with)
-    
-    if max_results > 0:
-        if len(cat_list) > max_results:
-            cat_list = cat_list[:max_results]
+        #Served from the in-memory prefix index, ranked by likes.
+        cat_list = category_index.search(starts_with, max_results)
     
     return cat_list
 
+#Served from memory, see rango.suggest.
+@query_budget(queries=0, rows=0)
 def suggest_category(request):
     cat_list = []
     starts_with = ''
     if request.method == 'GET':
-        starts_with = request.GET['suggestion']
+        starts_with = request.GET.get('suggestion', '')
     
     cat_list = get_category_list(8, starts_with)
     
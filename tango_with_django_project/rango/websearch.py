@@ -0,0 +1,306 @@
+import codecs
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+URL = getattr(settings, 'RANGO_WEB_SEARCH_URL', 'https://api.datamarket.azure.com/Bing/Search/v1/Web')
+PAGES = getattr(settings, 'RANGO_WEB_SEARCH_PAGES', 3)
+PER_PAGE = getattr(settings, 'RANGO_WEB_SEARCH_PER_PAGE', 10)
+#(connect, read) timeouts for a single request, the whole search gives up
+#after DEADLINE seconds.
+TIMEOUT = getattr(settings, 'RANGO_WEB_SEARCH_TIMEOUT', (3.05, 10))
+DEADLINE = getattr(settings, 'RANGO_WEB_SEARCH_DEADLINE', 15)
+
+#Answers are reused for CACHE_TTL seconds, then served stale for up to
+#STALE_TTL more while a refresh runs in the background.
+CACHE_SIZE = getattr(settings, 'RANGO_WEB_SEARCH_CACHE_SIZE', 1000)
+CACHE_TTL = getattr(settings, 'RANGO_WEB_SEARCH_CACHE_TTL', 3600)
+STALE_TTL = getattr(settings, 'RANGO_WEB_SEARCH_STALE_TTL', 86400)
+
+#Statuses worth another try, after backoff * (1, 2, 4...) seconds.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class SearchResults(list):
+    """
+    The results of a search, a list of {'title', 'link', 'summary'} dicts
+    like run_query always returned. Pages that failed are described in
+    `errors` instead of raising, so a caller gets whatever did arrive.
+    """
+
+    def __init__(self, results=(), errors=()):
+        super(SearchResults, self).__init__(results)
+        self.errors = list(errors)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def iter_array(chunks, key='results'):
+    """
+    Yield the objects of the first JSON array under `key` from a stream of
+    byte chunks, decoding each as soon as it is complete instead of
+    waiting for, and holding, the whole body. Raises ValueError if the
+    body isn't JSON of that shape.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buf = u''
+    pos = None
+    marker = u'"%s"' % key
+    chunks = iter(chunks)
+    finished = False
+
+    while True:
+        if pos is None:
+            #Still looking for the start of the array.
+            found = buf.find(marker)
+            if found != -1:
+                bracket = buf.find(u'[', found + len(marker))
+                if bracket != -1:
+                    if buf[found + len(marker):bracket].strip() != u':':
+                        raise ValueError('Expected an array under %r.' % key)
+                    buf = buf[bracket + 1:]
+                    pos = 0
+                    continue
+        else:
+            while pos < len(buf) and buf[pos] in u' \t\r\n,':
+                pos += 1
+            if buf[pos:pos + 1] == u']':
+                return
+            if pos < len(buf):
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if finished:
+                        raise
+                else:
+                    yield item
+                    buf = buf[end:]
+                    pos = 0
+                    continue
+        if finished:
+            raise ValueError('The response ended before the %r array did.' % key)
+        try:
+            buf += text.decode(next(chunks))
+        except StopIteration:
+            buf += text.decode(b'', True)
+            finished = True
+
+
+class WebSearchClient(object):
+    """
+    Web search over a Bing style JSON API through one pooled session.
+    A search fetches `pages` result pages in parallel, every request with
+    connect and read timeouts and retried with exponential backoff on
+    connection errors and 5xx/429 answers. Nothing raises: failures end
+    up in SearchResults.errors.
+    """
+
+    def __init__(self, url=URL, key='', pages=PAGES, per_page=PER_PAGE, timeout=TIMEOUT,
+                 deadline=DEADLINE, retries=3, backoff=0.5):
+        self.url = url
+        self.key = key
+        self.pages = pages
+        self.per_page = per_page
+        self.timeout = timeout
+        self.deadline = deadline
+        self.session = requests.Session()
+        retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=backoff,
+                      status_forcelist=RETRY_STATUSES)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pages, 1) * 2, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(max(self.pages, 1) * 2)
+        return self._pool
+
+    def search(self, terms, pages=None):
+        pages = pages or self.pages
+        started = time.time()
+        pending = [self.pool.apply_async(self.fetch_page, (terms, page)) for page in range(pages)]
+
+        results, errors = [], []
+        for page, reply in enumerate(pending):
+            try:
+                found, error = reply.get(max(self.deadline - (time.time() - started), 0))
+            except TimeoutError:
+                found, error = [], 'gave up after %ss' % self.deadline
+            results += found
+            if error:
+                errors.append('page %d: %s' % (page + 1, error))
+        if errors:
+            logger.warning('Web search for %r: %s', terms, '; '.join(errors))
+        return SearchResults(results, errors)
+
+    def fetch_page(self, terms, page):
+        """One page of results as (results, None), or whatever arrived and an error message."""
+        results = []
+        params = {
+            #The API wants the query in single quotes.
+            'Query': u"'%s'" % terms.replace(u"'", u"''"),
+            '$format': 'json',
+            '$top': self.per_page,
+            '$skip': page * self.per_page,
+        }
+        try:
+            response = self.session.get(self.url, params=params, auth=('', self.key),
+                                        timeout=self.timeout, stream=True)
+            try:
+                response.raise_for_status()
+                for result in iter_array(response.iter_content(8192)):
+                    results.append({
+                        'title': result.get('Title', ''),
+                        'link': result.get('Url', ''),
+                        'summary': result.get('Description', '')})
+            finally:
+                response.close()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return results, str(e) or e.__class__.__name__
+        return results, None
+
+    def close(self):
+        self.session.close()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+class _Flight(object):
+    #One fetch in progress, the callers that missed on the same key wait on it.
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class RevalidatingCache(object):
+    """
+    Keeps the last `size` answers of fetch(terms), least recently used
+    dropped first. An answer younger than ttl is returned as is. One up to
+    stale_ttl older is returned straight away too, while a single
+    background fetch replaces it. Older than that it is a miss.
+
+    Concurrent misses on the same terms share one fetch. Answers with
+    errors are not stored, and a failed refresh leaves the stale answer
+    in place.
+    """
+
+    def __init__(self, fetch, size=1000, ttl=3600, stale_ttl=86400):
+        self.fetch = fetch
+        self.size = size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._refreshing = set()
+        self._stats = dict.fromkeys(['hits', 'stale_hits', 'misses', 'coalesced', 'refreshes', 'errors'], 0)
+
+    def key(self, terms):
+        return u' '.join(terms.lower().split())
+
+    def get(self, terms):
+        key = self.key(terms)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fetched = entry
+                age = now - fetched
+                if age < self.ttl + self.stale_ttl:
+                    self._entries[key] = self._entries.pop(key)
+                    if age < self.ttl:
+                        self._stats['hits'] += 1
+                    else:
+                        self._stats['stale_hits'] += 1
+                        if key not in self._refreshing:
+                            self._refreshing.add(key)
+                            refresh = threading.Thread(target=self._refresh, args=(key, terms))
+                            refresh.daemon = True
+                            refresh.start()
+                    return self._copy(value)
+                del self._entries[key]
+
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats['coalesced'] += 1
+                leader = False
+            else:
+                self._stats['misses'] += 1
+                flight = self._flights[key] = _Flight()
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self._copy(flight.value)
+
+        try:
+            flight.value = self._fetch(key, terms)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return self._copy(flight.value)
+
+    def _refresh(self, key, terms):
+        try:
+            with self._lock:
+                self._stats['refreshes'] += 1
+            self._fetch(key, terms)
+        except Exception:
+            logger.exception('Refreshing the web search for %r failed.', terms)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _fetch(self, key, terms):
+        value = self.fetch(terms)
+        with self._lock:
+            if getattr(value, 'errors', None):
+                self._stats['errors'] += 1
+            else:
+                self._entries.pop(key, None)
+                self._entries[key] = (value, time.time())
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return value
+
+    def _copy(self, value):
+        #Callers get their own list, the cached one stays as fetched.
+        if isinstance(value, SearchResults):
+            return SearchResults(value, value.errors)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries), max_size=self.size,
+                        ttl=self.ttl, stale_ttl=self.stale_ttl)
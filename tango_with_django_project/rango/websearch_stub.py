@@ -0,0 +1,123 @@
+"""
+A stand-in for the web search API, for tests and for trying the client
+without a key:
+
+    server = StubSearchServer(delay=0.1)
+    server.start()
+    client = WebSearchClient(server.url)
+    ...
+    server.stop()
+
+Or run it with `python -m rango.websearch_stub 8001`.
+"""
+import json
+import socket
+import sys
+import threading
+import time
+
+from django.utils.six.moves import BaseHTTPServer, socketserver
+from django.utils.six.moves.urllib.parse import parse_qs, urlparse
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        #Clients that timed out and hung up are part of the job.
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+class StubSearchServer(object):
+    """
+    Answers GET /Web?Query='terms'&$top=n&$skip=m with n made up results
+    in the API's {"d": {"results": [...]}} shape, `total` in all. It can
+    be told to be slow (delay), to fail the next `fail` requests with
+    `status`, or to send a broken body. requests, and the most it saw in
+    flight at once, are counted.
+    """
+
+    def __init__(self, total=100, delay=0, port=0):
+        self.total = total
+        self.delay = delay
+        self.fail = 0
+        self.status = 503
+        self.broken = False
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._server = _Server(('127.0.0.1', port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/Web' % self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        #Cut short any delay and let the requests being answered finish.
+        self._stopping.set()
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        for i in range(100):
+            if not self.in_flight:
+                break
+            time.sleep(0.01)
+
+    def results(self, terms, skip, top):
+        return [{'Title': u'%s result %d' % (terms, i),
+                 'Url': u'http://example.com/%d' % i,
+                 'Description': u'Result %d for %s' % (i, terms)}
+                for i in range(skip, min(skip + top, self.total))]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                    failing = stub.fail > 0
+                    if failing:
+                        stub.fail -= 1
+                try:
+                    stub._stopping.wait(stub.delay)
+                    if failing:
+                        self.send_error(stub.status)
+                        return
+                    query = parse_qs(urlparse(self.path).query)
+                    terms = query.get('Query', ["''"])[0].strip("'")
+                    body = json.dumps({'d': {'results': stub.results(
+                        terms, int(query.get('$skip', [0])[0]), int(query.get('$top', [10])[0]))}})
+                    if stub.broken:
+                        body = body[:len(body) // 2]
+                    body = body.encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    server = StubSearchServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8001)
+    print('Serving stub web search at %s' % server.url)
+    server._server.serve_forever()
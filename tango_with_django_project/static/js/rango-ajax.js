@@ -9,6 +9,24 @@ $(document).ready(function() {
         });
     });
 
+    $('#more_pages').click(function(event){
+        var link = $(this);
+        event.preventDefault();
+        $.getJSON(link.attr('data-source'), {after: link.attr('data-next')}, function(data){
+            $.each(data.pages, function(i, page){
+                var item = $('<li class="list-group-item"></li>');
+                item.append($('<a></a>').attr('href', page.goto).text(page.title));
+                item.append(document.createTextNode(' - ' + page.views + ' view/s'));
+                $('#page_list').append(item);
+            });
+            if (data.next) {
+                link.attr('data-next', data.next).attr('href', '?after=' + data.next);
+            } else {
+                link.hide();
+            }
+        });
+    });
+
     $('#suggestion').keyup(function(){
         var query;
         query = $(this).val();
@@ -37,6 +37,10 @@ STATIC_PATH = os.path.join(BASE_DIR, 'static')
 STATIC_URL = '/static/'
 STATICFILES_DIRS = (
     STATIC_PATH,)
+# `manage.py collectstatic` fingerprints and precompresses the files into STATIC_ROOT,
+# rango.middleware.StaticAssetMiddleware serves them.
+STATIC_ROOT = os.path.join(BASE_DIR, 'static_collected')
+STATICFILES_STORAGE = 'rango.static_assets.CompressedManifestStaticFilesStorage'
 
 ALLOWED_HOSTS = []
 
@@ -60,8 +64,11 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'rango.middleware.StaticAssetMiddleware',
+    'rango.middleware.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'rango.middleware.VisitTrackingMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
@@ -109,12 +116,60 @@ LOGIN_REDIRECT_URL = '/rango/'  #The page you want users to arrive at after they
 LOGIN_URL = '/accounts/login'   #The age users are directed to if they are not logged in,
                                 # and they try to access a page requiring auth.
 
+# The embedded SQLite FTS5 engine needs no server. For big catalogues point
+# 'default' at the Elasticsearch settings below; `manage.py bench_search
+# default elasticsearch` compares the two.
 HAYSTACK_CONNECTIONS = {
     'default': {
+        'ENGINE': 'rango.fts_backend.FTSEngine',
+        'PATH': os.path.join(BASE_DIR, 'search.sqlite3'),
+    },
+    'elasticsearch': {
         'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
         'URL': 'http://127.0.0.1:9200/',
         'INDEX_NAME': 'haystack',
     },
 }
 
-CRISPY_TEMPLATE_PACK = 'bootstrap3'
\ No newline at end of file
+# Saves and deletes are queued in the db, `manage.py process_search_queue --loop` indexes them.
+HAYSTACK_SIGNAL_PROCESSOR = 'rango.search_signals.QueuedSignalProcessor'
+
+CRISPY_TEMPLATE_PACK = 'bootstrap3'
+
+# Views going over their query budgets fail the tests, see rango.query_budget.
+TEST_RUNNER = 'rango.query_budget.QueryBudgetTestRunner'
+
+# Rango tuning
+
+RANGO_VIEW_FLUSH_INTERVAL = 5   #Seconds between writes of buffered page views to the db.
+RANGO_VIEW_FLUSH_SIZE = 100     #Buffered clicks that trigger an early write.
+RANGO_PAGE_URL_TIMEOUT = 300    #Seconds a page's url stays cached for /goto/ redirects.
+RANGO_LIKE_SHARDS = 8           #Counter rows per category for likes, see rango.likes.
+                                #Run `manage.py compact_likes` from cron to fold shards into Category.likes.
+RANGO_SUGGEST_TOP_K = 8         #Most liked categories kept per prefix for the autocomplete.
+RANGO_SUGGEST_MAX_AGE = 300     #Seconds before a process rebuilds its autocomplete index from the db.
+RANGO_SIDEBAR_CATEGORIES = 50   #Most liked categories listed in the sidebar.
+RANGO_SIDEBAR_TIMEOUT = 60      #Seconds an unused rendered sidebar is kept in the cache.
+RANGO_LEADERBOARD_SIZE = 5      #Categories and pages listed on the index page.
+RANGO_LEADERBOARD_MAX_AGE = 60  #Seconds before a process reloads its leaderboards from the db.
+RANGO_CATEGORY_PAGE_SIZE = 50   #Pages listed per screen on a category page.
+RANGO_VISIT_WINDOW = 86400      #Seconds after a counted visit before the next hit counts as a new one.
+RANGO_SEARCH_CACHE_SIZE = 500   #Pages of /search/ results kept per process, least recently used dropped first.
+RANGO_SEARCH_CACHE_TTL = 300    #Seconds a page of search results is reused.
+RANGO_WEB_SEARCH_PAGES = 3      #Result pages the web search client fetches in parallel per query.
+RANGO_WEB_SEARCH_TIMEOUT = (3.05, 10)   #Connect and read timeouts for each web search request.
+RANGO_WEB_SEARCH_DEADLINE = 15  #Seconds before a web search returns whatever pages arrived.
+RANGO_WEB_SEARCH_CACHE_SIZE = 1000  #Web search answers kept per process.
+RANGO_WEB_SEARCH_CACHE_TTL = 3600   #Seconds a web search answer is served without asking the API again.
+RANGO_WEB_SEARCH_STALE_TTL = 86400  #Seconds after that it is still served while being refreshed in the background.
+RANGO_THUMBNAIL_SIZES = (64, 128, 256)  #Square thumbnails made of every profile picture, JPEG and WebP.
+RANGO_THUMBNAIL_WORKERS = 2     #Threads making thumbnails after uploads, 0 makes them during the request.
+RANGO_UPLOAD_MAX_SIZE = 5 * 1024 * 1024 #Bytes, bigger profile pictures are refused without being kept, see rango.uploads.
+RANGO_STATIC_MAX_AGE = 300       #Seconds static files requested by their unfingerprinted names may be cached.
+RANGO_MEDIA_OFFLOAD = None      #'x-accel-redirect' (nginx) or 'x-sendfile' to let the front proxy send /media/ files.
+RANGO_MEDIA_ACCEL_PREFIX = '/protected-media/'  #Internal nginx location aliasing MEDIA_ROOT, for x-accel-redirect.
+RANGO_MEDIA_MAX_AGE = 3600      #Seconds browsers may cache /media/ files.
+RANGO_METRICS = True            #Time every request for /rango/_metrics, see rango.metrics.
+RANGO_PAGE_CACHE_TIMEOUT = 600  #Seconds an anonymous index or category page is kept unvisited, see rango.page_cache.
+RANGO_PAGE_CACHE_WAIT = 5       #Seconds a request waits for another one rendering the same page before rendering it too.
+RANGO_QUERY_BUDGETS = 'warn'    #Over a view's query budget: 'warn' logs it, 'raise' (tests) raises, None doesn't check.
@@ -1,6 +1,12 @@
 from django.conf import settings
 from django.conf.urls import patterns, include, url
 from django.contrib import admin
+from haystack.query import SearchQuerySet
+from haystack.views import RESULTS_PER_PAGE
+from rango import media
+from rango.query_budget import query_budget
+from rango.uploads import hashed_uploads
+from rango.views import PAGE_QUERIES, PAGE_ROWS, CachedSearchView
 from tango_with_django_project import views
 
 urlpatterns = patterns('',
@@ -10,14 +16,11 @@ urlpatterns = patterns('',
 
     url(r'^admin/', include(admin.site.urls)),
     url(r'^rango/', include('rango.urls')),
-    url(r'^search/$', include('haystack.urls')),
-    url(r'^accounts/register/$', views.MyRegistrationView.as_view(), name='registration_register'),
+    url(r'^search/$', query_budget(queries=PAGE_QUERIES + 2, rows=PAGE_ROWS + RESULTS_PER_PAGE, name='haystack_search')(
+        CachedSearchView(searchqueryset=SearchQuerySet().highlight())), name='haystack_search'),
+    url(r'^accounts/register/$', query_budget(queries=PAGE_QUERIES + 12, rows=PAGE_ROWS + 2)(
+        hashed_uploads(views.MyRegistrationView.as_view())), name='registration_register'),
     (r'^accounts/', include('registration.backends.simple.urls')),
-)
-
-if settings.DEBUG:
-    urlpatterns += patterns(
-        'django.views.static',
-        (r'^media/(?P<path>.*)',
-        'serve',
-        {'document_root': settings.MEDIA_ROOT}), )
\ No newline at end of file
+    #Served in production too, with ranges and sendfile, see rango.media.
+    url(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), media.serve, name='media'),
+)
\ No newline at end of file
@@ -3,6 +3,7 @@
 from registration.backends.simple.views import RegistrationView
 from rango.forms import UserProfileRegistrationForm
 from rango.models import UserProfile
+from rango import thumbnails
 
 class MyRegistrationView(RegistrationView):
     
@@ -15,6 +16,7 @@ class MyRegistrationView(RegistrationView):
         user_profile.website = form_class.cleaned_data['website']
         user_profile.picture = form_class.cleaned_data['picture']
         user_profile.save()
+        thumbnails.schedule(user_profile)
         return user_profile
     
     def get_success_url(self, request, user):
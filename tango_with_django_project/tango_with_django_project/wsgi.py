@@ -12,3 +12,11 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tango_with_django_project.setti
 
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
+
+#Build the in-memory category suggestions before the first request needs them.
+from django.db import DatabaseError
+from rango.suggest import category_index
+try:
+    category_index.ensure_built()
+except DatabaseError:
+    pass #Not migrated yet, the index is built on first use instead.